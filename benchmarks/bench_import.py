@@ -0,0 +1,58 @@
+'''
+Benchmarks the cold import time and memory of the dlpy modules, each in a fresh interpreter.
+
+Run with
+    python -m benchmarks.bench_import
+'''
+import json
+import subprocess
+import sys
+
+MODULES = ("dlpy.maths", "dlpy.percentile", "dlpy.weighted_calcs", "dlpy.likert", "dlpy.ap.scoring",
+           "dlpy.ap.optimize", "dlpy.ap.report")
+
+# Runs in the fresh interpreter, numpy is loaded first so we only measure what dlpy adds on top
+_CODE = '''
+import json, resource, sys, time
+import numpy
+before = set(sys.modules)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+__import__({module!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    "heavy": sorted(m for m in ("matplotlib", "pandas", "scipy") if m in sys.modules and m not in before)
+}}))
+'''
+
+
+def measure(module, repeat=3):
+    '''
+    Imports module in repeat fresh interpreters
+    :param module: The dotted module name
+    :param repeat: How many interpreters to try
+    :return: The result dict of the fastest import, with keys seconds, maxrss_kb and heavy
+    '''
+    results = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, "-c", _CODE.format(module=module)],
+                                capture_output=True, text=True, check=True)
+        results.append(json.loads(output.stdout))
+    return min(results, key=lambda result: result["seconds"])
+
+
+def main(modules=MODULES):
+    print("{:>20} {:>12} {:>12}  {}".format("module", "import (s)", "rss (KB)", "heavy modules loaded"))
+    rval = {}
+    for module in modules:
+        result = measure(module)
+        rval[module] = result
+        print("{:>20} {:>12.4f} {:>12}  {}".format(module, result["seconds"], result["maxrss_kb"],
+                                                  ", ".join(result["heavy"]) or "-"))
+    return rval
+
+
+if __name__ == "__main__":
+    main()
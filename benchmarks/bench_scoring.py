@@ -0,0 +1,26 @@
+'''
+Benchmarks the partial ranking used by the scoring module against a full sort.
+
+Run with
+    python -m benchmarks.bench_scoring
+'''
+import numpy as np
+from benchmarks.harness import best_time
+from dlpy.ap.scoring import RankScoringV1, top_ranked
+
+
+def main(sizes=(10**3, 10**4, 10**5, 10**6, 10**7)):
+    rng = np.random.default_rng(0)
+    print("{:>10} {:>14} {:>14} {:>8}".format("n", "argsort (s)", "top_ranked (s)", "speedup"))
+    for nitems in sizes:
+        scores = rng.random(nitems)
+        rks = RankScoringV1.standard(scores)
+        count = rks.max_out_of()
+        assert np.array_equal(top_ranked(scores, count), np.argsort(scores, kind="stable")[0:count])
+        full = best_time(lambda: np.argsort(scores, kind="stable")[0:count])
+        partial = best_time(lambda: top_ranked(scores, count))
+        print("{:>10} {:>14.6f} {:>14.6f} {:>8.1f}".format(nitems, full, partial, full / partial))
+
+
+if __name__ == "__main__":
+    main()
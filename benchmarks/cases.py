@@ -0,0 +1,179 @@
+'''
+The benchmark cases for the dlpy hot paths.  Each case builds its data for a size and
+returns the function to time.  The pure python paths are capped at the sizes where they
+still finish in reasonable time.
+
+Each case's peak memory is recorded with its time (see harness.peak_memory).  The transform
+cases write into a preallocated out= buffer, so their peak is just the temporaries: for
+GcpCurve.transform and likert_transform that is bounded by the chunk size, not by n.  The
+[float32] variants show what calculating in float32 saves, and the [threads] ones what splitting
+the work over a thread per cpu (see dlpy.threads) saves.
+'''
+import os
+import numpy as np
+from benchmarks.harness import case
+from dlpy.maths import pw_linear, pw_linear_many, pad_pts
+from dlpy.percentile import std_perc, std_percs, gcp, gcp_inverse, gcp_approx_pts, gcp_grouped, GcpCurve
+from dlpy.likert import cluster_simple, likert_using_zscores, likert_using_percentile, \
+    likert_using_small_count, likert_using_default, likert_transform
+from dlpy.ap.scoring import RankScoringV1, top_ranked
+from dlpy.weighted_calcs import wtd_mean, wtd_median
+
+_PTS = [(x, x / 10.0) for x in range(1, 10)]
+
+
+@case("maths.pw_linear", max_size=10**5)
+def _pw_linear(nitems, rng):
+    xs = rng.uniform(-5, 15, nitems).tolist()
+    return lambda: [pw_linear(x, _PTS, 0, 1) for x in xs]
+
+
+@case("maths.pw_linear_many", max_size=10**6)
+def _pw_linear_many(nitems, rng):
+    # nitems values spread over 10 curves
+    pts, lengths = pad_pts([_PTS] * 10)
+    X = rng.uniform(-5, 15, (max(nitems // 10, 1), 10))
+    return lambda: pw_linear_many(X, pts, lengths, 0, 1)
+
+
+@case("maths.pw_linear_many[float32]", max_size=10**6)
+def _pw_linear_many_float32(nitems, rng):
+    pts, lengths = pad_pts([_PTS] * 10)
+    X = rng.uniform(-5, 15, (max(nitems // 10, 1), 10)).astype(np.float32)
+    out = np.empty(X.shape, dtype=np.float32)
+    return lambda: pw_linear_many(X, pts, lengths, 0, 1, out=out, dtype=np.float32)
+
+
+@case("percentile.gcp", max_size=10**6)
+def _gcp(nitems, rng):
+    X = rng.random(nitems).tolist()
+    return lambda: gcp(X, 0.5)
+
+
+@case("percentile.gcp_inverse", max_size=10**6)
+def _gcp_inverse(nitems, rng):
+    X = rng.random(nitems).tolist()
+    return lambda: gcp_inverse(X, 0.5)
+
+
+@case("percentile.gcp_approx_pts", max_size=10**5)
+def _gcp_approx_pts(nitems, rng):
+    X = rng.random(nitems).tolist()
+    return lambda: gcp_approx_pts(X, 0.01)
+
+
+@case("percentile.gcp_grouped")
+def _gcp_grouped(nitems, rng):
+    X = rng.random(nitems)
+    keys = rng.integers(0, 100, nitems)
+    return lambda: gcp_grouped(X, keys)
+
+
+@case("percentile.GcpCurve.transform")
+def _gcp_curve_transform(nitems, rng):
+    curve = GcpCurve.fit(rng.random(10**4))
+    S = rng.uniform(-0.1, 1.1, nitems)
+    out = np.empty(nitems)
+    return lambda: curve.transform(S, out)
+
+
+@case("percentile.GcpCurve.transform[float32]")
+def _gcp_curve_transform_float32(nitems, rng):
+    curve = GcpCurve.fit(rng.random(10**4))
+    S = rng.uniform(-0.1, 1.1, nitems).astype(np.float32)
+    out = np.empty(nitems, dtype=np.float32)
+    return lambda: curve.transform(S, out, dtype=np.float32)
+
+
+@case("percentile.GcpCurve.transform[threads]")
+def _gcp_curve_transform_threads(nitems, rng):
+    curve = GcpCurve.fit(rng.random(10**4))
+    S = rng.uniform(-0.1, 1.1, nitems)
+    out = np.empty(nitems)
+    return lambda: curve.transform(S, out, n_threads=os.cpu_count() or 1)
+
+
+@case("percentile.std_perc", max_size=10**6)
+def _std_perc(nitems, rng):
+    X = rng.random(nitems).tolist()
+    return lambda: std_perc(X, 0.5)
+
+
+@case("percentile.std_percs")
+def _std_percs(nitems, rng):
+    X = rng.random(nitems)
+    return lambda: std_percs(X)
+
+
+@case("likert.cluster_simple", max_size=10**5)
+def _cluster_simple(nitems, rng):
+    X = rng.random(nitems)
+    return lambda: cluster_simple(X, 0.01, 0.09)
+
+
+@case("likert.likert_using_zscores", max_size=10**5)
+def _likert_using_zscores(nitems, rng):
+    X = rng.random(nitems)
+    return lambda: likert_using_zscores(X)
+
+
+@case("likert.likert_using_percentile", max_size=10**5)
+def _likert_using_percentile(nitems, rng):
+    X = rng.random(nitems)
+    return lambda: likert_using_percentile(X)
+
+
+@case("likert.likert_using_small_count", max_size=10**5)
+def _likert_using_small_count(nitems, rng):
+    # Few distinct values, or the small count algorithm does not apply
+    X = rng.integers(0, 10, nitems)
+    return lambda: likert_using_small_count(X)
+
+
+@case("likert.likert_using_default", max_size=10**5)
+def _likert_using_default(nitems, rng):
+    X = rng.random(nitems)
+    return lambda: likert_using_default(X)
+
+
+@case("likert.likert_transform")
+def _likert_transform(nitems, rng):
+    X = rng.integers(0, 1000, nitems).astype(float)
+    out = np.empty(nitems, dtype=np.int8)
+    return lambda: likert_transform(X, out)
+
+
+@case("scoring.grade")
+def _grade(nitems, rng):
+    scores = rng.random(nitems)
+    plan = (rng.random(nitems) < 0.3).astype(int)
+    rks = RankScoringV1.standard(scores)
+    return lambda: rks.grade(scores, plan)
+
+
+@case("scoring.best_plan_not_above", max_size=10**6)
+def _best_plan_not_above(nitems, rng):
+    scores = rng.random(nitems)
+    rks = RankScoringV1.standard(scores)
+    return lambda: rks.best_plan_not_above(scores)
+
+
+@case("scoring.top_ranked")
+def _top_ranked(nitems, rng):
+    scores = rng.random(nitems)
+    count = RankScoringV1.standard(scores).max_out_of()
+    return lambda: top_ranked(scores, count)
+
+
+@case("weighted_calcs.wtd_mean")
+def _wtd_mean(nitems, rng):
+    values = rng.random(nitems)
+    weights = rng.random(nitems)
+    return lambda: wtd_mean(values, weights)
+
+
+@case("weighted_calcs.wtd_median")
+def _wtd_median(nitems, rng):
+    values = rng.random(nitems)
+    weights = rng.random(nitems)
+    return lambda: wtd_median(values, weights)
@@ -0,0 +1,167 @@
+'''
+The shared machinery for the benchmarks: a registry of cases, timing, peak memory and the
+JSON history that runs are appended to so they can be compared offline.
+'''
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+
+SIZES = (10**2, 10**3, 10**4, 10**5, 10**6, 10**7)
+HISTORY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "history.json")
+
+# The registered cases, in the order they were registered
+CASES = []
+
+
+class Case:
+    '''
+    A single benchmark.  setup(nitems, rng) builds the data and returns a function of no
+    arguments that does the work being measured.
+    '''
+    def __init__(self, name, setup, max_size=SIZES[-1]):
+        self.name = name
+        self.setup = setup
+        self.max_size = max_size
+
+    def sizes(self, sizes=SIZES):
+        return [nitems for nitems in sizes if nitems <= self.max_size]
+
+
+def case(name, max_size=SIZES[-1]):
+    '''
+    Decorator that registers a setup function as a benchmark case
+    :param name: The name the results are recorded under
+    :param max_size: The largest size it is feasible to run this case at
+    '''
+    def register(setup):
+        CASES.append(Case(name, setup, max_size))
+        return setup
+    return register
+
+
+def best_time(func, repeat=5, max_seconds=2.0):
+    '''
+    Runs func up to repeat times and returns the fastest wall time in seconds.  We stop
+    repeating once max_seconds have been spent, but always run at least once.
+    :param func: A function taking no arguments
+    :param repeat: How many times to run it
+    :param max_seconds: The time budget for the repeats
+    :return:
+    '''
+    best = np.inf
+    spent = 0.0
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent > max_seconds:
+            break
+    return best
+
+
+def peak_memory(func):
+    '''
+    Runs func once under tracemalloc
+    :param func: A function taking no arguments
+    :return: The peak number of bytes allocated while it ran
+    '''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(bench, nitems, repeat=5, seed=0):
+    '''
+    Measures a case at one size
+    :param bench: The Case to run
+    :param nitems: The size of the data
+    :param repeat: How many times to repeat the timing
+    :param seed: The seed for the random data
+    :return: A result dict with the name, n, seconds, items_per_second and peak_bytes
+    '''
+    func = bench.setup(nitems, np.random.default_rng(seed))
+    seconds = best_time(func, repeat)
+    return {
+        "name": bench.name,
+        "n": nitems,
+        "seconds": seconds,
+        "items_per_second": nitems / seconds if seconds > 0 else np.inf,
+        "peak_bytes": peak_memory(func)
+    }
+
+
+def _git_revision():
+    try:
+        output = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        return output.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def describe_environment():
+    '''
+    :return: A dict describing what the benchmarks ran on, stored with each run
+    '''
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor()
+    }
+
+
+def load_history(path=HISTORY_PATH):
+    '''
+    :param path: The history file
+    :return: The list of runs recorded so far, oldest first
+    '''
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def append_history(run, path=HISTORY_PATH):
+    '''
+    Adds a run to the end of the history file
+    :param run: A dict with the keys of describe_environment() plus "label" and "results"
+    :param path: The history file
+    :return: The index of the run in the history
+    '''
+    history = load_history(path)
+    history.append(run)
+    with open(path, "w") as f:
+        json.dump(history, f, indent=1)
+    return len(history) - 1
+
+
+def compare_runs(old, new):
+    '''
+    Lines up the results of two runs
+    :param old: The baseline run
+    :param new: The run to compare against it
+    :return: A list of (name, n, old seconds, new seconds, new/old time ratio, old peak bytes,
+    new peak bytes) for each (name, n) measured in both runs
+    '''
+    old_results = {(result["name"], result["n"]): result for result in old["results"]}
+    rval = []
+    for result in new["results"]:
+        key = (result["name"], result["n"])
+        if key in old_results:
+            before = old_results[key]
+            rval.append((key[0], key[1], before["seconds"], result["seconds"],
+                         result["seconds"] / before["seconds"], before["peak_bytes"], result["peak_bytes"]))
+    return rval
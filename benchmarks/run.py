@@ -0,0 +1,85 @@
+'''
+Runs the benchmark suite and records the results, or compares two recorded runs.
+
+Run with
+    python -m benchmarks.run                      # everything, appended to benchmarks/history.json
+    python -m benchmarks.run --max-size 100000 --only likert
+    python -m benchmarks.run list                 # the recorded runs
+    python -m benchmarks.run compare              # the last run against the one before it
+    python -m benchmarks.run compare 0 3          # run 3 against run 0
+'''
+import argparse
+import sys
+from benchmarks.harness import CASES, SIZES, HISTORY_PATH, run_case, describe_environment, load_history, \
+    append_history, compare_runs
+import benchmarks.cases  # noqa: F401, registers the cases
+
+
+def run(args):
+    sizes = [nitems for nitems in SIZES if nitems <= args.max_size]
+    selected = [bench for bench in CASES if (args.only is None) or (args.only in bench.name)]
+    results = []
+    print("{:>34} {:>10} {:>12} {:>14} {:>12}".format("case", "n", "time (s)", "items/s", "peak (MB)"))
+    for bench in selected:
+        for nitems in bench.sizes(sizes):
+            result = run_case(bench, nitems, repeat=args.repeat)
+            results.append(result)
+            print("{:>34} {:>10} {:>12.6f} {:>14.4g} {:>12.2f}".format(
+                result["name"], result["n"], result["seconds"], result["items_per_second"],
+                result["peak_bytes"] / 2**20))
+            sys.stdout.flush()
+    run_record = describe_environment()
+    run_record["label"] = args.label
+    run_record["results"] = results
+    if not args.no_save:
+        index = append_history(run_record, args.history)
+        print("Recorded as run {} in {}".format(index, args.history))
+
+
+def list_runs(args):
+    for index, run_record in enumerate(load_history(args.history)):
+        print("{:>4}  {}  {:<10} {:<20} {} results".format(index, run_record["timestamp"], run_record["revision"] or "-",
+                                                         run_record["label"] or "", len(run_record["results"])))
+
+
+def compare(args):
+    history = load_history(args.history)
+    if len(history) < 2:
+        raise Exception("Need at least 2 recorded runs to compare")
+    old, new = history[args.old], history[args.new]
+    print("{:>34} {:>10} {:>12} {:>12} {:>8} {:>12} {:>12}".format(
+        "case", "n", "old (s)", "new (s)", "ratio", "old (MB)", "new (MB)"))
+    for name, nitems, old_seconds, new_seconds, ratio, old_peak, new_peak in compare_runs(old, new):
+        flag = "  slower" if ratio > 1 + args.threshold else ("  faster" if ratio < 1 - args.threshold else "")
+        print("{:>34} {:>10} {:>12.6f} {:>12.6f} {:>8.2f} {:>12.2f} {:>12.2f}{}".format(
+            name, nitems, old_seconds, new_seconds, ratio, old_peak / 2**20, new_peak / 2**20, flag))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="dlpy benchmarks")
+    parser.add_argument("--history", default=HISTORY_PATH, help="The JSON file runs are recorded in")
+    commands = parser.add_subparsers(dest="command")
+    run_parser = commands.add_parser("run", help="Run the benchmarks (the default)")
+    list_parser = commands.add_parser("list", help="List the recorded runs")
+    compare_parser = commands.add_parser("compare", help="Compare two recorded runs")
+    for sub_parser in (run_parser, parser):
+        sub_parser.add_argument("--max-size", type=int, default=SIZES[-1], help="The largest size to run")
+        sub_parser.add_argument("--only", default=None, help="Only run cases whose name contains this")
+        sub_parser.add_argument("--repeat", type=int, default=5, help="Timing repeats, the best is kept")
+        sub_parser.add_argument("--label", default=None, help="A note stored with the run")
+        sub_parser.add_argument("--no-save", action="store_true", help="Do not record the run")
+    compare_parser.add_argument("old", type=int, nargs="?", default=-2, help="The baseline run index")
+    compare_parser.add_argument("new", type=int, nargs="?", default=-1, help="The run index to compare")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="Flag ratios further than this from 1")
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        list_runs(args)
+    elif args.command == "compare":
+        compare(args)
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+'''
+Runs the dlpy batch command, see dlpy.cli
+'''
+from dlpy.cli import main
+
+if __name__ == "__main__":
+    main()
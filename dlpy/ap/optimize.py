@@ -0,0 +1,123 @@
+'''
+Searching for the best graded plan under a budget.
+
+The grade of a plan only depends on which of the top max(out_of) ranked
+projects are funded, so we never need to look at anything past that prefix.
+Within the prefix we build plans rank by rank, keeping only the plans that
+are not dominated (cheaper and at least as good for grading), and then grade
+the survivors.
+'''
+import numpy as np
+from dlpy.ap.scoring import power_weights
+
+
+def _pareto(labels):
+    '''
+    Removes dominated labels from a list of (cost, weight, bits) labels.  A label
+    is dominated if another label costs no more and has at least as much weight.
+    :param labels: The labels to prune
+    :return: The non-dominated labels, sorted by cost
+    '''
+    labels.sort(key=lambda label: (label[0], -label[1]))
+    rval = []
+    best_weight = -np.inf
+    for label in labels:
+        if label[1] > best_weight:
+            rval.append(label)
+            best_weight = label[1]
+    return rval
+
+
+def _plan_candidates(costs, weights, snapshots, budget=None):
+    '''
+    Builds all of the non-dominated plans on the ranked items, rank by rank.
+    :param costs: The cost of each ranked item, best ranked first
+    :param weights: The grading weight of each ranked item, best ranked first
+    :param snapshots: The prefix lengths (i.e. the out_of values) we need the plans for
+    :param budget: If not None, plans costing more than this are dropped
+    :return: A list of (cost, bits) where bits is the bitmask of funded ranks
+    '''
+    if (budget is not None) and (budget < 0):
+        return []
+    # Labels are keyed by the number of funded items, as the grade depends on that count
+    labels = {0: [(0.0, 0.0, 0)]}
+    rval = []
+    for rank in range(len(costs) + 1):
+        if rank in snapshots:
+            for count_labels in labels.values():
+                rval.extend([(cost, bits) for cost, weight, bits in count_labels])
+        if rank == len(costs):
+            break
+        new_labels = {}
+        for count, count_labels in labels.items():
+            new_labels.setdefault(count, []).extend(count_labels)
+            for cost, weight, bits in count_labels:
+                new_cost = cost + costs[rank]
+                if (budget is not None) and (new_cost > budget):
+                    continue
+                new_labels.setdefault(count + 1, []).append(
+                    (new_cost, weight + weights[rank], bits | (1 << rank))
+                )
+        labels = {count: _pareto(count_labels) for count, count_labels in new_labels.items()}
+    return rval
+
+
+def grade_frontier(scores, costs, rks, budget=None):
+    '''
+    Finds the grade versus budget efficient frontier, i.e. every plan that gets a strictly
+    better grade than any cheaper plan.
+    :param scores: The scores to grade upon
+    :param costs: The cost of funding each project
+    :param rks: The RankScoringV1 to grade with
+    :param budget: If not None, we do not look at plans costing more than this
+    :return: A list of (cost, grade, plan) tuples, sorted by increasing cost (and therefore
+    increasing grade).  The plan is a 0/1 list the same length as scores.
+    '''
+    nitems = len(scores)
+    prepared = rks.prepare(scores)
+    top_ix = prepared.ranked
+    top_n = len(top_ix)
+    top_costs = [float(costs[i]) for i in top_ix]
+    if rks.use_rank_interpolate:
+        weights = power_weights(top_n, rks.grade_decay_rate)
+    else:
+        # Only the count matters, so all plans with the same count only differ by cost
+        weights = [0.0] * top_n
+    snapshots = set([min(out_of, top_n) for out_of in
+                     (rks.a_out_of, rks.b_out_of, rks.c_out_of, rks.d_out_of)])
+    candidates = {}
+    for cost, bits in _plan_candidates(top_costs, weights, snapshots, budget):
+        candidates.setdefault(bits, cost)
+    # The grade of a plan only depends on the top ranked items, so we grade them all at once on those
+    all_bits = list(candidates.keys())
+    matrix = np.array([[(bits >> rank) & 1 for rank in range(top_n)] for bits in all_bits]).reshape(
+        (len(all_bits), top_n))
+    grades = prepared.grade_ranked(matrix)
+    graded = {bits: (candidates[bits], grade) for bits, grade in zip(all_bits, grades)}
+    rval = []
+    best_grade = -np.inf
+    for bits, (cost, grade) in sorted(graded.items(), key=lambda item: (item[1][0], -item[1][1])):
+        if grade > best_grade:
+            plan = [0] * nitems
+            for rank in range(top_n):
+                if (bits >> rank) & 1:
+                    plan[top_ix[rank]] = 1
+            rval.append((cost, grade, plan))
+            best_grade = grade
+    return rval
+
+
+def optimal_plan(scores, costs, budget, rks):
+    '''
+    Finds the best graded plan that fits in the budget.
+    :param scores: The scores to grade upon
+    :param costs: The cost of funding each project
+    :param budget: The most we can spend
+    :param rks: The RankScoringV1 to grade with
+    :return: A tuple (cost, grade, plan) of the cheapest plan with the best grade, or None
+    if nothing fits in the budget.
+    '''
+    frontier = grade_frontier(scores, costs, rks, budget)
+    if len(frontier) == 0:
+        return None
+    return frontier[-1]
@@ -0,0 +1,89 @@
+'''
+Renders RankScoringV1 charts to files in bulk.  Nothing here touches pyplot, every chart
+is drawn on a plain Agg figure, so this runs headless and in as many processes as you like.
+'''
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+GRADE_FIGSIZE = (8, 5)
+HEATMAP_FIGSIZE = (8, 2)
+
+# The figures we have already setup in this process, keyed by (figsize, dpi)
+_figures = {}
+
+
+def _axes_for(figsize, dpi):
+    '''
+    Gets a cleared Axes to draw in, reusing the figure from the last chart with the same size
+    :param figsize: The figure size in inches
+    :param dpi: The dots per inch
+    :return: The matplotlib Axes
+    '''
+    key = (tuple(figsize), dpi)
+    if key not in _figures:
+        fig = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(fig)
+        _figures[key] = fig.add_subplot()
+    ax = _figures[key]
+    ax.clear()
+    return ax
+
+
+def render_report(rks, scores, plan, path, kind="grade", grade=None, percents=None, figsize=None, dpi=100):
+    '''
+    Draws a single chart and saves it to a file
+    :param rks: The RankScoringV1 to grade with
+    :param scores: The scores to grade against
+    :param plan: The plan to grade
+    :param path: The file to write, the format comes from the extension, e.g. .png or .svg
+    :param kind: "grade" for the RankScoringV1.plot chart, or "heatmap" for RankScoringV1.plot_heatmap
+    :param grade: The result of rks.grade(scores, plan), if it has already been calculated
+    :param percents: The result of rks.percents(scores, plan), if it has already been calculated
+    :param figsize: The figure size in inches, if None we use GRADE_FIGSIZE or HEATMAP_FIGSIZE
+    :param dpi: The dots per inch
+    :return: The path written
+    '''
+    if grade is None:
+        grade = rks.grade(scores, plan)
+    if kind == "grade":
+        ax = _axes_for(figsize or GRADE_FIGSIZE, dpi)
+        if percents is None:
+            percents = rks.percents(scores, plan)
+        rks.plot(scores, plan, ax=ax, percents=percents, grade=grade)
+    elif kind == "heatmap":
+        ax = _axes_for(figsize or HEATMAP_FIGSIZE, dpi)
+        rks.plot_heatmap(scores, plan, ax=ax, grade=grade)
+    else:
+        raise Exception("Unknown report kind "+str(kind))
+    ax.figure.savefig(path)
+    return path
+
+
+def _render_job(rks, kind, figsize, dpi, job):
+    scores, plan, path = job[0:3]
+    grade = job[3] if len(job) > 3 else None
+    percents = job[4] if len(job) > 4 else None
+    return render_report(rks, scores, plan, path, kind, grade, percents, figsize, dpi)
+
+
+def render_reports(rks, jobs, kind="grade", processes=None, figsize=None, dpi=100, chunksize=16):
+    '''
+    Draws many charts and saves them to files, spread across a pool of processes.
+    :param rks: The RankScoringV1 to grade with
+    :param jobs: A list of (scores, plan, path) tuples, or (scores, plan, path, grade, percents) tuples
+    if the grades and percents have already been calculated.
+    :param kind: "grade" for the RankScoringV1.plot chart, or "heatmap" for RankScoringV1.plot_heatmap
+    :param processes: The number of processes to use, if None we use one per cpu.  If 1 we draw
+    everything in this process.
+    :param figsize: The figure size in inches, if None we use GRADE_FIGSIZE or HEATMAP_FIGSIZE
+    :param dpi: The dots per inch
+    :param chunksize: How many jobs to send to a process at a time
+    :return: The list of paths written, in the same order as jobs
+    '''
+    render = partial(_render_job, rks, kind, figsize, dpi)
+    if processes == 1:
+        return [render(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(render, jobs, chunksize=chunksize))
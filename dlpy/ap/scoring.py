@@ -1,10 +1,12 @@
 '''
 Here for different scoring mechanisms
 '''
+import sys
+from collections.abc import Mapping
+from functools import lru_cache
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as mtick
-from matplotlib.lines import Line2D
+from dlpy.instrument import instrumented
+from dlpy.chunked import as_array
 
 
 def decay_between(stepsToDecay, max_steps, lower, upper):
@@ -14,6 +16,26 @@ def decay_between(stepsToDecay, max_steps, lower, upper):
     slope = (upper - lower)/max_steps
     return lower + stepsToDecay*slope
 
+@lru_cache(maxsize=256)
+def power_weights(length, base=0.707):
+    '''
+    The power ranking weights [1, base, base**2, ..., base**(length-1)].  These are cached, so
+    the returned array is read only.
+    :param length: The number of weights
+    :param base: The base of the powers
+    :return: A read only numpy array of the weights
+    '''
+    rval = np.array([base**i for i in range(length)])
+    rval.flags.writeable = False
+    return rval
+
+
+@lru_cache(maxsize=256)
+def _lowest_total(length, min_count, base):
+    # The lowest possible total is funding the last min_count projects
+    return np.sum(power_weights(length, base)[(length-min_count):])
+
+
 def rank_interpolate(plan_subset, min_count, lower_grade, upper_grade,
                      best_plan_subset=None, base=0.707):
     """
@@ -27,20 +49,167 @@ def rank_interpolate(plan_subset, min_count, lower_grade, upper_grade,
     :param base:
     :return:
     """
-    if best_plan_subset is None:
-        best_plan_subset = [1]*len(plan_subset)
-    scores = [base**i for i in range(len(plan_subset))]
-    out_of = len(scores)
-    #The lowest possible total is funding the last min_count projects
-    lowest_scores = scores[(out_of-min_count):]
-    lowest_total = np.sum(lowest_scores)
-    highest_total= np.dot(scores, best_plan_subset)
+    return rank_interpolate_many([plan_subset], min_count, lower_grade, upper_grade,
+                                 best_plan_subset, base)[0]
+
+
+def rank_interpolate_many(plan_subsets, min_count, lower_grade, upper_grade,
+                          best_plan_subset=None, base=0.707, highest_total=None):
+    """
+    The same as rank_interpolate, but for many plan subsets at once.
+    :param plan_subsets: A 2d array-like, each row is the subset of a plan on the top_n projects, in order
+    :param min_count: The minimum count of on's we need to get our lowest_grade
+    :param lower_grade: The lowest grade possible it should get, with min_count
+    :param upper_grade: The highest grade possible it should get
+    :param best_plan_subset: The best plan possible.  If None, we set to [1]*top_n
+    :param base:
+    :param highest_total: The power total of best_plan_subset, if it has already been calculated
+    :return: A numpy array of the interpolated grades, one per row
+    """
+    plan_subsets = as_array(plan_subsets)
+    out_of = plan_subsets.shape[1]
+    scores = power_weights(out_of, base)
+    lowest_total = _lowest_total(out_of, min_count, base)
+    if highest_total is None:
+        if best_plan_subset is None:
+            highest_total = np.sum(scores)
+        else:
+            highest_total = np.dot(scores, np.asarray(best_plan_subset))
     # Now we can calculate our score
-    score = np.sum([score * status for score,status in zip(scores, plan_subset)])
+    score = plan_subsets.dot(scores)
     percent = (score - lowest_total)/(highest_total-lowest_total)
     rval = lower_grade + (upper_grade-lower_grade)*percent
     return rval
 
+@instrumented
+def top_ranked(scores, count):
+    '''
+    Finds the indices of the count best ranked (i.e. lowest) scores, in rank order.  This
+    gives the same result as np.argsort(scores, kind="stable")[0:count], with ties in index
+    order, but only partially sorts the scores, so it is O(n) instead of O(n log n) when count
+    is small compared to the number of scores.
+    :param scores: The scores to rank, anything that can be sorted
+    :param count: The number of top ranked indices we want
+    :return: A numpy array of the indices of the top count scores, best ranked first
+    '''
+    scores = as_array(scores)
+    nitems = len(scores)
+    if count <= 0:
+        return np.zeros(0, dtype=np.intp)
+    if (2 * count >= nitems) or (scores.dtype == object):
+        return np.argsort(scores, kind="stable")[0:count]
+    kth = np.partition(scores, count - 1)[count - 1]
+    if kth != kth:
+        # We have NaN's in the top count, comparisons won't work so we just sort
+        return np.argsort(scores, kind="stable")[0:count]
+    below = np.flatnonzero(scores < kth)
+    ties = np.flatnonzero(scores == kth)[0:(count - len(below))]
+    top = np.concatenate((below, ties))
+    return top[np.argsort(scores[top], kind="stable")]
+
+
+class SparsePlan:
+    '''
+    A plan that only stores the projects that are listed in it, every other project is
+    at the fill value (0, i.e. not funded, by default).  Useful when only a handful of a
+    very long list of projects are funded.
+    '''
+    def __init__(self, indices, amounts=None, nitems=None, fill=0):
+        '''
+        Constructor
+        :param indices: The indices of the listed (usually funded) projects
+        :param amounts: The amount each listed project is funded, 1 for fully funded.  If None
+        every listed project is fully funded.
+        :param nitems: The total number of projects.  If None it is one more than the largest index.
+        :param fill: The value of every project that is not listed
+        '''
+        indices = as_array(indices, np.intp).ravel()
+        if amounts is None:
+            amounts = np.ones(len(indices))
+        else:
+            amounts = as_array(amounts).ravel()
+        if np.any(indices[1:] < indices[:-1]):
+            order = np.argsort(indices, kind="stable")
+            indices = indices[order]
+            amounts = amounts[order]
+        self.indices = indices
+        self.amounts = amounts
+        if nitems is None:
+            nitems = int(indices[-1]) + 1 if len(indices) > 0 else 0
+        self.nitems = nitems
+        self.fill = fill
+
+    @staticmethod
+    def from_dict(funded, nitems=None):
+        '''
+        Creates a sparse plan from a mapping of project index to the fraction funded
+        :param funded: The mapping, e.g. {3: 1, 17: 0.5}
+        :param nitems: The total number of projects
+        :return:
+        '''
+        indices = list(funded.keys())
+        return SparsePlan(indices, [funded[i] for i in indices], nitems)
+
+    @staticmethod
+    def from_dense(plan):
+        '''
+        Creates a sparse plan from a regular list of 0-1 values
+        :param plan: The dense plan
+        :return:
+        '''
+        plan = as_array(plan)
+        indices = np.flatnonzero(plan)
+        return SparsePlan(indices, plan[indices], len(plan))
+
+    def values_at(self, indices):
+        '''
+        Looks up the plan values of several projects at once
+        :param indices: The project indices to look up
+        :return: A numpy array of the plan's value at each index
+        '''
+        indices = as_array(indices, np.intp)
+        pos = np.searchsorted(self.indices, indices)
+        found = pos < len(self.indices)
+        found[found] = self.indices[pos[found]] == indices[found]
+        rval = np.full(len(indices), self.fill, dtype=np.result_type(self.amounts, self.fill))
+        rval[found] = self.amounts[pos[found]]
+        return rval
+
+    def to_dense(self):
+        '''
+        :return: The plan as a regular list with one value per project
+        '''
+        return self.values_at(np.arange(self.nitems)).tolist()
+
+    def __len__(self):
+        return self.nitems
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return self.values_at(np.arange(*item.indices(self.nitems))).tolist()
+        if item < 0:
+            item += self.nitems
+        return self.values_at([item])[0]
+
+
+def plan_values(plan, indices):
+    '''
+    Looks up the values of a plan at the given project indices.
+    :param plan: A dense list of 0-1 values, a SparsePlan or a mapping of index to fraction funded
+    :param indices: The project indices to look up
+    :return: A list-like of the plan values, in the same order as indices
+    '''
+    if isinstance(plan, SparsePlan):
+        return plan.values_at(indices)
+    elif isinstance(plan, Mapping):
+        return [plan.get(i, 0) for i in indices]
+    elif isinstance(plan, (list, tuple)):
+        # Looking up a few values is cheaper than converting the whole list
+        return [plan[i] for i in indices]
+    else:
+        return as_array(plan)[as_array(indices, np.intp)]
+
+
 class RankScoringV1:
     '''
     This class scores using the Rank Scoring algorithm, where you set a target/out_of for each
@@ -108,7 +277,15 @@ class RankScoringV1:
             self.d_target, self.d_out_of
         )
 
-    def grade_on(self, scores, plan, target, out_of, best_plan, min_grade, max_grade, return_none=True):
+    def max_out_of(self):
+        '''
+        The largest of the out_of values, which is the most top ranked items we ever look at.
+        :return:
+        '''
+        return max(self.a_out_of, self.b_out_of, self.c_out_of, self.d_out_of)
+
+    def grade_on(self, scores, plan, target, out_of, best_plan, min_grade, max_grade, return_none=True,
+                 ranked=None):
         '''
         A simple function to get the grade of a plan ON a particular target.  Used by the grade() method only.
         :param plan: The plan to grade
@@ -121,30 +298,31 @@ class RankScoringV1:
         the top out_of divided by target/out_of percent.  In that case it returns 0 if none of the top
         out_of items were in the plan up to slightly less than 1 if target-1 of the top out_of items are
         in the plan.
+        :param ranked: The indices of the top ranked scores, best first, as returned by top_ranked(scores, n)
+        for some n >= out_of.  If None we calculate it.
         :return: If the target is hit, the grade is returned. Otherwise, if return_none=True it returns None,
         otherwise it returns (nitems_in_plan_of_top_out_of / out_of) / (target / out_of)
         '''
-        sort_ix = np.argsort(scores)
-        total = 0
-        for i in range(out_of):
-            if plan[sort_ix[i]]:
-                total += 1
+        if ranked is None:
+            ranked = top_ranked(scores, out_of)
+        plan_subset = plan_values(plan, ranked[0:out_of])
+        total = int(np.count_nonzero(plan_subset))
         if total >= target:
             # We have an A, how much over the A are we
             overage = total - target
             # Decay between upper and lower
             if self.use_rank_interpolate:
                 return rank_interpolate(
-                    [plan[i] for i in sort_ix[0:out_of]],
+                    plan_subset,
                     target,
                     min_grade, max_grade,
-                    [best_plan[i] for i in sort_ix[0:out_of]],
+                    plan_values(best_plan, ranked[0:out_of]),
                     self.grade_decay_rate
                 )
             else:
                 return decay_between(
                     overage,
-                    np.sum([best_plan[i] for i in sort_ix[0:out_of]])-target,
+                    np.sum(plan_values(best_plan, ranked[0:out_of]))-target,
                     min_grade, max_grade
                 )
         else:
@@ -155,59 +333,86 @@ class RankScoringV1:
                 diff = max_grade - min_grade
                 return min_grade + percentage * diff
 
-    def grade(self, scores, plan):
+    @instrumented(size_arg=1)
+    def grade(self, scores, plan, best_plans=None):
         '''
         Grades a plan on a set of scores, returning 0->Worst F to 1->Best A.
         :param scores: The scores to grade upon
         :param plan: The plan to score
+        :param best_plans: The result of best_plan_not_above(scores), if it has already been
+        calculated.  If None we calculate it.
         :return: The grade, a number between 0 and 1.
         '''
         # Check for A
-        best_plans = self.best_plan_not_above(scores)
+        ranked = top_ranked(scores, self.max_out_of())
+        if best_plans is None:
+            best_plans = self.best_plan_not_above(scores, ranked, sparse=True)
         score = self.grade_on(scores, plan, self.a_target, self.a_out_of,
                               best_plans[0],
-                              0.8, 1.0)
+                              0.8, 1.0, ranked=ranked)
         if score is not None:
             return score
         # Check for B
         score = self.grade_on(scores, plan, self.b_target, self.b_out_of,
                               best_plans[1],
-                              0.6, 0.8)
+                              0.6, 0.8, ranked=ranked)
         if score is not None:
             return score
         # Check for C
         score = self.grade_on(scores, plan, self.c_target, self.c_out_of,
                               best_plans[2],
-                              0.4, 0.6)
+                              0.4, 0.6, ranked=ranked)
         if score is not None:
             return score
         # Check for D
         score = self.grade_on(scores, plan, self.d_target, self.d_out_of,
                               best_plans[3],
-                              0.2, 0.4)
+                              0.2, 0.4, ranked=ranked)
         if score is not None:
             return score
         # We have an F
         return self.grade_on(scores, plan, self.d_target, self.d_out_of,
                              best_plans[4],
-                             0.0, 0.2, return_none=False)
+                             0.0, 0.2, return_none=False, ranked=ranked)
+
+    @instrumented(size_arg=1)
+    def prepare(self, scores):
+        '''
+        Does all of the work of grading that only depends on the scores, so that many plans can
+        be graded on the same scores quickly.
+        :param scores: The scores to grade upon
+        :return: A PreparedRanking
+        '''
+        return PreparedRanking(self, scores)
+
+    @instrumented(size_arg=1)
+    def grade_many(self, scores, plans):
+        '''
+        Grades many plans on the same set of scores, giving the same results as calling grade() on
+        each plan.
+        :param scores: The scores to grade upon
+        :param plans: A list of plans (lists, SparsePlans or mappings), or a 2d array with one dense plan per row
+        :return: A numpy array of the grades
+        '''
+        return self.prepare(scores).grade_many(plans)
 
     @staticmethod
-    def percent(scores, plan, out_of):
+    def percent(scores, plan, out_of, ranked=None):
         '''
         Used for reporting purposes, returns the percentage of each A, B, C, D out_ofs for a given plan.
         :param scores: The scores to grade on
         :param plan: The plan to grade
         :param out_of: The out_of number to use
+        :param ranked: The indices of the top ranked scores, best first, as returned by top_ranked(scores, n)
+        for some n >= out_of.  If None we calculate it.
         :return:
         '''
-        sort_ix = np.argsort(scores)
-        total = 0
-        for i in range(out_of):
-            if plan[sort_ix[i]]:
-                total += 1
+        if ranked is None:
+            ranked = top_ranked(scores, out_of)
+        total = int(np.count_nonzero(plan_values(plan, ranked[0:out_of])))
         return total / out_of
 
+    @instrumented(size_arg=1)
     def percents(self, scores, plan, return_targets_out_ofs=False):
         '''
         Used for reporting purposes, returns the A, B, C, D percentages out of their out_of values
@@ -218,18 +423,19 @@ class RankScoringV1:
         respectively.
         :return:
         '''
+        ranked = top_ranked(scores, self.max_out_of())
         if return_targets_out_ofs:
             return [
-                (self.percent(scores, plan, self.a_out_of), self.a_target, self.a_out_of),
-                (self.percent(scores, plan, self.b_out_of), self.b_target, self.b_out_of),
-                (self.percent(scores, plan, self.c_out_of), self.c_target, self.c_out_of),
-                (self.percent(scores, plan, self.d_out_of), self.d_target, self.d_out_of)
+                (self.percent(scores, plan, self.a_out_of, ranked), self.a_target, self.a_out_of),
+                (self.percent(scores, plan, self.b_out_of, ranked), self.b_target, self.b_out_of),
+                (self.percent(scores, plan, self.c_out_of, ranked), self.c_target, self.c_out_of),
+                (self.percent(scores, plan, self.d_out_of, ranked), self.d_target, self.d_out_of)
             ]
         return [
-            self.percent(scores, plan, self.a_out_of),
-            self.percent(scores, plan, self.b_out_of),
-            self.percent(scores, plan, self.c_out_of),
-            self.percent(scores, plan, self.d_out_of),
+            self.percent(scores, plan, self.a_out_of, ranked),
+            self.percent(scores, plan, self.b_out_of, ranked),
+            self.percent(scores, plan, self.c_out_of, ranked),
+            self.percent(scores, plan, self.d_out_of, ranked),
         ]
 
     def target_percents(self):
@@ -263,7 +469,8 @@ class RankScoringV1:
 
     def plot(self, scores, plan,
              unselected_bar_color='#0000ff33',
-             selected_bar_color='#0000ffff'):
+             selected_bar_color='#0000ffff',
+             ax=None, percents=None, grade=None):
         '''
         Creates a cool matplotlib based plot of the A/B/C/D targets and how close the plan is to reacing them.
         It has a nice title that shows the grade, generally very useful for visually playing.
@@ -271,10 +478,21 @@ class RankScoringV1:
         :param plan: The plan, which is either a boolean list, or list of 0-1 scores.
         :param unselected_bar_color: The color for the bars A/B/C/D that are not the ones used for grading
         :param selected_bar_color: The color for the bar A/B/C/D that is used for grading
+        :param ax: The matplotlib Axes to draw in.  If None we draw in the current pyplot axes.
+        :param percents: The result of percents(scores, plan), if it has already been calculated
+        :param grade: The result of grade(scores, plan), if it has already been calculated
         :return: Nothing
         '''
-        ps = self.percents(scores, plan)
-        raw_grade = self.grade(scores, plan)
+        # Plotting is optional, so matplotlib is only loaded once we actually plot
+        import matplotlib.ticker as mtick
+        from matplotlib.lines import Line2D
+        if ax is None:
+            import matplotlib.pyplot as plt
+            ax = plt.gca()
+        if percents is None:
+            percents = self.percents(scores, plan)
+        ps = list(percents)
+        raw_grade = grade if grade is not None else self.grade(scores, plan)
         xs = [1, 2, 3, 4]
         targets = self.target_percents()
         if raw_grade >= 0.8:
@@ -290,32 +508,28 @@ class RankScoringV1:
 
         if grade_index is None:
             # We have an F and all bars should be the same color
-            plt.bar(xs, ps, zorder=1, color=unselected_bar_color)
+            ax.bar(xs, ps, zorder=1, color=unselected_bar_color)
         else:
-            plt.bar(xs[grade_index:(grade_index + 1)], ps[grade_index:(grade_index + 1)],
-                    zorder=1, color=selected_bar_color)
+            ax.bar(xs[grade_index:(grade_index + 1)], ps[grade_index:(grade_index + 1)],
+                   zorder=1, color=selected_bar_color)
             xs.pop(grade_index)
             ps.pop(grade_index)
-            plt.bar(xs, ps, zorder=1, color=unselected_bar_color)
+            ax.bar(xs, ps, zorder=1, color=unselected_bar_color)
 
-        # plt.bar(xs, ps, zorder=1)
-        plt.scatter([1, 2, 3, 4], targets, c="red", marker="d", s=200, zorder=2)
+        ax.scatter([1, 2, 3, 4], targets, c="red", marker="d", s=200, zorder=2)
+        out_ofs = (self.a_out_of, self.b_out_of, self.c_out_of, self.d_out_of)
         xtick_labels = ["{}\n% of top {}".format(letter, out_of) for letter, out_of in
-                        zip(
-                            ("A", "B", "C", "D"),
-                            (self.a_out_of, self.b_out_of, self.c_out_of, self.d_out_of)
-                        )]
-        plt.xticks([1, 2, 3, 4], xtick_labels)
+                        zip(("A", "B", "C", "D"), out_ofs)]
+        ax.set_xticks([1, 2, 3, 4])
+        ax.set_xticklabels(xtick_labels)
 
         # Let's annotate our targets
         count = 1
-        for info in self.percents(scores, plan, return_targets_out_ofs=True):
-            percent, target, out_of = info
-            plt.annotate("{} of top {}".format(target, out_of), (count, target / out_of), textcoords="offset points",
-                         xytext=(15, 0), ha="left")
+        for target, out_of in zip((self.a_target, self.b_target, self.c_target, self.d_target), out_ofs):
+            ax.annotate("{} of top {}".format(target, out_of), (count, target / out_of), textcoords="offset points",
+                        xytext=(15, 0), ha="left")
             count += 1
-        plt.ylim(0, 1)
-        ax = plt.gca()
+        ax.set_ylim(0, 1)
         legend_elements = [
             Line2D([0], [0], marker='d', color='w', label='Target',
                    markerfacecolor='red', markersize=15)
@@ -324,9 +538,9 @@ class RankScoringV1:
         ax.yaxis.set_major_formatter(mtick.PercentFormatter(xmax=1))
         grade = "{:.1f}".format(raw_grade * 100)
         if self.use_rank_interpolate:
-            plt.title("With rank interpolation the grade is {}, {}th percentile".format(self.letter_of_grade(raw_grade), grade))
+            ax.set_title("With rank interpolation the grade is {}, {}th percentile".format(self.letter_of_grade(raw_grade), grade))
         else:
-            plt.title("With linear interpolation the plan grade is {}, {}th percentile".format(self.letter_of_grade(raw_grade), grade))
+            ax.set_title("With linear interpolation the plan grade is {}, {}th percentile".format(self.letter_of_grade(raw_grade), grade))
 
     def out_of(self, letter):
         if letter == "A":
@@ -340,37 +554,60 @@ class RankScoringV1:
         else:
             raise Exception("Don't understand "+str(letter))
 
-    def plot_heatmap(self, scores, plan, letter_grade=None, ax=plt):
+    def plot_heatmap(self, scores, plan, letter_grade=None, ax=None, grade=None):
         '''
         Plots the 1-d h
         :param scores: The scores to do the heatmap
         :param plan: The plan to use
-        :param grade: The letter grade to heatmap for, if None, we grade, then heatmap for the appropriate grade
-        :param ax: The plot do work in, if None
+        :param letter_grade: The letter grade to heatmap for, if None, we grade, then heatmap for the appropriate grade
+        :param ax: The matplotlib Axes to draw in.  If None we draw in a new pyplot figure.
+        :param grade: The result of grade(scores, plan), if it has already been calculated
         :return:
         '''
-        f = ax.figure()
-        f.set_figheight(2)
+        if (ax is None) or (ax is sys.modules.get("matplotlib.pyplot")):
+            import matplotlib.pyplot as plt
+            f = plt.figure()
+            f.set_figheight(2)
+            ax = f.gca()
         if letter_grade is None:
-            grade = self.grade(scores, plan)
+            if grade is None:
+                grade = self.grade(scores, plan)
             letter_grade = self.letter_of_grade(grade)
         out_of = self.out_of(letter_grade)
-        y = np.array(plan[0:out_of])
+        y = np.array(plan_values(plan, range(out_of)))
         ax.imshow(y[np.newaxis, :], cmap="Blues")
-        ax.title("Funded projects in Blue, by rank, for grade "+letter_grade)
-        ax.xlim([-0.5, len(y)-0.5])
-        ax.yticks([])
+        ax.set_title("Funded projects in Blue, by rank, for grade "+letter_grade)
+        ax.set_xlim([-0.5, len(y)-0.5])
+        ax.set_yticks([])
         texts = [str(i + 1) for i in range(len(y))]
         indices = [i + 0 for i in range(len(y))]
-        ax.xticks(indices, texts)
+        ax.set_xticks(indices)
+        ax.set_xticklabels(texts)
 
-    def best_plan_not_above(self, scores):
-        a_plan = [1] * len(scores)
-        sort_ix = np.argsort(scores)
+    @instrumented(size_arg=1)
+    def best_plan_not_above(self, scores, ranked=None, sparse=False):
+        '''
+        Finds the best plans that do not get above each grade, i.e. the plan with as much funded as
+        possible that still does not hit the A target, the B target, etc.  These are used to scale
+        the grade within each letter.
+        :param scores: The scores to grade upon
+        :param ranked: The indices of the top ranked scores, as returned by top_ranked(scores, self.max_out_of()).
+        If None we calculate it.
+        :param sparse: If True each plan is returned as a SparsePlan, only storing the first max_out_of
+        items, otherwise as a list the same length as scores.
+        :return: A tuple of 5 plans, the all funded plan, and the best plans not above A, B, C and D respectively.
+        '''
+        if ranked is None:
+            ranked = top_ranked(scores, self.max_out_of())
+        nitems = len(scores)
+        # Only the first max_out_of items are ever changed, the rest of each plan is funded
+        head_indices = np.arange(min(nitems, self.max_out_of()))
+        as_plan = lambda head: SparsePlan(head_indices, head, nitems, fill=1)
+        a_plan = [1] * len(head_indices)
         for i in range(self.a_target - 1, self.a_out_of):
             a_plan[i] = 0
         b_plan = [i for i in a_plan]
-        b_sum = self.percent(scores, b_plan, self.b_out_of) * self.b_out_of
+        b_sum = self.percent(scores, as_plan(b_plan), self.b_out_of, ranked) * self.b_out_of
         index = self.b_out_of - 1
         while b_sum >= self.b_target:
             b_plan[index] = 0
@@ -378,7 +615,7 @@ class RankScoringV1:
             index -= 1
 
         c_plan = [i for i in b_plan]
-        c_sum = self.percent(scores, c_plan, self.c_out_of) * self.c_out_of
+        c_sum = self.percent(scores, as_plan(c_plan), self.c_out_of, ranked) * self.c_out_of
         index = self.c_out_of - 1
         while c_sum >= self.c_target:
             c_plan[index] = 0
@@ -386,11 +623,135 @@ class RankScoringV1:
             index -= 1
 
         d_plan = [i for i in c_plan]
-        d_sum = self.percent(scores, d_plan, self.d_out_of) * self.d_out_of
+        d_sum = self.percent(scores, as_plan(d_plan), self.d_out_of, ranked) * self.d_out_of
         index = self.d_out_of - 1
         while d_sum >= self.d_target:
             d_plan[index] = 0
             d_sum -= 1
             index -= 1
 
-        return [1]*len(scores), a_plan, b_plan, c_plan, d_plan
+        if sparse:
+            return SparsePlan([], nitems=nitems, fill=1), as_plan(a_plan), as_plan(b_plan), \
+                as_plan(c_plan), as_plan(d_plan)
+        tail = [1] * (nitems - len(head_indices))
+        return [1]*nitems, a_plan + tail, b_plan + tail, c_plan + tail, d_plan + tail
+
+
+class PreparedRanking:
+    '''
+    A RankScoringV1 together with everything about a set of scores it needs to grade plans on
+    them: the top ranked projects, the best plans not above each letter and the lowest and highest
+    power totals for each letter.
+    '''
+    def __init__(self, rks, scores):
+        '''
+        Constructor
+        :param rks: The RankScoringV1 to grade with
+        :param scores: The scores to grade upon
+        '''
+        self.rks = rks
+        self.nitems = len(scores)
+        self.ranked = top_ranked(scores, rks.max_out_of())
+        self.best_plans = rks.best_plan_not_above(scores, self.ranked, sparse=True)
+        self._setup_tiers()
+
+    @staticmethod
+    def from_parts(rks, nitems, ranked, best_plans):
+        '''
+        Recreates a PreparedRanking from what it was built from the scores, without the scores
+        themselves, e.g. when loading one that was saved with dlpy.serialize
+        :param rks: The RankScoringV1 to grade with
+        :param nitems: The number of scores
+        :param ranked: The indices of the top ranked scores
+        :param best_plans: The sparse best plans not above each letter, see RankScoringV1.best_plan_not_above
+        :return: The PreparedRanking
+        '''
+        rval = PreparedRanking.__new__(PreparedRanking)
+        rval.rks = rks
+        rval.nitems = nitems
+        rval.ranked = ranked
+        rval.best_plans = best_plans
+        rval._setup_tiers()
+        return rval
+
+    def _setup_tiers(self):
+        rks = self.rks
+        base = rks.grade_decay_rate
+        # One row per letter, (target, out_of, min_grade, max_grade, best_plan_subset, lowest_total, highest_total)
+        self.tiers = []
+        for target, out_of, best_plan, min_grade, max_grade in (
+                (rks.a_target, rks.a_out_of, self.best_plans[0], 0.8, 1.0),
+                (rks.b_target, rks.b_out_of, self.best_plans[1], 0.6, 0.8),
+                (rks.c_target, rks.c_out_of, self.best_plans[2], 0.4, 0.6),
+                (rks.d_target, rks.d_out_of, self.best_plans[3], 0.2, 0.4)):
+            best_plan_subset = plan_values(best_plan, self.ranked[0:out_of])
+            weights = power_weights(len(best_plan_subset), base)
+            self.tiers.append((target, out_of, min_grade, max_grade, best_plan_subset,
+                               _lowest_total(len(best_plan_subset), target, base),
+                               np.dot(weights, best_plan_subset)))
+
+    def plan_matrix(self, plans):
+        '''
+        Looks up the values of many plans on the top ranked projects
+        :param plans: A list of plans (lists, SparsePlans or mappings), or a 2d array with one dense plan per row
+        :return: A 2d numpy array with one row per plan, and one column per top ranked project, best first
+        '''
+        if hasattr(plans, "to_numpy"):
+            # A pandas DataFrame with one plan per row
+            plans = as_array(plans)
+        if isinstance(plans, np.ndarray) and (plans.ndim == 2):
+            return plans[:, self.ranked]
+        return np.array([plan_values(plan, self.ranked) for plan in plans], dtype=float).reshape(
+            (len(plans), len(self.ranked)))
+
+    def grade(self, plan):
+        '''
+        Grades a single plan, see RankScoringV1.grade
+        :param plan: The plan to score
+        :return: The grade, a number between 0 and 1.
+        '''
+        return self.grade_many([plan])[0]
+
+    @instrumented(size_arg=1)
+    def grade_many(self, plans):
+        '''
+        Grades many plans at once, see RankScoringV1.grade_many
+        :param plans: A list of plans (lists, SparsePlans or mappings), or a 2d array with one dense plan per row
+        :return: A numpy array of the grades
+        '''
+        return self.grade_ranked(self.plan_matrix(plans))
+
+    @instrumented(size_arg=1)
+    def grade_ranked(self, matrix):
+        '''
+        Grades many plans given only their values on the top ranked projects
+        :param matrix: A 2d array with one row per plan, and one column per top ranked project, as
+        returned by plan_matrix()
+        :return: A numpy array of the grades
+        '''
+        rks = self.rks
+        matrix = as_array(matrix)
+        rval = np.full(len(matrix), np.nan)
+        ungraded = np.ones(len(matrix), dtype=bool)
+        for target, out_of, min_grade, max_grade, best_plan_subset, lowest_total, highest_total in self.tiers:
+            totals = np.count_nonzero(matrix[:, 0:out_of], axis=1)
+            hit = ungraded & (totals >= target)
+            if not np.any(hit):
+                continue
+            if rks.use_rank_interpolate:
+                rval[hit] = rank_interpolate_many(matrix[hit, 0:out_of], target, min_grade, max_grade,
+                                                  base=rks.grade_decay_rate, highest_total=highest_total)
+            else:
+                max_steps = np.sum(best_plan_subset) - target
+                if max_steps == 0:
+                    rval[hit] = max_grade
+                else:
+                    slope = (max_grade - min_grade)/max_steps
+                    rval[hit] = min_grade + (totals[hit] - target)*slope
+            ungraded &= ~hit
+        # We have F's, which are graded on the D target
+        target, out_of = rks.d_target, rks.d_out_of
+        totals = np.count_nonzero(matrix[ungraded, 0:out_of], axis=1)
+        percentage = (totals / out_of) / (target / out_of)
+        rval[ungraded] = 0.0 + percentage * (0.2 - 0.0)
+        return rval
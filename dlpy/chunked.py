@@ -0,0 +1,108 @@
+'''
+Helpers for getting inputs as numpy arrays without copying them, and for working through data a
+chunk at a time, so that inputs and outputs can be numpy arrays, memory mapped arrays or .npy files
+larger than memory.
+'''
+import os
+import numpy as np
+
+# The default number of elements we hold in memory at once
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+def as_array(X, dtype=None):
+    '''
+    Gets the input as a C-contiguous numpy array, without copying it when its layout and dtype
+    already fit.  Numpy arrays, pandas Series and Index, array.array, memoryviews and other buffers
+    are viewed in place, lists and tuples are converted in one pass.
+    :param X: The values
+    :param dtype: If not None, the dtype we need, X is only converted (i.e. copied) if it is not one
+    :return: The numpy array
+    '''
+    if not isinstance(X, np.ndarray):
+        to_numpy = getattr(X, "to_numpy", None)
+        if to_numpy is not None:
+            X = to_numpy()
+    return np.asarray(X, dtype=dtype, order='C')
+
+
+def open_input(X):
+    '''
+    Gets the input as something we can slice chunks out of without loading it all
+    :param X: A path to a .npy file (which we memory map read only), a numpy array or memmap
+    (which we use as is), or anything as_array accepts.
+    :return: The numpy array or memmap
+    '''
+    if isinstance(X, (str, os.PathLike)):
+        return np.load(X, mmap_mode='r')
+    if isinstance(X, np.ndarray):
+        return X
+    return as_array(X)
+
+
+def open_output(out, shape, dtype):
+    '''
+    Gets the array to write results into
+    :param out: None for a new in memory array, a path for a new .npy file that we memory map,
+    or an existing array or memmap of the right shape.
+    :param shape: The shape of the result
+    :param dtype: The dtype of the result, used when we create the array
+    :return: The numpy array or memmap
+    '''
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if isinstance(out, (str, os.PathLike)):
+        return np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=shape)
+    if out.shape != tuple(shape):
+        raise Exception("out has shape {} but the result has shape {}".format(out.shape, tuple(shape)))
+    return out
+
+
+def float_dtype(dtype):
+    '''
+    Checks the dtype a calculation was asked to run in
+    :param dtype: Anything np.dtype accepts, e.g. np.float32
+    :return: The np.dtype, which is a float one
+    '''
+    dtype = np.dtype(dtype)
+    if dtype.kind != 'f':
+        raise Exception("dtype must be a float type, not "+str(dtype))
+    return dtype
+
+
+def write_output(result, out, dtype):
+    '''
+    Hands back a result calculated in memory, in out if we were given one
+    :param result: The numpy array of results
+    :param out: None, or where to write the result, see open_output
+    :param dtype: The dtype of the result
+    :return: out, or result as dtype
+    '''
+    if out is None:
+        return result.astype(dtype, copy=False)
+    out = open_output(out, result.shape, dtype)
+    out[...] = result
+    return finish_output(out)
+
+
+def finish_output(out):
+    '''
+    Flushes out to disk if it is memory mapped
+    :return: out
+    '''
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
+
+
+def chunk_slices(n, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Splits range(n) into consecutive slices of at most chunk_size
+    :param n: The number of elements
+    :param chunk_size: The most elements in a slice
+    :return: A generator of slice objects
+    '''
+    if chunk_size <= 0:
+        raise Exception("chunk_size must be positive")
+    for start in range(0, n, chunk_size):
+        yield slice(start, min(start + chunk_size, n))
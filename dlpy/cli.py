@@ -0,0 +1,315 @@
+'''
+The python -m dlpy batch command.  It streams a CSV or .npy file in chunks through a chain of
+steps and writes the results as it goes, e.g.
+
+    python -m dlpy scores.csv scored.csv --column score --group department --steps gcp,likert,wtd_median
+
+Every step needs something from all of the rows first (the curve knots, the group statistics), so
+the input is read twice, a chunk at a time: once to fit and once to transform.  With --group each
+step is done within each group, e.g. the percentile of a project within its department.
+'''
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dlpy.chunked import open_output, finish_output, chunk_slices
+from dlpy.percentile import GcpCurve
+from dlpy.likert import likert_codes_of_unique
+from dlpy.weighted_calcs import WtdMeanAccumulator, WtdQuantileAccumulator
+
+STEPS = ("gcp", "likert", "wtd_mean", "wtd_median")
+DEFAULT_ROWS = 100000
+
+
+def _group_segments(keys, nrows):
+    '''
+    Splits the rows into groups
+    :param keys: The group of each row, or None if there are no groups
+    :param nrows: The number of rows
+    :return: A list of (key, row indices), with key None if there are no groups
+    '''
+    if keys is None:
+        return [(None, np.arange(nrows))]
+    unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse.ravel(), kind="stable")
+    return list(zip(unique_keys.tolist(), np.split(order, np.cumsum(counts)[:-1])))
+
+
+class ScoringChain:
+    '''
+    The steps to apply to a column, and what is fit from the data for them.  Each chunk is fit on
+    its own (possibly in another process) and the partial fits are merged, then finalized.
+    '''
+    def __init__(self, steps, column, group=None, weight=None, epsilon=0.01, likert_method="percentile",
+                 max_quantile_size=None):
+        '''
+        :param steps: The steps to do, a list from STEPS
+        :param column: The column to score
+        :param group: The column with the group of each row, or None
+        :param weight: The column with the weight of each row for the weighted stats, or None for 1
+        :param epsilon: The gcp epsilon
+        :param likert_method: "percentile" or "zscores"
+        :param max_quantile_size: If not None, the weighted medians are approximate, keeping at most
+        this many values per group, see WtdQuantileAccumulator
+        '''
+        if len(steps) == 0:
+            raise Exception("No steps to do")
+        for step in steps:
+            if step not in STEPS:
+                raise Exception("Unknown step "+str(step))
+        self.steps = list(steps)
+        self.column = column
+        self.group = group
+        self.weight = weight
+        self.epsilon = epsilon
+        self.likert_method = likert_method
+        self.max_quantile_size = max_quantile_size
+        self.nrows = 0
+        # Group key -> distinct values / accumulators, the key is None without groups
+        self.knots = {}
+        self.means = {}
+        self.quantiles = {}
+        # Set by finalize
+        self.curves = None
+        self.likert_codes = None
+        self.mean_of = None
+        self.median_of = None
+
+    def output_columns(self):
+        '''
+        :return: A list of (name, dtype) of the columns we add
+        '''
+        dtypes = {"gcp": np.float64, "likert": np.int8, "wtd_mean": np.float64, "wtd_median": np.float64}
+        return [("{}_{}".format(self.column, step), dtypes[step]) for step in self.steps]
+
+    def _unfitted(self):
+        return ScoringChain(self.steps, self.column, self.group, self.weight, self.epsilon, self.likert_method,
+                            self.max_quantile_size)
+
+    def _segments(self, frame):
+        values = np.asarray(frame[self.column], dtype=float)
+        keys = None if self.group is None else np.asarray(frame[self.group])
+        return values, _group_segments(keys, len(values))
+
+    def fit_chunk(self, frame):
+        '''
+        Fits a chunk of rows
+        :param frame: A dict of column name to array
+        :return: A new ScoringChain fit to only this chunk, see merge
+        '''
+        rval = self._unfitted()
+        values, segments = self._segments(frame)
+        weights = np.ones(len(values)) if self.weight is None else np.asarray(frame[self.weight], dtype=float)
+        rval.nrows = len(values)
+        for key, ix in segments:
+            if ("gcp" in self.steps) or ("likert" in self.steps):
+                rval.knots[key] = np.unique(values[ix])
+            if "wtd_mean" in self.steps:
+                rval.means[key] = WtdMeanAccumulator().update(values[ix], weights[ix])
+            if "wtd_median" in self.steps:
+                rval.quantiles[key] = WtdQuantileAccumulator(self.max_quantile_size).update(values[ix], weights[ix])
+        return rval
+
+    def merge(self, other):
+        '''
+        Adds a partial fit from fit_chunk into this one
+        :return: self
+        '''
+        self.nrows += other.nrows
+        for key, knots in other.knots.items():
+            self.knots[key] = np.union1d(self.knots[key], knots) if key in self.knots else knots
+        for mine, theirs in ((self.means, other.means), (self.quantiles, other.quantiles)):
+            for key, accumulator in theirs.items():
+                if key in mine:
+                    mine[key].merge(accumulator)
+                else:
+                    mine[key] = accumulator
+        return self
+
+    def finalize(self):
+        '''
+        Builds the curves and statistics from everything that has been fit
+        :return: self
+        '''
+        self.curves = {key: GcpCurve(knots, self.epsilon) for key, knots in self.knots.items()}
+        if "likert" in self.steps:
+            self.likert_codes = {key: likert_codes_of_unique(knots, self.likert_method)
+                                 for key, knots in self.knots.items()}
+        self.mean_of = {key: accumulator.mean() for key, accumulator in self.means.items()}
+        self.median_of = {key: accumulator.median() for key, accumulator in self.quantiles.items()}
+        return self
+
+    def transform_chunk(self, frame):
+        '''
+        Scores a chunk of rows, after finalize
+        :param frame: A dict of column name to array
+        :return: A dict of the output column name to array
+        '''
+        values, segments = self._segments(frame)
+        rval = {name: np.empty(len(values), dtype=dtype) for name, dtype in self.output_columns()}
+        for key, ix in segments:
+            group_values = values[ix]
+            for step, (name, dtype) in zip(self.steps, self.output_columns()):
+                if step == "gcp":
+                    rval[name][ix] = self.curves[key].evaluate(group_values)
+                elif step == "likert":
+                    rval[name][ix] = self.likert_codes[key][np.searchsorted(self.knots[key], group_values)]
+                elif step == "wtd_mean":
+                    rval[name][ix] = self.mean_of[key]
+                elif step == "wtd_median":
+                    rval[name][ix] = self.median_of[key]
+        return rval
+
+
+def read_chunks(path, rows=DEFAULT_ROWS, column=None):
+    '''
+    Reads a CSV or .npy file a chunk of rows at a time
+    :param path: The file, a .npy file is memory mapped, and is either a structured array whose
+    fields are the columns, or a plain 1d array that is the one column named column
+    :param rows: The number of rows in a chunk
+    :param column: The column name for a plain .npy array
+    :return: A generator of dicts of column name to array
+    '''
+    if os.path.splitext(path)[1].lower() == ".npy":
+        data = np.load(path, mmap_mode="r")
+        for chunk in chunk_slices(len(data), rows):
+            if data.dtype.names is None:
+                yield {column: np.asarray(data[chunk])}
+            else:
+                yield {name: np.asarray(data[chunk][name]) for name in data.dtype.names}
+    else:
+        import pandas as pd
+        for frame in pd.read_csv(path, chunksize=rows):
+            yield {name: frame[name].to_numpy() for name in frame.columns}
+
+
+class _CsvWriter:
+    '''Appends each chunk, the input columns and then ours, to a CSV file'''
+    def __init__(self, path):
+        self.file = open(path, "w", newline="")
+        self.header = True
+
+    def write(self, frame, scored):
+        import pandas as pd
+        pd.DataFrame({**frame, **scored}).to_csv(self.file, header=self.header, index=False)
+        self.header = False
+
+    def close(self):
+        self.file.close()
+
+
+class _NpyWriter:
+    '''Writes our columns into a structured .npy file, memory mapped'''
+    def __init__(self, path, nrows, columns):
+        self.out = open_output(path, (nrows,), np.dtype(columns))
+        self.start = 0
+
+    def write(self, frame, scored):
+        nrows = len(next(iter(scored.values())))
+        for name, values in scored.items():
+            self.out[name][self.start:self.start + nrows] = values
+        self.start += nrows
+
+    def close(self):
+        finish_output(self.out)
+
+
+# The chain a worker process uses, set once per process so it is not sent with every chunk
+_worker_chain = None
+
+
+def _set_worker_chain(chain):
+    global _worker_chain
+    _worker_chain = chain
+
+
+def _fit_in_worker(frame):
+    return _worker_chain.fit_chunk(frame)
+
+
+def _transform_in_worker(frame):
+    return _worker_chain.transform_chunk(frame)
+
+
+def _ordered_map(func, chain, items, workers):
+    '''
+    Applies func to each item, in worker processes that have chain if workers > 1.  At most
+    2*workers items are in flight at once, so memory stays bounded.
+    :return: A generator of (item, func(item)), in the order of items
+    '''
+    _set_worker_chain(chain)
+    if workers <= 1:
+        for item in items:
+            yield item, func(item)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_worker_chain, initargs=(chain,)) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= 2 * workers:
+                item, future = pending.popleft()
+                yield item, future.result()
+        while pending:
+            item, future = pending.popleft()
+            yield item, future.result()
+
+
+def run(input_path, output_path, chain, rows=DEFAULT_ROWS, workers=1, stats=None):
+    '''
+    Fits the chain to the input and writes the scored output, both a chunk at a time
+    :param input_path: A .csv or .npy file
+    :param output_path: A .csv file (the input columns and ours) or .npy file (a structured array
+    of our columns)
+    :param chain: The ScoringChain to apply
+    :param rows: The number of rows in a chunk
+    :param workers: The number of processes to use
+    :param stats: If not None, a file to write timings and throughput to
+    :return: The fitted chain
+    '''
+    start = time.perf_counter()
+    for frame, partial in _ordered_map(_fit_in_worker, chain, read_chunks(input_path, rows, chain.column), workers):
+        chain.merge(partial)
+    chain.finalize()
+    fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    if os.path.splitext(output_path)[1].lower() == ".npy":
+        writer = _NpyWriter(output_path, chain.nrows, chain.output_columns())
+    else:
+        writer = _CsvWriter(output_path)
+    try:
+        for frame, scored in _ordered_map(_transform_in_worker, chain, read_chunks(input_path, rows, chain.column),
+                                          workers):
+            writer.write(frame, scored)
+    finally:
+        writer.close()
+    transform_seconds = time.perf_counter() - start
+    if stats is not None:
+        for name, seconds in (("fit", fit_seconds), ("transform", transform_seconds)):
+            stats.write("{:>10}: {} rows in {:.3f}s, {:.0f} rows/s\n".format(
+                name, chain.nrows, seconds, chain.nrows / seconds if seconds > 0 else float("inf")))
+    return chain
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m dlpy", description="Streams a CSV or .npy file through "
+                                     "dlpy scoring steps, a chunk at a time.")
+    parser.add_argument("input", help="The .csv or .npy file to score")
+    parser.add_argument("output", help="The .csv (input columns plus ours) or .npy (our columns) to write")
+    parser.add_argument("--column", required=True, help="The column to score")
+    parser.add_argument("--steps", default="gcp,likert", help="Comma separated steps from "+",".join(STEPS))
+    parser.add_argument("--group", default=None, help="Do every step within the groups of this column")
+    parser.add_argument("--weight", default=None, help="The weight column for wtd_mean and wtd_median")
+    parser.add_argument("--epsilon", type=float, default=0.01, help="The gcp epsilon")
+    parser.add_argument("--likert-method", default="percentile", choices=("percentile", "zscores"))
+    parser.add_argument("--max-quantile-size", type=int, default=None,
+                        help="Approximate wtd_median keeping at most this many values per group")
+    parser.add_argument("--rows", type=int, default=DEFAULT_ROWS, help="The number of rows in a chunk")
+    parser.add_argument("--workers", type=int, default=1, help="The number of processes to use")
+    parser.add_argument("--stats", action="store_true", help="Print timings and throughput to stderr")
+    args = parser.parse_args(argv)
+    chain = ScoringChain([step.strip() for step in args.steps.split(",") if step.strip()], args.column,
+                         args.group, args.weight, args.epsilon, args.likert_method, args.max_quantile_size)
+    run(args.input, args.output, chain, args.rows, args.workers, sys.stderr if args.stats else None)
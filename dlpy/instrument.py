@@ -0,0 +1,131 @@
+'''
+Opt-in instrumentation of the dlpy entry points.  When enabled every instrumented function
+records how often it was called, its cumulative and max wall time, and the size of its input.
+When disabled (the default) an instrumented function only pays for one flag check.
+
+    import dlpy.instrument as instrument
+    with instrument.recording():
+        run_my_job()
+    stats = instrument.snapshot()
+
+Times are inclusive, i.e. gcp's time includes the time of the sort_dedupe call it makes.
+Scalar kernels that are called once per element or per tier, like dlpy.maths.pw_linear,
+dlpy.percentile.std_perc and gcp_sorted_deduped, and dlpy.ap.scoring.rank_interpolate and
+rank_interpolate_many, are deliberately not instrumented, so the wrapper stays out of the inner
+loops.  Their batch callers are instead, e.g. dlpy.maths.pw_linear_many and
+dlpy.ap.scoring.PreparedRanking.grade_many and grade_ranked.
+'''
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import numpy as np
+
+_enabled = False
+_lock = threading.Lock()
+# Function name -> [calls, total seconds, max seconds, total items, max items]
+_stats = {}
+
+
+def enable():
+    '''Starts recording'''
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    '''Stops recording, what has been recorded so far is kept'''
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    '''Forgets everything recorded so far'''
+    with _lock:
+        _stats.clear()
+
+
+def snapshot():
+    '''
+    Gets a copy of what has been recorded so far, suitable for a metrics exporter
+    :return: A dict of function name to a dict with the keys calls, total_seconds, max_seconds,
+    total_items and max_items.  The items are the size of the input of each call, see size_of.
+    '''
+    with _lock:
+        return {name: {"calls": stats[0], "total_seconds": stats[1], "max_seconds": stats[2],
+                       "total_items": stats[3], "max_items": stats[4]}
+                for name, stats in _stats.items()}
+
+
+@contextmanager
+def recording(clear=True):
+    '''
+    Records within a with block, restoring the previous enabled state afterwards
+    :param clear: If True we reset before starting
+    '''
+    was_enabled = _enabled
+    if clear:
+        reset()
+    enable()
+    try:
+        yield
+    finally:
+        if not was_enabled:
+            disable()
+
+
+def size_of(value):
+    '''
+    The size we record for an input, the number of elements for arrays, the length for
+    anything else that has one, and 1 for scalars.
+    '''
+    if isinstance(value, np.ndarray):
+        return value.size
+    try:
+        return len(value)
+    except TypeError:
+        return 1
+
+
+def _record(name, seconds, items):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            _stats[name] = [1, seconds, seconds, items, items]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3] += items
+            stats[4] = max(stats[4], items)
+
+
+def instrumented(func=None, name=None, size_arg=0):
+    '''
+    Decorator that records calls to func while instrumentation is enabled
+    :param func: The function to instrument
+    :param name: The name to record under, if None we use module.qualname
+    :param size_arg: The index of the positional argument whose size we record, e.g. 1 for
+    methods to skip self.  If the call has fewer positional arguments we record 0.
+    :return: The wrapped function
+    '''
+    if func is None:
+        return lambda f: instrumented(f, name, size_arg)
+    if name is None:
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _enabled:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            _record(name, seconds, size_of(args[size_arg]) if len(args) > size_arg else 0)
+    return wrapper
@@ -2,13 +2,12 @@
 For bundling numeric values into standard scales
 '''
 from enum import Enum
-from dlpy.maths import pw_linear
-from dlpy.percentile import std_perc
-from scipy.stats import zscore
+from dlpy.maths import pw_linear, pw_linear_many, pad_pts
+from dlpy.percentile import unique_inverse, sorted_unique
+from dlpy.instrument import instrumented
+from dlpy.chunked import DEFAULT_CHUNK_SIZE, as_array, open_input, open_output, finish_output, chunk_slices
+from dlpy.threads import map_chunks
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.lines import Line2D
 
 class StandardLikert(Enum):
     L = 1
@@ -124,68 +123,187 @@ def likert_from_01_grade(score):
 ZSCORE_CUTOFFS_VALUES = [(-0.84162123, 0.2), (-0.2533471, 0.4) ,  (0.2533471, 0.6) ,  (0.84162123, 0.8)]
 ZSCORE_INTERPRETTER = lambda x: pw_linear(x, ZSCORE_CUTOFFS_VALUES, 0, 1);
 
-def likert_using_zscores(values, do_cluster=True, cluster_epsilon=0.01, cluster_delta=0.09):
+def _likerts_by_unique(likerts, ix_in_unique):
+    '''
+    Spreads the likert value of each unique value out to every value, in one gather
+    '''
+    by_unique = np.empty(len(likerts), dtype=object)
+    by_unique[:] = likerts
+    return by_unique[ix_in_unique].tolist()
+
+def _small_int_centers(values, small_ints):
+    '''
+    The small_ints to deduplicate clustered values with.  Clustering replaces each value with its
+    cluster's (float) center, which small_int_counts only counts if small_ints is True, so for
+    integer typed values we ask for the centers to be counted when they are all still integers.
+    Only the deduplication is done by counting, the clustering itself still sorts and walks every
+    value, so do_cluster=False is needed for the O(n + k) path.
+    :param values: The values before clustering
+    :param small_ints: See dlpy.percentile.small_int_counts
+    :return: The small_ints to use on the cluster centers
+    '''
+    if (small_ints is None) and (as_array(values).dtype.kind in 'iu'):
+        return True
+    return small_ints
+
+@instrumented
+def likert_using_zscores(values, do_cluster=True, cluster_epsilon=0.01, cluster_delta=0.09, small_ints=None):
     '''
     Returns the standard likert evaluation of the values using
     :param values: Any list-like object of numbers
+    :param small_ints: See dlpy.percentile.small_int_counts, small integer data is deduplicated
+    by counting instead of sorting.  With do_cluster, the cluster centers of integer typed values
+    are counted if they are all still integers, but the clustering itself still sorts.
     :return: The likert evaluation of those numbers.  Returns a simple list
     '''
     if do_cluster:
-        clustered_values = cluster_values_simple(values, cluster_epsilon, cluster_delta)
+        small_ints = _small_int_centers(values, small_ints)
+        clustered_values = _cluster_centers(values, cluster_epsilon, cluster_delta)
     else:
         clustered_values = values
-    unique_values = list(set(clustered_values))
-    unique_values.sort()
-    ix_in_unique = [unique_values.index(value) for value in clustered_values]
+    from scipy.stats import zscore
+    unique_values, ix_in_unique = unique_inverse(clustered_values, small_ints)
     zscores = zscore(unique_values)
     evaled_zscores = [ZSCORE_INTERPRETTER(x) for x in zscores]
-    rval = [likert_from_01_grade(evaled_zscores[index]) for index in ix_in_unique]
-    return rval
+    return _likerts_by_unique([likert_from_01_grade(x) for x in evaled_zscores], ix_in_unique)
 
-def likert_using_percentile(values, do_cluster=True, cluster_epsilon=0.01, cluster_delta=0.09):
+@instrumented
+def likert_using_percentile(values, do_cluster=True, cluster_epsilon=0.01, cluster_delta=0.09, small_ints=None):
     '''
     Returns the standard likert evaluation of the values using
     :param values: Any list-like object of numbers
+    :param small_ints: See dlpy.percentile.small_int_counts, small integer data is deduplicated
+    by counting instead of sorting.  With do_cluster, the cluster centers of integer typed values
+    are counted if they are all still integers, but the clustering itself still sorts.
     :return: The likert evaluation of those numbers.  Returns a simple list
     '''
     if do_cluster:
-        clustered_values = cluster_values_simple(values, cluster_epsilon, cluster_delta)
+        small_ints = _small_int_centers(values, small_ints)
+        clustered_values = _cluster_centers(values, cluster_epsilon, cluster_delta)
     else:
         clustered_values = values
-    unique_values = list(set(clustered_values))
-    unique_values.sort()
-    ix_in_unique = [unique_values.index(value) for value in clustered_values]
-    percs = [std_perc(unique_values, x) for x in unique_values]
-    rval = [likert_from_01_grade(percs[index]) for index in ix_in_unique]
-    return rval
-
-
-def likert_using_small_count(values, cluster_epsilon=0.05, cluster_delta=0.2):
-    clustered_values = cluster_values_simple(values, cluster_epsilon, cluster_delta)
-    unique_values = list(set(clustered_values))
+    unique_values, ix_in_unique = unique_inverse(clustered_values, small_ints)
+    # The unique values are sorted and distinct, so std_perc of the i-th is (i + 0.5)/count
+    nunique = len(unique_values)
+    percs = [(i + 0.5)/nunique for i in range(nunique)]
+    return _likerts_by_unique([likert_from_01_grade(perc) for perc in percs], ix_in_unique)
+
+
+@instrumented
+def likert_using_small_count(values, cluster_epsilon=0.05, cluster_delta=0.2, small_ints=None):
+    small_ints = _small_int_centers(values, small_ints)
+    clustered_values = _cluster_centers(values, cluster_epsilon, cluster_delta)
+    unique_values, ix_in_unique = unique_inverse(clustered_values, small_ints)
     if len(unique_values) > len(SmallLikertScales):
         raise Exception("Too many values to use the small_count likert algorithm")
-    unique_values.sort()
-    ix_in_unique = [unique_values.index(value) for value in clustered_values]
     smallScale = SmallLikertScales[len(unique_values)-1]
-    rval = [smallScale[ix_in_unique[i]] for i in range(len(values))]
-    return rval
+    return _likerts_by_unique(smallScale, ix_in_unique)
 
-def likert_using_default(values, cluster_epsilon=0.05, cluster_delta=0.2):
+@instrumented
+def likert_using_default(values, cluster_epsilon=0.05, cluster_delta=0.2, small_ints=None):
     '''
     If the number of values after clustering is small enough that we can use
     the small_count version, we do so, otherwise we use the percentile version
     :param values:
     :param cluster_epsilon:
     :param cluster_delta:
+    :param small_ints: See dlpy.percentile.small_int_counts and likert_using_percentile
     :return:
     '''
     try:
-        return likert_using_small_count(values, cluster_epsilon, cluster_delta)
+        return likert_using_small_count(values, cluster_epsilon, cluster_delta, small_ints=small_ints)
     except:
         pass
-    return likert_using_percentile(values, cluster_epsilon, cluster_delta)
+    return likert_using_percentile(values, cluster_epsilon=cluster_epsilon, cluster_delta=cluster_delta,
+                                   small_ints=small_ints)
+
+# The 0 to 1 grades where likert_from_01_grade moves up a level
+LIKERT_01_CUTOFFS = [0.2, 0.4, 0.6, 0.8]
+
+
+def likert_codes_from_01_grades(grades, out=None, n_threads=None):
+    '''
+    The vectorized likert_from_01_grade
+    :param grades: An array of 0 to 1 grades
+    :param out: If not None, an int8 array the same shape as grades to write the codes into
+    :param n_threads: The number of threads to split a large 1d grades over, None for the setting
+    from dlpy.threads.set_threads
+    :return: out, or a new int8 array of the StandardLikert ivalue() codes, 1 (Very Low) to 5 (Very High)
+    '''
+    grades = as_array(grades)
+    if out is None:
+        out = np.empty(grades.shape, dtype=np.int8)
+    if grades.ndim != 1:
+        return _codes_from_01_grades(grades, out)
+
+    def digitize_chunk(chunk):
+        _codes_from_01_grades(grades[chunk], out[chunk])
 
+    map_chunks(digitize_chunk, len(grades), n_threads)
+    return out
+
+
+def _codes_from_01_grades(grades, out):
+    levels = np.searchsorted(LIKERT_01_CUTOFFS, grades, side='right')
+    return np.add(levels, 1, out=out, casting='unsafe')
+
+
+def likert_codes_of_unique(unique_values, method="percentile"):
+    '''
+    The likert code of each distinct value, as likert_using_percentile (or likert_using_zscores)
+    with do_cluster=False would give it.
+    :param unique_values: The distinct values of the data, sorted
+    :param method: "percentile" or "zscores"
+    :return: An int8 array of the StandardLikert ivalue() codes, one per distinct value
+    '''
+    unique_values = as_array(unique_values, float)
+    nunique = len(unique_values)
+    if method == "percentile":
+        grades = (np.arange(nunique) + 0.5)/nunique
+    elif method == "zscores":
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscores = (unique_values - unique_values.mean())/unique_values.std()
+        pts, lengths = pad_pts([ZSCORE_CUTOFFS_VALUES])
+        grades = pw_linear_many(zscores[:, np.newaxis], pts, lengths, 0, 1)[:, 0]
+    else:
+        raise Exception("Unknown likert method "+str(method))
+    return likert_codes_from_01_grades(grades)
+
+
+@instrumented
+def likert_transform(values, out=None, method="percentile", chunk_size=DEFAULT_CHUNK_SIZE, n_threads=None):
+    '''
+    The same as likert_using_percentile(values, do_cluster=False) (or likert_using_zscores) but done
+    in chunks, so that values and the result can be larger than memory.  Clustering needs every value
+    in memory at once, so it is not done here.  Only the distinct values are held in memory.
+    :param values: The values, an array, memmap or path to a .npy file
+    :param out: Where to write the result, None for a new array, a path for a new .npy file, or an
+    int8 array or memmap the same shape as values
+    :param method: "percentile" or "zscores"
+    :param chunk_size: The number of values to read at a time
+    :param n_threads: The number of threads to split each large chunk over, None for the setting
+    from dlpy.threads.set_threads
+    :return: out, or the new array or memmap, holding the StandardLikert ivalue() codes as int8
+    '''
+    values = open_input(values)
+    unique_values = sorted_unique(values, chunk_size)
+    codes = likert_codes_of_unique(unique_values, method)
+    out = open_output(out, values.shape, np.int8)
+    result = np.empty(min(chunk_size, len(values)), dtype=np.int8) if out.dtype != np.int8 else None
+    for chunk in chunk_slices(len(values), chunk_size):
+        block = values[chunk]
+        target = out[chunk] if result is None else result[0:len(block)]
+
+        def digitize_part(part):
+            index = np.searchsorted(unique_values, block[part])
+            np.take(codes, index, out=target[part], mode='clip')
+
+        map_chunks(digitize_part, len(block), n_threads)
+        if result is not None:
+            out[chunk] = target
+    return finish_output(out)
+
+@instrumented
 def average_likerts(list_of_likerts)->StandardLikert:
     '''
     Takes the average of a list of likert scores. This is done by
@@ -240,19 +358,34 @@ class ClusterOfNumber:
 
     @staticmethod
     def clustered_values_from_clusters(clusters):
-        max_index = max([max(cluster.indices) for cluster in clusters])
-        rval = [None] * (max_index+1)
+        '''
+        Empty clusters hold no indices, so they are skipped.
+        :return: A list with the center of its cluster for each index in the clusters
+        '''
+        return ClusterOfNumber._centers(clusters).tolist()
+
+    @staticmethod
+    def _centers(clusters):
+        # cluster_simple leaves an empty cluster at the end if the last value broke a cluster up
+        max_index = max([max(cluster.indices) for cluster in clusters if len(cluster.indices) > 0])
+        rval = np.empty(max_index+1)
         for cluster in clusters:
-            for index in cluster.indices:
-                rval[index] = cluster.center()
+            if len(cluster.indices) > 0:
+                rval[cluster.indices] = cluster.center()
         return rval
 
 
+@instrumented
 def cluster_values_simple(values, epsilon=0.05, delta=0.2):
-    clusters = cluster_simple(values, epsilon, delta)
-    return ClusterOfNumber.clustered_values_from_clusters(clusters)
+    return _cluster_centers(values, epsilon, delta).tolist()
+
+
+def _cluster_centers(values, epsilon, delta):
+    # The likert functions go on to work on arrays, so they skip the list that cluster_values_simple returns
+    return ClusterOfNumber._centers(cluster_simple(values, epsilon, delta))
 
 
+@instrumented
 def cluster_simple(values, epsilon=0.05, delta=0.2):
     if epsilon < 0:
         raise Exception("Epsilon must be greater than zero")
@@ -260,6 +393,7 @@ def cluster_simple(values, epsilon=0.05, delta=0.2):
         raise Exception("delta must be greater than zero")
     if delta <= epsilon:
         raise Exception("delta must be bigger than epsilon")
+    values = as_array(values)
     ix_sorted = np.argsort(values)
     scale = np.max(values) - np.min(values)
     if scale == 0:
@@ -267,8 +401,8 @@ def cluster_simple(values, epsilon=0.05, delta=0.2):
     last_value = None
     currentCluster = ClusterOfNumber()
     rval=[currentCluster]
-    for index in ix_sorted:
-        val = values[index]
+    # Walking python numbers is much faster than indexing the array one element at a time
+    for index, val in zip(ix_sorted.tolist(), values[ix_sorted].tolist()):
         if last_value is None:
             last_value = val
         if val - last_value < epsilon*scale:
@@ -293,6 +427,8 @@ def cluster_simple(values, epsilon=0.05, delta=0.2):
     return rval
 
 def table_likerts(values):
+    # pandas is only needed for the table helpers, so we load it on first use
+    import pandas as pd
     values.sort()
     likerts_z = likert_using_zscores(values)
     likerts_z_nc = likert_using_zscores(values, do_cluster=False)
@@ -310,6 +446,7 @@ def table_likerts(values):
 
 
 def plot_likert_pt(x, level, val, size=10):
+    import matplotlib.pyplot as plt
     plot_string = ''
     if val is StandardLikert.L:
         plot_string = 'ro'
@@ -325,6 +462,8 @@ def plot_likert_pt(x, level, val, size=10):
 
 
 def plot_likerts(values, figsize=(12, 7), marker_size=10):
+    import matplotlib.pyplot as plt
+    from matplotlib.lines import Line2D
     # Create the figure
     fig, ax = plt.subplots(figsize=figsize)
     #plt.figure(figsize=figsize)
@@ -4,6 +4,9 @@ Some common mathematical functions
 
 from enum import Enum
 import numpy as np
+from dlpy.instrument import instrumented
+from dlpy.chunked import as_array, float_dtype, write_output
+from dlpy.threads import map_chunks
 
 def linear_interp(x, x1, y1, x2, y2):
     '''
@@ -56,7 +59,7 @@ def decay_exponential(x, x0, y0, m, C, return_params=False):
 
 def decay_linear(x, x0, y0, m, C, k=1, return_params=False):
     '''
-    Creates a funciton of the form f(x)=A/(x-c)^k+B where
+    Creates a funciton of the form f(x)=A/(x-B)^k+C where
     f(x0)=y0
     and
     f'(x0)=m
@@ -79,7 +82,7 @@ def decay_linear(x, x0, y0, m, C, k=1, return_params=False):
     if return_params:
         return (A,B,C)
     else:
-        return A / (x-B) + C
+        return A / (x-B) ** k + C
 
 
 def slope(pt1, pt2):
@@ -164,3 +167,231 @@ def pw_linear(x, pts, lhs_asymptote, rhs_asymptote, decay_type=DecayType.POWER,
             return linear_interp(x, pts[i-1][0], pts[i-1][1], pts[i][0], pts[i][1])
     # We should never make it here
     raise Exception("Should not make it here")
+
+
+def pad_pts(list_of_pts):
+    '''
+    Packs the points of several piecewise linear functions (each like the pts argument of pw_linear)
+    into one array, padded with nan, for use with pw_linear_many.
+    :param list_of_pts: A list, each entry a list of the form (x1, y1), ..., (x_n, y_n)
+    :return: A tuple (pts, lengths) where pts has shape (ncurves, max_n, 2) and lengths[j] is the
+    number of points in curve j
+    '''
+    lengths = np.array([len(curve_pts) for curve_pts in list_of_pts], dtype=np.intp)
+    pts = np.full((len(list_of_pts), max(lengths, default=0), 2), np.nan)
+    for j, curve_pts in enumerate(list_of_pts):
+        if len(curve_pts) > 0:
+            pts[j, 0:len(curve_pts)] = curve_pts
+    return pts, lengths
+
+
+def decay_exponential_params(x0, y0, m, C):
+    '''
+    The array version of decay_exponential(..., return_params=True), all arguments are broadcast
+    against each other, so this calculates the parameters of many decays at once.
+    Instead of raising, a zero slope gives a flat decay that stays at y0, and y0 == C gives
+    A = 0 (i.e. the flat decay at C).
+    :param x0: the x coord of the point whose value we know
+    :param y0: the y coord of the point whose value we know
+    :param m: the slope at the point x0
+    :param C: the asymptotic value
+    :return: A tuple of arrays (A,B,C) for f(x) = A*exp(B*x)+C, see decay_exponential_eval
+    '''
+    x0, y0, m, C = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (x0, y0, m, C)])
+    flat = (m == 0) | (y0 == C)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        B = np.where(flat, 0.0, m / (y0 - C))
+        A = np.where(flat, y0 - C, (y0 - C) / np.exp(B * x0))
+    return A, B, C
+
+
+def decay_exponential_eval(x, A, B, C):
+    '''
+    Evaluates f(x) = A*exp(B*x)+C for parameters from decay_exponential_params, broadcasting x
+    against the parameters.
+    '''
+    with np.errstate(over='ignore', invalid='ignore'):
+        return A * np.exp(B * np.asarray(x)) + C
+
+
+def decay_linear_params(x0, y0, m, C, k=1):
+    '''
+    The array version of decay_linear(..., return_params=True), all arguments are broadcast
+    against each other, so this calculates the parameters of many decays at once.  A zero slope
+    is handled as in decay_linear, by putting the pole one unit to the left of x0.
+    :param x0: the x coord of the point whose value we know
+    :param y0: the y coord of the point whose value we know
+    :param m: the slope at the point x0
+    :param C: the asymptotic value
+    :param k: the power to raise the denominator to
+    :return: A tuple of arrays (A,B,C) for f(x) = A/(x-B)^k+C, see decay_linear_eval
+    '''
+    x0, y0, m, C, k = np.broadcast_arrays(*[np.asarray(v, dtype=float) for v in (x0, y0, m, C, k)])
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        B = np.where(m == 0, x0 - 1, x0 + (y0 - C) * k / m)
+        A = (y0 - C) * (x0 - B) ** k
+    return A, B, C
+
+
+def decay_linear_eval(x, A, B, C, k=1):
+    '''
+    Evaluates f(x) = A/(x-B)^k+C for parameters from decay_linear_params, broadcasting x
+    against the parameters.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        return A / (np.asarray(x) - B) ** k + C
+
+
+def _tail_params(x0, y0, m, C, is_exp, k):
+    '''
+    The (A,B,C) parameters of the decay tails of many curves, as decay_linear (or decay_exponential
+    where is_exp) would calculate them, as an array with one row per curve.
+    '''
+    power = decay_linear_params(x0, y0, m, C, k)
+    exponential = decay_exponential_params(x0, y0, m, C)
+    return np.stack([np.where(is_exp, e, p) for p, e in zip(power, exponential)], axis=1)
+
+
+def _tail_values(x, params, is_exp, k):
+    '''
+    Evaluates the decay tails from _tail_params, x has one column per curve
+    '''
+    A, B, C = params[:, 0], params[:, 1], params[:, 2]
+    return np.where(is_exp, decay_exponential_eval(x, A, B, C), decay_linear_eval(x, A, B, C, k))
+
+
+class PwLinearCurves:
+    '''
+    Many piecewise linear functions (each like the pts of pw_linear) with their decay tails fitted,
+    ready to be evaluated together many times, see pw_linear_many.
+    '''
+    def __init__(self, pts, lengths, lhs_asymptotes, rhs_asymptotes, decay_types=DecayType.POWER, decay_rates=1):
+        '''
+        Constructor, the parameters are as in pw_linear_many
+        '''
+        pts = as_array(pts, float)
+        lengths = as_array(lengths, np.intp)
+        ncurves = pts.shape[0]
+        if np.any(lengths <= 0):
+            raise Exception("No points to linearly interpolate between")
+        self.pts = pts
+        self.lengths = lengths
+        self.lhs_asymptotes = np.broadcast_to(np.asarray(lhs_asymptotes, dtype=float), (ncurves,))
+        self.rhs_asymptotes = np.broadcast_to(np.asarray(rhs_asymptotes, dtype=float), (ncurves,))
+        self.decay_rates = np.broadcast_to(np.asarray(decay_rates, dtype=float), (ncurves,))
+        if isinstance(decay_types, DecayType):
+            decay_types = [decay_types] * ncurves
+        self.is_exp = np.array([decay_type == DecayType.EXPONENTIAL for decay_type in decay_types], dtype=bool)
+        self._fit_tails()
+
+    @staticmethod
+    def from_pts(list_of_pts, lhs_asymptotes, rhs_asymptotes, decay_types=DecayType.POWER, decay_rates=1):
+        '''
+        Creates the curves from a list of points lists, see pad_pts
+        '''
+        pts, lengths = pad_pts(list_of_pts)
+        return PwLinearCurves(pts, lengths, lhs_asymptotes, rhs_asymptotes, decay_types, decay_rates)
+
+    def decay_types(self):
+        '''
+        :return: The list of the DecayType of each curve
+        '''
+        return [DecayType.EXPONENTIAL if is_exp else DecayType.POWER for is_exp in self.is_exp]
+
+    def _fit_tails(self):
+        curves = np.arange(len(self.lengths))
+        lengths = self.lengths
+        knots_x = self.pts[:, :, 0]
+        knots_y = self.pts[:, :, 1]
+        self.x_first = knots_x[:, 0]
+        self.x_last = knots_x[curves, lengths - 1]
+        y_first = knots_y[:, 0]
+        y_last = knots_y[curves, lengths - 1]
+        # The slopes the tails start with, a single point decays up or down towards the asymptotes
+        single = lengths == 1
+        single_slope = np.where(self.lhs_asymptotes <= self.rhs_asymptotes, 1.0, -1.0)
+        second = np.minimum(1, lengths - 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m_lhs = (y_first - knots_y[curves, second]) / (self.x_first - knots_x[curves, second])
+            m_rhs = (knots_y[curves, lengths - 2] - y_last) / (knots_x[curves, lengths - 2] - self.x_last)
+        m_lhs = np.where(single, single_slope, m_lhs)
+        m_rhs = np.where(single, single_slope, m_rhs)
+        # The (A,B,C) of each curve's tails, one row per curve
+        self.lhs_params = _tail_params(self.x_first, y_first, m_lhs, self.lhs_asymptotes, self.is_exp,
+                                       self.decay_rates)
+        self.rhs_params = _tail_params(self.x_last, y_last, m_rhs, self.rhs_asymptotes, self.is_exp,
+                                       self.decay_rates)
+
+    def evaluate(self, X, out=None, dtype=np.float64, n_threads=None):
+        '''
+        Evaluates the j-th curve on the j-th column of X, see pw_linear_many
+        :param X: A 2d array with one row per alternative and one column per curve
+        :param out: If not None, where to write the result, an array the same shape as X
+        :param dtype: The float dtype to calculate in, and of the result.  np.float32 halves the
+        memory of the temporaries, but the decay tails lose accuracy far from the points.
+        :param n_threads: The number of threads to split the rows of a large X over, None for the
+        setting from dlpy.threads.set_threads
+        :return: out, or a new 2d array the same shape as X
+        '''
+        dtype = float_dtype(dtype)
+        X = as_array(X, dtype)
+        if X.ndim != 2:
+            return write_output(self._evaluate_rows(X, dtype), out, dtype)
+        rval = np.empty(X.shape, dtype)
+
+        def evaluate_chunk(chunk):
+            rval[chunk] = self._evaluate_rows(X[chunk], dtype)
+
+        map_chunks(evaluate_chunk, X.shape[0], n_threads, row_size=X.shape[1])
+        return write_output(rval, out, dtype)
+
+    def _evaluate_rows(self, X, dtype):
+        lengths = self.lengths
+        curves = np.arange(len(lengths))
+        knots_x = self.pts[:, :, 0].astype(dtype)
+        knots_y = self.pts[:, :, 1].astype(dtype)
+        valid = np.arange(self.pts.shape[1]) < lengths[:, np.newaxis]
+        single = lengths == 1
+        # The interior, find the first point i >= 1 with x_i >= x, and interpolate from the point before it
+        below = (knots_x[np.newaxis, :, :] < X[:, :, np.newaxis]) & valid[np.newaxis, :, :]
+        i = np.clip(np.sum(below, axis=2), 1, np.maximum(lengths - 1, 1))
+        del below
+        prev_i = np.where(single, 0, i - 1)
+        i = np.where(single, 0, i)
+        x1 = knots_x[curves, prev_i]
+        y1 = knots_y[curves, prev_i]
+        x2 = knots_x[curves, i]
+        y2 = knots_y[curves, i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rval = np.where(x1 == x2, (y1 + y2) / 2, y1 + (y2 - y1) / (x2 - x1) * (X - x1))
+        decay_rates = self.decay_rates.astype(dtype)
+        rval = np.where(X < knots_x[:, 0], _tail_values(X, self.lhs_params.astype(dtype), self.is_exp, decay_rates),
+                        rval)
+        rval = np.where(X > knots_x[curves, lengths - 1],
+                        _tail_values(X, self.rhs_params.astype(dtype), self.is_exp, decay_rates), rval)
+        return rval
+
+
+@instrumented
+def pw_linear_many(X, pts, lengths, lhs_asymptotes, rhs_asymptotes, decay_types=DecayType.POWER, decay_rates=1,
+                   out=None, dtype=np.float64, n_threads=None):
+    '''
+    Evaluates many piecewise linear functions at once, the j-th function on the j-th column of X.
+    This is the same as calling pw_linear(X[i, j], <j-th points>, lhs_asymptotes[j], rhs_asymptotes[j],
+    decay_types[j], decay_rates[j]) for every i and j, but in one vectorized pass.  The one difference
+    is that an exponential tail with zero slope stays flat instead of raising an exception.  To evaluate
+    the same functions many times, fit them once with PwLinearCurves.
+    :param X: A 2d array with one row per alternative and one column per function
+    :param pts: The points of every function, padded, with shape (nfunctions, max_n, 2), see pad_pts
+    :param lengths: The number of points in each function
+    :param lhs_asymptotes: The lhs asymptote of each function, or a single value for all of them
+    :param rhs_asymptotes: The rhs asymptote of each function, or a single value for all of them
+    :param decay_types: The DecayType of each function, or a single DecayType for all of them
+    :param decay_rates: The power decay rate of each function, or a single value for all of them
+    :param out: If not None, where to write the result, an array the same shape as X
+    :param dtype: The float dtype to calculate in, see PwLinearCurves.evaluate
+    :param n_threads: The number of threads to split a large X over, see PwLinearCurves.evaluate
+    :return: out, or a new 2d array the same shape as X
+    '''
+    return PwLinearCurves(pts, lengths, lhs_asymptotes, rhs_asymptotes, decay_types, decay_rates).evaluate(
+        X, out, dtype, n_threads)
@@ -0,0 +1,163 @@
+'''
+Running a per-entity transform over many entities (e.g. thousands of portfolios) on a process pool,
+without pickling the inputs into every worker.
+
+The entities' values are concatenated into one array, with offsets marking where each one starts,
+i.e. entity i is values[offsets[i]:offsets[i+1]].  The values, offsets, any plans and the output
+are put in shared memory blocks, each worker attaches them once, and then each task is just a range
+of entities whose results the worker writes straight into its slice of the output.  The result
+therefore does not depend on how the tasks were scheduled.  Small jobs are run in this process.
+
+    values, offsets = concat_segments(portfolio_scores)
+    codes = segment_map("likert", values, offsets)
+    grades = segment_map("grade", values, offsets, plans=plans)
+'''
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from dlpy.likert import likert_using_default
+from dlpy.percentile import GcpCurve
+from dlpy.ap.scoring import RankScoringV1
+from dlpy.shared import open_block
+from dlpy.chunked import as_array
+
+# Jobs with fewer values than this in total are run serially
+DEFAULT_MIN_PARALLEL = 100000
+# The number of tasks we aim to give each worker, more balances better but costs more dispatching
+TASKS_PER_WORKER = 4
+# op -> (output dtype, True if there is one result per value rather than one per entity)
+OPS = {"likert": (np.int8, True), "gcp": (np.float64, True), "grade": (np.float64, False)}
+
+# The worker process's attached blocks and arrays, set by _init_worker
+_worker = {}
+
+
+def concat_segments(segments, dtype=np.float64):
+    '''
+    Concatenates a list of list-like segments
+    :param segments: The list of segments
+    :param dtype: The dtype of the concatenated values
+    :return: A tuple (values, offsets) where segment i is values[offsets[i]:offsets[i+1]]
+    '''
+    offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(segment) for segment in segments])
+    values = np.empty(offsets[-1], dtype=dtype)
+    for i, segment in enumerate(segments):
+        values[offsets[i]:offsets[i + 1]] = segment
+    return values, offsets
+
+
+def _apply(op, values, offsets, plans, out, start, stop, kwargs):
+    '''
+    Runs the op on segments start to stop, writing into out
+    '''
+    for i in range(start, stop):
+        lo, hi = offsets[i], offsets[i + 1]
+        segment = values[lo:hi]
+        if op == "likert":
+            out[lo:hi] = [likert.ivalue() for likert in likert_using_default(segment, **kwargs)]
+        elif op == "gcp":
+            out[lo:hi] = GcpCurve.fit(segment, **kwargs).evaluate(segment)
+        else:
+            rks = kwargs.get("rks")
+            if rks is None:
+                rks = RankScoringV1.standard(segment)
+            out[i] = rks.grade(segment, plans[lo:hi])
+
+
+def _task_bounds(offsets, ntasks):
+    '''
+    Splits the segments into at most ntasks contiguous ranges with about the same number of values
+    :return: A list of (start, stop) segment ranges
+    '''
+    nsegments = len(offsets) - 1
+    targets = np.linspace(0, offsets[-1], ntasks + 1)[1:-1]
+    cuts = np.unique(np.concatenate([[0], np.searchsorted(offsets[:-1], targets), [nsegments]]))
+    return [(int(start), int(stop)) for start, stop in zip(cuts[:-1], cuts[1:])]
+
+
+def _create_block(array):
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    view[...] = array
+    return block, view
+
+
+def _init_worker(op, layout, kwargs):
+    _worker.clear()
+    _worker["op"] = op
+    _worker["kwargs"] = kwargs
+    for field, (block_name, dtype, shape) in layout.items():
+        block = open_block(block_name)
+        _worker[field + "_block"] = block
+        _worker[field] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+def _run_task(bounds):
+    start, stop = bounds
+    _apply(_worker["op"], _worker["values"], _worker["offsets"], _worker.get("plans"), _worker["out"], start, stop,
+           _worker["kwargs"])
+
+
+def segment_map(op, values, offsets=None, plans=None, workers=None, min_parallel=DEFAULT_MIN_PARALLEL, **kwargs):
+    '''
+    Applies an op to every segment (entity) of values
+    :param op: One of
+        "likert": likert_using_default of each segment, the result is an int8 array of ivalue() codes, one per value
+        "gcp": each value's gcp within its segment, as GcpCurve.fit(segment).evaluate(segment), one per value
+        "grade": RankScoringV1.grade of each segment's plan on its scores, one per segment.  By default
+        each segment is graded with RankScoringV1.standard(segment), pass rks= to use the same one for all.
+    :param values: The concatenated values, or a list of segments if offsets is None
+    :param offsets: The offsets of the segments, see concat_segments
+    :param plans: For "grade", the concatenated plans (laid out like values), or a list of them if offsets is None
+    :param workers: The number of processes, defaults to the number of cpus
+    :param min_parallel: If there are fewer values than this, we run in this process
+    :param kwargs: Passed on to likert_using_default, GcpCurve.fit, or rks= for "grade"
+    :return: A numpy array of the results
+    '''
+    if op not in OPS:
+        raise Exception("Unknown op "+str(op))
+    dtype, per_value = OPS[op]
+    if offsets is None:
+        values, offsets = concat_segments(values)
+        if plans is not None:
+            plans = concat_segments(plans)[0]
+    values = as_array(values)
+    offsets = as_array(offsets, np.int64)
+    if op == "grade":
+        if plans is None:
+            raise Exception("grade needs plans")
+        plans = as_array(plans)
+        if len(plans) != len(values):
+            raise Exception("There must be one plan value per value")
+    nsegments = len(offsets) - 1
+    out = np.zeros(len(values) if per_value else nsegments, dtype=dtype)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if (workers <= 1) or (nsegments < 2) or (len(values) < min_parallel):
+        _apply(op, values, offsets, plans, out, 0, nsegments, kwargs)
+        return out
+    inputs = {"values": values, "offsets": offsets, "out": out}
+    if plans is not None:
+        inputs["plans"] = plans
+    blocks = []
+    try:
+        layout = {}
+        views = {}
+        for field, array in inputs.items():
+            block, views[field] = _create_block(array)
+            blocks.append(block)
+            layout[field] = (block.name, array.dtype.str, array.shape)
+        tasks = _task_bounds(offsets, workers * TASKS_PER_WORKER)
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks)), initializer=_init_worker,
+                                 initargs=(op, layout, kwargs)) as executor:
+            for result in executor.map(_run_task, tasks):
+                pass
+        out[...] = views["out"]
+        del views
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return out
@@ -2,10 +2,99 @@
 Calculations around percentiling.
 
 '''
-from dlpy.maths import  pw_linear, DecayType
-from collections import OrderedDict
+from dlpy.maths import  pw_linear, DecayType, decay_linear_params, decay_linear_eval, \
+    decay_exponential_params, decay_exponential_eval
+from dlpy.instrument import instrumented
+from dlpy.threads import map_chunks
+from dlpy.chunked import DEFAULT_CHUNK_SIZE, as_array, open_input, open_output, finish_output, chunk_slices, \
+    float_dtype, write_output
 import numpy as np
 
+# The largest range of integers we will count with np.bincount instead of sorting
+SMALL_INT_RANGE = 1 << 16
+
+
+def small_int_counts(X, small_ints=None, max_range=SMALL_INT_RANGE):
+    '''
+    Counts the occurrences of each value of X, if X is integer data with a small range
+    (e.g. 1-5 survey answers or rank positions).
+    :param X: The values
+    :param small_ints: If None we only count integer typed data.  If True we also count floats
+    whose values are all integers.  If False we never count.
+    :param max_range: The largest max(X)-min(X) we will count
+    :return: A tuple (lowest, counts) where counts[i] is the number of times lowest+i occurs in X,
+    or None if X is not small integer data.
+    '''
+    if small_ints is False:
+        return None
+    X = as_array(X)
+    if (X.size == 0) or (X.ndim != 1):
+        return None
+    if X.dtype.kind == 'f' and small_ints:
+        if not np.all(np.isfinite(X)) or not np.all(X == np.floor(X)):
+            return None
+    elif X.dtype.kind not in 'iu':
+        # Bools are left to np.unique, they do not support the subtraction
+        return None
+    lowest = X.min()
+    if int(X.max()) - int(lowest) > max_range:
+        return None
+    counts = np.bincount(_small_int_index(X, lowest))
+    return lowest, counts
+
+
+def _small_int_index(X, lowest):
+    '''
+    X - lowest as indices, without wrapping around in a narrow signed dtype like int8
+    '''
+    if X.dtype.kind == 'i':
+        return X.astype(np.int64) - int(lowest)
+    # Floats are exact, and unsigned ints never go below their lowest
+    return (X - lowest).astype(np.intp)
+
+
+def unique_inverse(X, small_ints=None):
+    '''
+    The sorted unique values of X, and where each element of X is in them.  Small integer data is
+    done by counting in O(n + k) instead of sorting, see small_int_counts.
+    :param X: The values
+    :param small_ints: See small_int_counts
+    :return: A tuple (unique_values, inverse) of numpy arrays, where unique_values[inverse] == X
+    '''
+    X = as_array(X)
+    counted = small_int_counts(X, small_ints)
+    if counted is None:
+        unique_values, inverse = np.unique(X, return_inverse=True)
+        return unique_values, inverse.ravel()
+    lowest, counts = counted
+    present = counts > 0
+    lookup = np.cumsum(present) - 1
+    unique_values = (np.flatnonzero(present) + lowest).astype(X.dtype)
+    return unique_values, lookup[_small_int_index(X, lowest)]
+
+
+@instrumented
+def std_percs(X, small_ints=None):
+    '''
+    The standard percentile rank of every element of X within X, i.e. the same as
+    [std_perc(X, x) for x in X], but in one pass.  Small integer data is done by counting
+    in O(n + k) instead of sorting, see small_int_counts.
+    :param X: The values
+    :param small_ints: See small_int_counts
+    :return: A numpy array of the percentile ranks
+    '''
+    X = as_array(X)
+    counted = small_int_counts(X, small_ints)
+    if counted is None:
+        unique_values, inverse, counts = np.unique(X, return_inverse=True, return_counts=True)
+        index = inverse.ravel()
+    else:
+        lowest, counts = counted
+        index = _small_int_index(X, lowest)
+    less = np.cumsum(counts) - counts
+    return ((less + 0.5*counts)/len(X))[index]
+
+
 def std_perc(X,s):
     '''
     Given a sequence of numbers X, calculate the percentile rank/score of the item s
@@ -14,14 +103,8 @@ def std_perc(X,s):
     :param s:
     :return:
     '''
-    e=0
-    l=0
-    for x in X:
-        if x < s:
-            l+=1
-        elif x==s:
-            e+=1
-    return (l + 0.5*e)/len(X)
+    X = as_array(X)
+    return (np.count_nonzero(X < s) + 0.5*np.count_nonzero(X == s))/len(X)
 
 
 def gcp_sorted_deduped(X, s, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1,
@@ -52,16 +135,23 @@ def gcp_sorted_deduped(X, s, epsilon=0.01, decay_type=DecayType.POWER, decay_rat
     else:
         return pw_linear(s, pts, 0, 1, decay_type=decay_type, decay_rate=decay_rate)
 
-def sort_dedupe(X):
+@instrumented
+def sort_dedupe(X, small_ints=None):
     '''
     Sorts the elements of X and removes duplicates
     :param X:
+    :param small_ints: See small_int_counts, small integer data is deduplicated by counting instead
+    of sorting.
     :return: New list with elements sorted and deduplicated
     '''
-    deduped = list(OrderedDict.fromkeys(X))
-    deduped.sort()
-    return deduped
+    X = as_array(X)
+    counted = small_int_counts(X, small_ints)
+    if counted is not None:
+        lowest, counts = counted
+        return (np.flatnonzero(counts) + lowest).astype(X.dtype).tolist()
+    return np.unique(X).tolist()
 
+@instrumented
 def gcp(X, s, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1, return_params=False):
     '''
     Very much like gcp_sorted_deduped, except it does not expect X to be deduped and sorted,
@@ -81,6 +171,7 @@ def gcp(X, s, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1, return_par
                               decay_rate=decay_rate,
                               return_params=return_params)
 
+@instrumented
 def gcp_sorted_deduped_inverse(X, v, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1):
     '''
     Calculates the inverse of the grading compatible percentile score s in X.
@@ -135,6 +226,7 @@ def gcp_sorted_deduped_inverse(X, v, epsilon=0.01, decay_type=DecayType.POWER, d
         return pw_linear(v, inv_pts, 0, 1, decay_type=decay_type, decay_rate=decay_rate)
 
 
+@instrumented
 def gcp_inverse(X, v, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1, return_params=False):
     '''
     Very much like gcp_sorted_deduped, except it does not expect X to be deduped and sorted,
@@ -153,6 +245,7 @@ def gcp_inverse(X, v, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1, re
     return gcp_sorted_deduped_inverse(Y, v, epsilon, decay_type=decay_type,
                                       decay_rate=decay_rate)
 
+@instrumented
 def gcp_approx_pts(X, epsilon, percentiles=None, decay_type=DecayType.POWER, decay_rate=1):
     '''
     Gets the piecewise linear points to use to approximate the GCP function with the sequence X.
@@ -171,3 +264,337 @@ def gcp_approx_pts(X, epsilon, percentiles=None, decay_type=DecayType.POWER, dec
         pts.append((gcp_sorted_deduped_inverse(Y, per, epsilon, decay_type=decay_type, decay_rate=decay_rate), per))
     return pts
 
+
+def _grouped_knots(X, keys):
+    '''
+    Sorts X by (key, value) in one lexsort and finds the distinct values (the knots) of each group.
+    :return: A tuple (order, group_keys, knots, knot_group, knot_start, knot_count, knot_ix) where order
+    sorts (keys, X), group_keys are the distinct keys, sorted, knots the distinct values of each group
+    laid out group after group with knot_group the group of each, knot_start and knot_count where
+    each group's knots are, and knot_ix the knot each element of X (in sorted order) is.
+    '''
+    order = np.lexsort((X, keys))
+    sorted_keys = keys[order]
+    sorted_X = X[order]
+    new_group = np.empty(len(X), dtype=bool)
+    new_group[0:1] = True
+    new_group[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    new_knot = new_group.copy()
+    new_knot[1:] |= sorted_X[1:] != sorted_X[:-1]
+    knot_ix = np.cumsum(new_knot) - 1
+    knots = sorted_X[new_knot]
+    knot_group = np.cumsum(new_group)[new_knot] - 1
+    group_keys = sorted_keys[new_group]
+    knot_count = np.bincount(knot_group, minlength=len(group_keys))
+    knot_start = np.cumsum(knot_count) - knot_count
+    return order, group_keys, knots, knot_group, knot_start, knot_count, knot_ix
+
+
+@instrumented
+def gcp_grouped(X, keys, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1, S=None, S_keys=None, out=None,
+                dtype=np.float64):
+    '''
+    The grading compatible percentile of each value within its own group, i.e. the same as
+    gcp(X[keys == keys[i]], X[i], ...) for every i, but with one sort for all of the groups.
+    :param X: The values
+    :param keys: The group of each value, anything numpy can sort, the same length as X
+    :param epsilon: The epsilon, see gcp_sorted_deduped
+    :param decay_type: Power or Exponential decay?
+    :param decay_rate: If Power decay, what power to use?
+    :param S: If not None, we score these values instead of X, each within the group of X given
+    by S_keys.  Values outside of their group's range are scored with the epsilon tails.
+    :param S_keys: The group of each element of S, every one must be a key in keys
+    :param out: If not None, where to write the result, an array the same length as X (or S)
+    :param dtype: The float dtype of the result, the percentiles are calculated in float64
+    :return: out, or a numpy array of the percentiles, in the same order as X (or S).  A group with
+    only one distinct value scores 0.5 at that value, and nan anywhere else.
+    '''
+    dtype = float_dtype(dtype)
+    X = as_array(X, float)
+    keys = as_array(keys)
+    if len(keys) != len(X):
+        raise Exception("X and keys must be the same length")
+    if len(X) == 0:
+        return write_output(np.zeros(0 if S is None else len(S)), out, dtype)
+    order, group_keys, knots, knot_group, knot_start, knot_count, knot_ix = _grouped_knots(X, keys)
+    if S is None:
+        # Each value is one of its group's knots, so the number of knots below it is its dense rank
+        values = np.empty(len(X))
+        values[order] = knots[knot_ix]
+        group = np.empty(len(X), dtype=np.intp)
+        group[order] = knot_group[knot_ix]
+        below = np.empty(len(X), dtype=np.intp)
+        below[order] = knot_ix - knot_start[knot_group[knot_ix]]
+    else:
+        values = as_array(S, float)
+        S_keys = as_array(S_keys)
+        if len(S_keys) != len(values):
+            raise Exception("S and S_keys must be the same length")
+        group = np.minimum(np.searchsorted(group_keys, S_keys), len(group_keys) - 1)
+        if np.any(group_keys[group] != S_keys):
+            raise Exception("S_keys has a key that is not in keys")
+        # Sorting the knots and the values together by (group, value), with values before knots
+        # they equal, the knots before each value are the ones below it
+        is_value = np.concatenate((np.zeros(len(knots), dtype=bool), np.ones(len(values), dtype=bool)))
+        merged = np.lexsort((is_value, np.concatenate((knots, values)), np.concatenate((knot_group, group))))
+        knots_before = np.cumsum(~is_value[merged]) - ~is_value[merged]
+        below = np.empty(len(values), dtype=np.intp)
+        value_positions = merged >= len(knots)
+        below[merged[value_positions] - len(knots)] = knots_before[value_positions]
+        below -= knot_start[group]
+    return write_output(_gcp_evaluate(values, knots, knot_start[group], knot_count[group], below, epsilon,
+                                      decay_type, decay_rate), out, dtype)
+
+
+def _gcp_evaluate(values, knots, start, count, below, epsilon, decay_type, decay_rate):
+    '''
+    Evaluates grading compatible percentile curves, vectorized.  The curve for each value is built
+    from knots[start:start+count] (start and count may be arrays, one entry per value, or scalars
+    for a single curve) and below is the number of those knots less than the value.
+    '''
+    # The points of each group's curve are (knot_j, y_j) with y_0 = epsilon, y_j = j/(count-1) and
+    # y_last = 1-epsilon, interpolated between the first point at or above the value and the one before
+    last = np.maximum(count - 1, 1)
+
+    def y_of(j):
+        return np.where(j == 0, epsilon, np.where(j >= count - 1, 1 - epsilon, j / last))
+
+    i = np.clip(below, 1, last)
+    x1 = knots[start + np.minimum(i - 1, count - 1)]
+    x2 = knots[start + np.minimum(i, count - 1)]
+    y1 = y_of(i - 1)
+    y2 = y_of(i)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rval = np.where(x1 == x2, (y1 + y2) / 2, y1 + (y2 - y1) / (x2 - x1) * (values - x1))
+    first = knots[start]
+    final = knots[start + count - 1]
+    lhs = values < first
+    rhs = values > final
+    if np.any(lhs) or np.any(rhs):
+        x_second = knots[start + np.minimum(1, count - 1)]
+        x_before = knots[start + np.maximum(count - 2, 0)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m_lhs = (epsilon - y_of(np.ones_like(count))) / (first - x_second)
+            m_rhs = (y_of(count - 2) - (1 - epsilon)) / (x_before - final)
+        if decay_type == DecayType.POWER:
+            lhs_values = decay_linear_eval(values, *decay_linear_params(first, epsilon, m_lhs, 0, decay_rate),
+                                           decay_rate)
+            rhs_values = decay_linear_eval(values, *decay_linear_params(final, 1 - epsilon, m_rhs, 1, decay_rate),
+                                           decay_rate)
+        elif decay_type == DecayType.EXPONENTIAL:
+            lhs_values = decay_exponential_eval(values, *decay_exponential_params(first, epsilon, m_lhs, 0))
+            rhs_values = decay_exponential_eval(values, *decay_exponential_params(final, 1 - epsilon, m_rhs, 1))
+        else:
+            raise Exception("Unknown decay type")
+        rval = np.where(lhs, lhs_values, np.where(rhs, rhs_values, rval))
+    # A single distinct value has no curve to decay from
+    rval = np.where((count == 1) & (values != first), np.nan, rval)
+    return rval
+
+
+@instrumented
+def sorted_unique(X, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    The sorted distinct values of X, found a chunk at a time so X can be larger than memory.
+    Only the distinct values found so far are held between chunks.
+    :param X: The values, an array, memmap or path to a .npy file
+    :param chunk_size: The number of values to read at a time
+    :return: A numpy array of the distinct values, sorted
+    '''
+    X = open_input(X)
+    rval = np.zeros(0, dtype=X.dtype)
+    for chunk in chunk_slices(len(X), chunk_size):
+        rval = np.union1d(rval, X[chunk])
+    return rval
+
+
+class GcpCurve:
+    '''
+    A fitted grading compatible percentile curve, i.e. the curve gcp(X, s) evaluates, kept so that
+    it can be applied to any number of values (in chunks, or out of core) without refitting.
+    '''
+    def __init__(self, knots, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1):
+        '''
+        :param knots: The distinct values of the data, sorted
+        :param epsilon: The epsilon, see gcp_sorted_deduped
+        :param decay_type: Power or Exponential decay?
+        :param decay_rate: If Power decay, what power to use?
+        '''
+        self.knots = as_array(knots, float)
+        if len(self.knots) == 0:
+            raise Exception("Cannot fit a curve to no values")
+        self.epsilon = epsilon
+        self.decay_type = decay_type
+        self.decay_rate = decay_rate
+        # dtype -> (knots, y at each knot, slope after each knot), see _tables
+        self._tables_by_dtype = {}
+        self._tail_params = None
+
+    @staticmethod
+    def fit(X, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        Fits the curve to X in streaming passes, see sorted_unique
+        :param X: The values, an array, memmap or path to a .npy file
+        :return: The GcpCurve
+        '''
+        return GcpCurve(sorted_unique(X, chunk_size), epsilon, decay_type, decay_rate)
+
+    def pts(self):
+        '''
+        :return: The points of the piecewise linear function, as gcp_sorted_deduped builds them
+        '''
+        return gcp_sorted_deduped(self.knots, 0, self.epsilon, self.decay_type, self.decay_rate,
+                                  return_params=True)[0]
+
+    def _tables(self, dtype):
+        '''
+        The knots, the y of each knot and the slope from each knot to the next, as dtype.  These are
+        worked out in float64 once, so the float64 results are exactly those of gcp.
+        '''
+        if dtype not in self._tables_by_dtype:
+            knots = self.knots
+            ys = np.arange(len(knots)) / max(len(knots) - 1, 1)
+            ys[0] = self.epsilon
+            ys[-1] = 1 - self.epsilon
+            slopes = (ys[1:] - ys[:-1]) / (knots[1:] - knots[:-1])
+            self._tables_by_dtype[dtype] = tuple(np.ascontiguousarray(table, dtype=dtype)
+                                                 for table in (knots, ys, slopes))
+        return self._tables_by_dtype[dtype]
+
+    def _tails(self):
+        '''
+        :return: The (A,B,C) parameters of the left and right decay tails, see decay_linear_params
+        '''
+        if self._tail_params is None:
+            knots, ys, slopes = self._tables(np.dtype(float))
+            first, final = knots[0], knots[-1]
+            m_lhs = (self.epsilon - ys[1]) / (first - knots[1])
+            m_rhs = (ys[-2] - (1 - self.epsilon)) / (knots[-2] - final)
+            if self.decay_type == DecayType.POWER:
+                self._tail_params = (decay_linear_params(first, self.epsilon, m_lhs, 0, self.decay_rate),
+                                     decay_linear_params(final, 1 - self.epsilon, m_rhs, 1, self.decay_rate))
+            elif self.decay_type == DecayType.EXPONENTIAL:
+                self._tail_params = (decay_exponential_params(first, self.epsilon, m_lhs, 0),
+                                     decay_exponential_params(final, 1 - self.epsilon, m_rhs, 1))
+            else:
+                raise Exception("Unknown decay type")
+        return self._tail_params
+
+    def _tail_values(self, values, params):
+        values = np.asarray(values, dtype=float)
+        if self.decay_type == DecayType.POWER:
+            return decay_linear_eval(values, *params, self.decay_rate)
+        return decay_exponential_eval(values, *params)
+
+    def _evaluate_into(self, S, out, work, original):
+        '''
+        Evaluates the curve at S, writing into out, which has S's shape and dtype.  work is scratch
+        space of the same shape and dtype, so the only temporaries are the knot indices.  original
+        is S as we were given it, before it was cast to dtype, which the tails are evaluated from.
+        '''
+        if len(self.knots) == 1:
+            S64 = np.asarray(original, dtype=float)
+            out[...] = _gcp_evaluate(S64, self.knots, 0, 1, np.searchsorted(self.knots, S64, side='left'),
+                                     self.epsilon, self.decay_type, self.decay_rate)
+            return out
+        knots, ys, slopes = self._tables(out.dtype)
+        # The index of the knot before each value, and the interpolation from it
+        j = np.asarray(np.searchsorted(knots, S, side='left'))
+        j -= 1
+        np.clip(j, 0, len(knots) - 2, out=j)
+        np.take(knots, j, out=work, mode='clip')
+        np.subtract(S, work, out=work)
+        np.take(slopes, j, out=out, mode='clip')
+        np.multiply(out, work, out=out)
+        np.take(ys, j, out=work, mode='clip')
+        np.add(work, out, out=out)
+        # The tails are steep near their poles, so they are worked out from the uncast values in
+        # float64, and only the results are rounded to dtype
+        lhs = original < self.knots[0]
+        rhs = original > self.knots[-1]
+        if np.any(lhs) or np.any(rhs):
+            lhs_params, rhs_params = self._tails()
+            out[lhs] = self._tail_values(original[lhs], lhs_params)
+            out[rhs] = self._tail_values(original[rhs], rhs_params)
+        return out
+
+    def _evaluate_threaded(self, S, out, work, n_threads, original):
+        '''
+        _evaluate_into, split into chunks on the thread pool when S is big enough, see dlpy.threads
+        '''
+        if S.ndim != 1:
+            return self._evaluate_into(S, out, work, original)
+        map_chunks(lambda chunk: self._evaluate_into(S[chunk], out[chunk], work[chunk], original[chunk]), len(S),
+                   n_threads)
+        return out
+
+    def evaluate(self, S, out=None, dtype=np.float64, n_threads=None):
+        '''
+        The same as gcp(X, s) for each s in S, where X is the data we were fit to
+        :param S: The values to score
+        :param out: If not None, an array the same shape as S to write the result into
+        :param dtype: The float dtype to calculate in and return.  np.float32 halves the memory of
+        the result and temporaries.  Between the first and last knots it is accurate to about 1e-5,
+        as the values are rounded to float32 before they are interpolated.  The decay tails are
+        calculated in float64 from the values as given, and only their results are rounded.
+        :param n_threads: The number of threads to split a large S over, None for the setting from
+        dlpy.threads.set_threads
+        :return: out, or a new numpy array of the percentiles
+        '''
+        dtype = float_dtype(dtype)
+        original = as_array(S)
+        S = as_array(original, dtype)
+        if (out is not None) and isinstance(out, np.ndarray) and (out.dtype == dtype) and (out.shape == S.shape):
+            return self._evaluate_threaded(S, out, np.empty(S.shape, dtype), n_threads, original)
+        rval = self._evaluate_threaded(S, np.empty(S.shape, dtype), np.empty(S.shape, dtype), n_threads, original)
+        return write_output(rval, out, dtype)
+
+    @instrumented(size_arg=1)
+    def transform(self, S, out=None, chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64, n_threads=None):
+        '''
+        Scores S a chunk at a time, so S and the result can be larger than memory.  The scratch space
+        is allocated once and reused for every chunk.
+        :param S: The values to score, an array, memmap or path to a .npy file
+        :param out: Where to write the result, None for a new array, a path for a new .npy file,
+        or an array or memmap of the same shape as S
+        :param chunk_size: The number of values to score at a time
+        :param dtype: The float dtype to calculate in, and of a new result, see evaluate
+        :param n_threads: The number of threads to split each chunk over, see evaluate
+        :return: out, or the new array or memmap
+        '''
+        dtype = float_dtype(dtype)
+        S = open_input(S)
+        out = open_output(out, S.shape, dtype)
+        size = min(chunk_size, len(S))
+        work = np.empty(size, dtype)
+        values = np.empty(size, dtype) if S.dtype != dtype else None
+        result = np.empty(size, dtype) if out.dtype != dtype else None
+        for chunk in chunk_slices(len(S), chunk_size):
+            n = chunk.stop - chunk.start
+            original = S[chunk]
+            if values is None:
+                chunk_values = original
+            else:
+                chunk_values = values[0:n]
+                chunk_values[...] = original
+            if result is None:
+                self._evaluate_threaded(chunk_values, out[chunk], work[0:n], n_threads, original)
+            else:
+                out[chunk] = self._evaluate_threaded(chunk_values, result[0:n], work[0:n], n_threads, original)
+        return finish_output(out)
+
+
+def gcp_transform(X, out=None, epsilon=0.01, decay_type=DecayType.POWER, decay_rate=1,
+                  chunk_size=DEFAULT_CHUNK_SIZE, dtype=np.float64, n_threads=None):
+    '''
+    The grading compatible percentile of every element of X within X, i.e. the same as
+    [gcp(X, x) for x in X], done in chunks so that X and the result can be larger than memory.
+    :param X: The values, an array, memmap or path to a .npy file
+    :param out: Where to write the result, see GcpCurve.transform
+    :param chunk_size: The number of values to read at a time
+    :param dtype: The float dtype to calculate in, see GcpCurve.evaluate
+    :param n_threads: The number of threads to split each chunk over, see GcpCurve.evaluate
+    :return: out, or the new array or memmap
+    '''
+    return GcpCurve.fit(X, epsilon, decay_type, decay_rate, chunk_size).transform(X, out, chunk_size, dtype,
+                                                                                  n_threads)
@@ -0,0 +1,174 @@
+'''
+Saving fitted curves and prepared rankings to a compact, versioned binary file, and loading them
+back without refitting.
+
+The file is an uncompressed .npz (so numpy can read it anywhere) with a __header__ member holding
+a small JSON header with the format version and what each object is.  Because the members are
+stored uncompressed, load memory maps them in place, so loading is zero-copy and takes the same
+few milliseconds however big the arrays are.
+
+    save("curves.npz", {"sales": GcpCurve.fit(sales), "costs": GcpCurve.fit(costs)})
+    curves = load("curves.npz")
+'''
+import json
+import zipfile
+import numpy as np
+from dlpy.maths import DecayType, PwLinearCurves
+from dlpy.percentile import GcpCurve
+from dlpy.ap.scoring import RankScoringV1, SparsePlan, PreparedRanking
+
+FORMAT = "dlpy"
+FORMAT_VERSION = 1
+_HEADER = "__header__"
+# The member holding a single object, when save is not given a dict
+_SINGLE = "object"
+
+
+def _decay_name(decay_type):
+    return "EXPONENTIAL" if decay_type == DecayType.EXPONENTIAL else "POWER"
+
+
+def _encode_rks(rks):
+    return {"targets": [rks.a_target, rks.b_target, rks.c_target, rks.d_target],
+            "out_ofs": [rks.a_out_of, rks.b_out_of, rks.c_out_of, rks.d_out_of],
+            "use_rank_interpolate": bool(rks.use_rank_interpolate), "grade_decay_rate": rks.grade_decay_rate}
+
+
+def _decode_rks(meta):
+    targets, out_ofs = meta["targets"], meta["out_ofs"]
+    rks = RankScoringV1(targets[0], out_ofs[0], targets[1], out_ofs[1], targets[2], out_ofs[2], targets[3], out_ofs[3],
+                        meta["use_rank_interpolate"])
+    rks.grade_decay_rate = meta["grade_decay_rate"]
+    return rks
+
+
+def to_arrays(obj):
+    '''
+    Breaks a fitted object down into plain numpy arrays and JSON-able settings
+    :param obj: A GcpCurve, PwLinearCurves or PreparedRanking
+    :return: A tuple (kind, meta, arrays) where meta is JSON-able and arrays is a dict of numpy arrays
+    '''
+    if isinstance(obj, GcpCurve):
+        return "GcpCurve", {"epsilon": obj.epsilon, "decay_type": _decay_name(obj.decay_type),
+                            "decay_rate": obj.decay_rate}, {"knots": obj.knots}
+    elif isinstance(obj, PwLinearCurves):
+        # The tail parameters are not needed to load, but are saved for readers outside of dlpy
+        return "PwLinearCurves", {}, {
+            "pts": obj.pts, "lengths": obj.lengths, "lhs_asymptotes": obj.lhs_asymptotes,
+            "rhs_asymptotes": obj.rhs_asymptotes, "decay_rates": obj.decay_rates, "is_exp": obj.is_exp,
+            "lhs_params": obj.lhs_params, "rhs_params": obj.rhs_params}
+    elif isinstance(obj, PreparedRanking):
+        arrays = {"ranked": np.asarray(obj.ranked)}
+        plans = []
+        for i, plan in enumerate(obj.best_plans):
+            arrays["plan{}_indices".format(i)] = plan.indices
+            arrays["plan{}_amounts".format(i)] = np.asarray(plan.amounts)
+            plans.append({"nitems": int(plan.nitems), "fill": plan.fill})
+        return "PreparedRanking", {"rks": _encode_rks(obj.rks), "nitems": int(obj.nitems), "plans": plans}, arrays
+    else:
+        raise Exception("Do not know how to save a "+type(obj).__name__)
+
+
+def from_arrays(kind, meta, arrays):
+    '''
+    Rebuilds the object to_arrays broke down, using the arrays as they are (i.e. without copying them)
+    :param kind: The kind from to_arrays
+    :param meta: The settings from to_arrays
+    :param arrays: The dict of arrays from to_arrays
+    :return: The object
+    '''
+    if kind == "GcpCurve":
+        return GcpCurve(arrays["knots"], meta["epsilon"], DecayType[meta["decay_type"]], meta["decay_rate"])
+    elif kind == "PwLinearCurves":
+        decay_types = [DecayType.EXPONENTIAL if is_exp else DecayType.POWER for is_exp in arrays["is_exp"]]
+        return PwLinearCurves(arrays["pts"], arrays["lengths"], arrays["lhs_asymptotes"], arrays["rhs_asymptotes"],
+                              decay_types, arrays["decay_rates"])
+    elif kind == "PreparedRanking":
+        best_plans = tuple(SparsePlan(arrays["plan{}_indices".format(i)], arrays["plan{}_amounts".format(i)],
+                                      plan["nitems"], plan["fill"]) for i, plan in enumerate(meta["plans"]))
+        return PreparedRanking.from_parts(_decode_rks(meta["rks"]), meta["nitems"], arrays["ranked"], best_plans)
+    else:
+        raise Exception("Do not know how to load a "+str(kind))
+
+
+def save(path, obj):
+    '''
+    Saves fitted objects to a file
+    :param path: The file to write, it should end in .npz (numpy adds it otherwise)
+    :param obj: A GcpCurve, PwLinearCurves or PreparedRanking, or a dict of names to them
+    :return: Nothing
+    '''
+    objects = obj if isinstance(obj, dict) else {_SINGLE: obj}
+    header = {"format": FORMAT, "version": FORMAT_VERSION, "single": not isinstance(obj, dict), "objects": {}}
+    members = {}
+    for name, value in objects.items():
+        if "/" in name:
+            raise Exception("Object names cannot contain /")
+        kind, meta, arrays = to_arrays(value)
+        header["objects"][name] = {"kind": kind, "meta": meta}
+        for field, array in arrays.items():
+            members["{}/{}".format(name, field)] = np.ascontiguousarray(array)
+    members[_HEADER] = np.frombuffer(json.dumps(header).encode("utf-8"), dtype=np.uint8)
+    np.savez(path, **members)
+
+
+def _memmap_members(path):
+    '''
+    Memory maps every member of an uncompressed .npz file
+    :return: A dict of member name to array, or None if some member cannot be memory mapped
+    '''
+    rval = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                return None
+            # The member's data starts after its local header, whose name and extra field lengths can
+            # differ from those in the central directory
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length = int.from_bytes(local_header[26:28], "little")
+            extra_length = int.from_bytes(local_header[28:30], "little")
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                return None
+            if dtype.hasobject:
+                return None
+            name = info.filename[:-len(".npy")] if info.filename.endswith(".npy") else info.filename
+            if int(np.prod(shape)) == 0:
+                rval[name] = np.zeros(shape, dtype=dtype)
+            else:
+                rval[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                       order="F" if fortran_order else "C")
+    return rval
+
+
+def load(path, mmap=True):
+    '''
+    Loads what save wrote
+    :param path: The file to read
+    :param mmap: If True the arrays are memory mapped read only from the file instead of read into memory
+    :return: The object, or the dict of names to objects, as it was saved
+    '''
+    members = _memmap_members(path) if mmap else None
+    if members is None:
+        with np.load(path, allow_pickle=False) as npz:
+            members = {name: npz[name] for name in npz.files}
+    if _HEADER not in members:
+        raise Exception("Not a dlpy file, there is no header")
+    header = json.loads(bytes(np.asarray(members.pop(_HEADER))).decode("utf-8"))
+    if header.get("format") != FORMAT:
+        raise Exception("Not a dlpy file")
+    if header["version"] > FORMAT_VERSION:
+        raise Exception("The file is version {}, we can only read up to version {}".format(
+            header["version"], FORMAT_VERSION))
+    objects = {}
+    for name, description in header["objects"].items():
+        prefix = name + "/"
+        arrays = {member[len(prefix):]: array for member, array in members.items() if member.startswith(prefix)}
+        objects[name] = from_arrays(description["kind"], description["meta"], arrays)
+    return objects[_SINGLE] if header["single"] else objects
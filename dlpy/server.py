@@ -0,0 +1,266 @@
+'''
+A small asyncio scoring server that keeps fitted models in memory and scores many tiny requests
+in micro-batches.  Requests that arrive within max_wait seconds of each other (up to max_batch of
+them) for the same operation and model are scored together with one vectorized call, in a thread
+pool, so the event loop is never blocked.
+
+The protocol is one JSON object per line over TCP, e.g.
+
+    {"id": 1, "op": "gcp", "model": "sales", "value": 1234.5}
+    {"id": 2, "op": "likert", "model": "sales", "value": 1234.5}
+    {"id": 3, "op": "likert", "value": 0.73}
+    {"id": 4, "op": "grade", "model": "portfolio", "plan": [1, 0, 1, ...]}
+    {"id": 5, "op": "stats"}
+
+and each gets one line back, {"id": 1, "result": 0.52} or {"id": 1, "error": "..."}.  Plans may also
+be objects of project index to amount funded, e.g. {"3": 1, "17": 0.5}.
+
+    server = ScoringServer({"sales": GcpCurve.fit(sales), "portfolio": rks.prepare(scores)})
+    asyncio.run(server.serve("127.0.0.1", 8765))
+'''
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from dlpy.percentile import GcpCurve
+from dlpy.likert import likert_codes_from_01_grades
+from dlpy.ap.scoring import PreparedRanking, SparsePlan
+
+OPS = ("gcp", "likert", "grade")
+
+
+def _plan_of(plan, nitems):
+    '''
+    Checks and converts a plan from a request
+    :param plan: A list of the amount funded of each project, or a dict of project index to amount
+    :param nitems: The number of projects the model ranks
+    :return: A SparsePlan, or a float numpy array of length nitems
+    '''
+    if isinstance(plan, dict):
+        funded = {int(index): float(amount) for index, amount in plan.items()}
+        if any((index < 0) or (index >= nitems) for index in funded):
+            raise Exception("Plan project indices must be from 0 to "+str(nitems - 1))
+        return SparsePlan.from_dict(funded, nitems)
+    plan = np.asarray(plan, dtype=float)
+    if plan.shape != (nitems,):
+        raise Exception("The plan has shape {} but the model ranks {} projects".format(plan.shape, nitems))
+    return plan
+
+
+class ScoringServer:
+    '''
+    Scores requests against in memory models in micro-batches, see the module documentation
+    '''
+    def __init__(self, models=None, max_batch=256, max_wait=0.002, threads=1, latency_window=10000):
+        '''
+        Constructor
+        :param models: A dict of name to GcpCurve (for gcp and likert) or PreparedRanking (for grade)
+        :param max_batch: The most requests to score together
+        :param max_wait: The most seconds to wait for more requests after the first one of a batch
+        :param threads: The number of threads to score batches in
+        :param latency_window: The number of most recent requests the latency percentiles are over
+        '''
+        self.models = dict(models or {})
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        # (op, model name) -> asyncio.Queue of (value, future, start time), and the task batching it
+        self.queues = {}
+        self.batchers = {}
+        self.latencies = deque(maxlen=latency_window)
+        self.requests = 0
+        self.batches = 0
+        self.max_batch_seen = 0
+
+    def _score(self, op, model, values):
+        '''
+        Scores a batch, in a worker thread
+        :return: A list of results, one per value
+        '''
+        if op == "gcp":
+            return model.evaluate(np.asarray(values, dtype=float)).tolist()
+        elif op == "likert":
+            grades = np.asarray(values, dtype=float)
+            if model is not None:
+                grades = model.evaluate(grades)
+            return likert_codes_from_01_grades(grades).tolist()
+        else:
+            return model.grade_many(values).tolist()
+
+    def _score_each(self, op, model, values):
+        '''
+        Scores a batch one value at a time, in a worker thread, so that a value that fails only fails itself
+        :return: A list of (result, exception) pairs, one per value
+        '''
+        rval = []
+        for value in values:
+            try:
+                rval.append((self._score(op, model, [value])[0], None))
+            except Exception as e:
+                rval.append((None, e))
+        return rval
+
+    def _prepare(self, op, model, value):
+        '''
+        Checks and converts one request's value (or plan), so that a bad one is rejected before it
+        can fail the batch it would be scored in
+        '''
+        if op == "grade":
+            return _plan_of(value, model.nitems)
+        if isinstance(value, (str, bytes)):
+            raise Exception("The value must be a number, not "+repr(value))
+        return float(value)
+
+    def _check(self, op, model_name):
+        if op not in OPS:
+            raise Exception("Unknown op "+str(op))
+        if (model_name is None) and (op == "likert"):
+            return None
+        if model_name not in self.models:
+            raise Exception("Unknown model "+str(model_name))
+        model = self.models[model_name]
+        wanted = PreparedRanking if op == "grade" else GcpCurve
+        if not isinstance(model, wanted):
+            raise Exception("Model {} cannot be used for {}".format(model_name, op))
+        return model
+
+    async def submit(self, op, model_name, value):
+        '''
+        Scores one value (or plan for grade), batched with any others that arrive at the same time
+        :param op: One of OPS
+        :param model_name: The name of the model to use, which may be None for likert of a 0-1 grade
+        :param value: The value to score, or the plan to grade
+        :return: The result
+        '''
+        value = self._prepare(op, self._check(op, model_name), value)
+        key = (op, model_name)
+        if key not in self.queues:
+            self.queues[key] = asyncio.Queue()
+            self.batchers[key] = asyncio.get_running_loop().create_task(self._batcher(key))
+        future = asyncio.get_running_loop().create_future()
+        self.queues[key].put_nowait((value, future, time.perf_counter()))
+        return await future
+
+    async def _batcher(self, key):
+        op, model_name = key
+        queue = self.queues[key]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                if queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(queue.get_nowait())
+            values = [value for value, future, start in batch]
+            try:
+                model = self._check(op, model_name)
+            except Exception as e:
+                outcomes = [(None, e)] * len(batch)
+            else:
+                try:
+                    outcomes = [(result, None) for result in
+                                await loop.run_in_executor(self.executor, self._score, op, model, values)]
+                except Exception:
+                    # Find out which values failed, so the others still get their results
+                    outcomes = await loop.run_in_executor(self.executor, self._score_each, op, model, values)
+            for (value, future, start), (result, error) in zip(batch, outcomes):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+            now = time.perf_counter()
+            self.latencies.extend(now - start for value, future, start in batch)
+            self.requests += len(batch)
+            self.batches += 1
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+
+    def stats(self):
+        '''
+        :return: A dict with the queue depth, request and batch counts, and the p50, p90 and p99
+        latency in seconds of the most recent requests
+        '''
+        latencies = np.array(self.latencies)
+        if len(latencies) > 0:
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99]).tolist()
+        else:
+            p50 = p90 = p99 = None
+        return {"queue_depth": sum(queue.qsize() for queue in self.queues.values()),
+                "requests": self.requests, "batches": self.batches, "max_batch": self.max_batch_seen,
+                "latency_p50": p50, "latency_p90": p90, "latency_p99": p99}
+
+    async def _respond(self, line, writer, lock):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            if request.get("op") == "stats":
+                response = {"id": request_id, "result": self.stats()}
+            else:
+                value = request["plan"] if request.get("op") == "grade" else request["value"]
+                response = {"id": request_id, "result": await self.submit(request.get("op"), request.get("model"),
+                                                                         value)}
+        except Exception as e:
+            response = {"id": request_id, "error": str(e)}
+        async with lock:
+            writer.write((json.dumps(response) + "\n").encode("utf-8"))
+            await writer.drain()
+
+    async def _handle(self, reader, writer):
+        # Requests on one connection are scored concurrently, so responses can come back out of order
+        lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.get_running_loop().create_task(self._respond(line, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=0):
+        '''
+        Starts listening
+        :param host: The address to listen on
+        :param port: The port, 0 for any free port
+        :return: The asyncio Server, see its sockets for the port
+        '''
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def serve(self, host="127.0.0.1", port=0):
+        '''
+        Listens until cancelled
+        '''
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.close()
+
+    async def close(self):
+        '''
+        Stops the batchers and the scoring threads
+        '''
+        for task in self.batchers.values():
+            task.cancel()
+        await asyncio.gather(*self.batchers.values(), return_exceptions=True)
+        self.batchers.clear()
+        self.queues.clear()
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,208 @@
+'''
+Sharing fitted curves and prepared rankings between processes through shared memory, so that
+many workers can score with one copy of the arrays instead of one copy each.
+
+The publishing process copies each object's arrays (see dlpy.serialize.to_arrays) into one
+multiprocessing.shared_memory block, after a small JSON header.  Any process can then attach
+the object by name, which only builds read-only numpy views onto the block: nothing is copied
+or pickled.
+
+    # In the parent
+    registry = SharedRegistry()
+    registry.publish("sales", GcpCurve.fit(sales))
+    # In each worker
+    curve = SharedRegistry().attach("sales")
+
+Attachments are reference counted within each process, and release closes the block once the
+last one is released.  unpublish removes the block's name, and the memory itself is freed by
+the operating system once every process that has it attached has closed it.
+'''
+import json
+import os
+import sys
+import threading
+import weakref
+from multiprocessing import shared_memory
+import numpy as np
+from dlpy.serialize import to_arrays, from_arrays
+
+# Arrays are laid out on this byte alignment in the block
+_ALIGNMENT = 64
+# The header is preceded by its length in this many bytes
+_LENGTH_BYTES = 8
+# Held while we stop the resource tracker registering a block, see open_block
+_register_lock = threading.Lock()
+
+
+def open_block(block_name):
+    '''
+    Attaches to an existing shared memory block without registering it with the resource tracker.
+    Before python 3.13 attaching registers the block as if we had created it, so a process that is
+    not a child of the publisher would destroy the block when it exits.
+    :param block_name: The name of the block
+    :return: The multiprocessing.shared_memory.SharedMemory, which the caller must close
+    '''
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=block_name, track=False)
+    if os.name != "posix":
+        return shared_memory.SharedMemory(name=block_name)
+    from multiprocessing import resource_tracker
+    with _register_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=block_name)
+        finally:
+            resource_tracker.register = register
+
+
+def _aligned(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _load(block):
+    '''
+    Builds the object published in a block, on read-only views of it
+    :return: A tuple (object, list of weak references to the views)
+    '''
+    length = int.from_bytes(bytes(block.buf[0:_LENGTH_BYTES]), "little")
+    header = json.loads(bytes(block.buf[_LENGTH_BYTES:_LENGTH_BYTES + length]).decode("utf-8"))
+    arrays = {}
+    for field, description in header["arrays"].items():
+        view = np.ndarray(description["shape"], dtype=np.dtype(description["dtype"]), buffer=block.buf,
+                          offset=description["offset"])
+        view.flags.writeable = False
+        arrays[field] = view
+    return from_arrays(header["kind"], header["meta"], arrays), [weakref.ref(view) for view in arrays.values()]
+
+
+class SharedRegistry:
+    '''
+    Publishes objects into shared memory blocks and attaches them, see the module documentation
+    '''
+    def __init__(self, prefix="dlpy_"):
+        '''
+        Constructor
+        :param prefix: Put in front of every object name to make the shared memory block name
+        '''
+        self.prefix = prefix
+        # Name -> SharedMemory, for the blocks we created
+        self.published = {}
+        # Name -> [SharedMemory, object, count, weak references to the views], for the blocks we attached
+        self.attached = {}
+
+    def block_name(self, name):
+        return self.prefix + name
+
+    def publish(self, name, obj):
+        '''
+        Copies an object into a new shared memory block
+        :param name: The name workers attach it by
+        :param obj: A GcpCurve, PwLinearCurves or PreparedRanking
+        :return: The name of the shared memory block
+        '''
+        if name in self.published:
+            raise Exception("Already published "+name)
+        kind, meta, arrays = to_arrays(obj)
+        layout = {}
+        # The header's size depends on the offsets, which depend on the header's size, so we lay the
+        # arrays out after a generous guess at the header size and grow the guess until it fits
+        start = 256
+        while True:
+            offset = start
+            for field, array in arrays.items():
+                array = np.asarray(array)
+                layout[field] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+                offset = _aligned(offset + array.nbytes)
+            header = json.dumps({"kind": kind, "meta": meta, "arrays": layout}).encode("utf-8")
+            if _LENGTH_BYTES + len(header) <= start:
+                break
+            start = _aligned(_LENGTH_BYTES + len(header))
+        block = shared_memory.SharedMemory(name=self.block_name(name), create=True, size=max(offset, 1))
+        try:
+            block.buf[0:_LENGTH_BYTES] = len(header).to_bytes(_LENGTH_BYTES, "little")
+            block.buf[_LENGTH_BYTES:_LENGTH_BYTES + len(header)] = header
+            for field, array in arrays.items():
+                description = layout[field]
+                view = np.ndarray(description["shape"], dtype=np.dtype(description["dtype"]), buffer=block.buf,
+                                  offset=description["offset"])
+                view[...] = array
+                del view
+        except BaseException:
+            block.close()
+            block.unlink()
+            raise
+        self.published[name] = block
+        return block.name
+
+    def attach(self, name):
+        '''
+        Gets a published object, its arrays are read-only views of the shared memory.  Each attach
+        should be matched by a release.
+        :param name: The name it was published under
+        :return: The object
+        '''
+        if name in self.attached:
+            self.attached[name][2] += 1
+            return self.attached[name][1]
+        block = open_block(self.block_name(name))
+        obj, views = _load(block)
+        self.attached[name] = [block, obj, 1, views]
+        return obj
+
+    def release(self, name):
+        '''
+        Releases one attach of an object.  After the last one the block is closed in this process,
+        so every reference to the object and its arrays must have been dropped by then.  If not, we
+        raise and it stays attached, to be released again once they have been.
+        :param name: The name it was published under
+        :return: Nothing
+        '''
+        entry = self.attached[name]
+        entry[2] -= 1
+        if entry[2] > 0:
+            return
+        block, obj, count, views = entry
+        # numpy does not hold on to the block's buffer, so closing it would not fail while its views
+        # are alive, it would unmap the memory under them.  We drop our own reference to the object
+        # and check nothing else still holds it or its arrays.
+        obj = weakref.ref(obj)
+        entry[1] = None
+        if (obj() is not None) or any(view() is not None for view in views):
+            # Keep tracking it, so that it can be released once it is no longer used
+            entry[1] = obj()
+            if entry[1] is None:
+                entry[1], new_views = _load(block)
+                views.extend(new_views)
+            entry[2] = 1
+            raise Exception("Cannot release {}, it is still in use".format(name))
+        block.close()
+        del self.attached[name]
+
+    def unpublish(self, name):
+        '''
+        Removes a block we published.  Processes that already attached it keep working until they
+        release it, when the memory is freed.
+        :param name: The name it was published under
+        :return: Nothing
+        '''
+        block = self.published[name]
+        block.close()
+        block.unlink()
+        del self.published[name]
+
+    def close(self):
+        '''
+        Releases everything we attached and unpublishes everything we published
+        '''
+        for name in list(self.attached.keys()):
+            self.attached[name][2] = 1
+            self.release(name)
+        for name in list(self.published.keys()):
+            self.unpublish(name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
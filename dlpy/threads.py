@@ -0,0 +1,123 @@
+'''
+Splitting large array transforms into chunks that run on a shared thread pool.  Numpy releases
+the GIL in sorts, searchsorted, take and elementwise math, so the chunks run on several cores at
+once without the cost of starting processes or pickling data.
+
+Threading is off by default.  Turn it on for everything with
+
+    set_threads(8)
+
+or for one call with n_threads=, e.g. curve.evaluate(S, n_threads=8).  Inputs with fewer than
+min_size elements always run in the calling thread, where splitting would cost more than it saves.
+'''
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# Inputs smaller than this are not split
+DEFAULT_MIN_SIZE = 1 << 18
+
+_n_threads = 1
+_min_size = DEFAULT_MIN_SIZE
+_lock = threading.Lock()
+_executor = None
+_executor_size = 0
+# Set in the pool's threads, so that a chunk that calls another threaded transform runs it serially
+# instead of waiting on the pool it is running in
+_local = threading.local()
+
+
+def set_threads(n_threads=None, min_size=None):
+    '''
+    Sets how many threads the transforms use when they are not given n_threads
+    :param n_threads: The number of threads, 1 to run everything in the calling thread, None for
+    the number of cpus
+    :param min_size: If not None, the fewest elements an input must have to be split
+    :return: Nothing
+    '''
+    global _n_threads, _min_size
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    if n_threads < 1:
+        raise Exception("n_threads must be at least 1")
+    _n_threads = n_threads
+    if min_size is not None:
+        _min_size = min_size
+
+
+def get_threads():
+    '''
+    :return: A tuple (n_threads, min_size) of the current settings, see set_threads
+    '''
+    return _n_threads, _min_size
+
+
+@contextmanager
+def using_threads(n_threads=None, min_size=None):
+    '''
+    Changes the settings (see set_threads) inside a with block, and puts them back afterwards
+    '''
+    previous = get_threads()
+    set_threads(n_threads, min_size)
+    try:
+        yield
+    finally:
+        set_threads(*previous)
+
+
+def _get_executor(size):
+    global _executor, _executor_size
+    with _lock:
+        if _executor_size < size:
+            # Another thread may still be submitting to the old pool, so we let it go rather than
+            # shutting it down, its idle threads exit once it is garbage collected
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="dlpy",
+                                           initializer=_mark_worker)
+            _executor_size = size
+        return _executor
+
+
+def _mark_worker():
+    _local.in_pool = True
+
+
+def chunk_bounds(n, n_threads=None, min_size=None, row_size=1):
+    '''
+    How a transform of n elements (or rows) is split
+    :param n: The number of elements, or of rows
+    :param n_threads: The number of threads, None for the setting from set_threads
+    :param min_size: The fewest elements to split, None for the setting from set_threads
+    :param row_size: The number of elements in each row, if we are splitting rows
+    :return: A list of slices, a single one if the work is not split
+    '''
+    n_threads = _n_threads if n_threads is None else n_threads
+    min_size = _min_size if min_size is None else min_size
+    if (n_threads <= 1) or (n < 2) or (n * row_size < min_size) or getattr(_local, "in_pool", False):
+        return [slice(0, n)]
+    nchunks = min(n_threads, n)
+    edges = [n * i // nchunks for i in range(nchunks + 1)]
+    return [slice(start, stop) for start, stop in zip(edges[:-1], edges[1:])]
+
+
+def map_chunks(func, n, n_threads=None, min_size=None, row_size=1):
+    '''
+    Runs func on each chunk of range(n), see chunk_bounds.  The first chunk runs in the calling
+    thread and the rest on the shared pool.
+    :param func: A function of a slice
+    :param n: The number of elements, or of rows
+    :param n_threads: The number of threads, None for the setting from set_threads
+    :param min_size: The fewest elements to split, None for the setting from set_threads
+    :param row_size: The number of elements in each row, if we are splitting rows
+    :return: The list of func's results, in chunk order
+    '''
+    chunks = chunk_bounds(n, n_threads, min_size, row_size)
+    if len(chunks) == 1:
+        return [func(chunks[0])]
+    executor = _get_executor(len(chunks) - 1)
+    futures = [executor.submit(func, chunk) for chunk in chunks[1:]]
+    try:
+        first = func(chunks[0])
+    finally:
+        rest = [future.result() for future in futures]
+    return [first] + rest
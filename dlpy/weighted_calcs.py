@@ -1,16 +1,79 @@
 import numpy as np
+from dlpy.instrument import instrumented
+from dlpy.chunked import as_array
+from dlpy.threads import map_chunks
 
 
-def wtd_mean(values, weights):
+@instrumented
+def wtd_mean(values, weights, dtype=None, n_threads=None):
     '''
     Calculates the weighted mean of a set of values
     :param values: The values to take the weighted mean of
     :param weights: The weights
+    :param dtype: If not None, the dtype to calculate in, e.g. np.float32 to use float32 data without
+    converting it (the sums are then only accurate to about 1e-7 relative)
+    :param n_threads: The number of threads to split large inputs over, None for the setting from
+    dlpy.threads.set_threads.  The sums are then added up in a different order, so the result can
+    differ from the single threaded one in the last few bits.
     :return: 
     '''
-    values = np.array(values)
-    weights = np.array(weights)
-    return np.dot(values, weights) / weights.sum()
+    values = as_array(values, dtype)
+    weights = as_array(weights, dtype)
+    if values.ndim != 1:
+        return np.dot(values, weights) / weights.sum()
+    sums = map_chunks(lambda chunk: (np.dot(values[chunk], weights[chunk]), weights[chunk].sum()),
+                      len(values), n_threads)
+    return sum(total for total, _ in sums) / sum(weight for _, weight in sums)
+
+
+@instrumented
+def wtd_mean_grouped(values, weights, keys, nkeys=None, dtype=np.float64, out=None, n_threads=None):
+    '''
+    Calculates the weighted mean of each group of values, without a python call per group.
+    :param values: The values to take the weighted means of, either 1d, or 2d with one row per
+    item and one column per metric to average.
+    :param weights: The weight of each item (i.e. each row of values)
+    :param keys: The group of each item, anything np.unique can handle
+    :param nkeys: If not None, keys are already integer group codes 0, 1, ..., nkeys-1 and we skip
+    finding the unique keys
+    :param dtype: The float dtype of values and weights while we work, np.float32 halves the memory of
+    the copies and temporaries.  Each group's totals are always added up in float64.
+    :param out: If not None, where to write the means, an array of the shape they would be returned as
+    :param n_threads: The number of threads to split the group totals of a large 1d values over,
+    None for the setting from dlpy.threads.set_threads
+    :return: A tuple (unique_keys, means), sorted by key.  means has one entry per group if values
+    is 1d, otherwise one row per group and one column per metric.
+    '''
+    values = as_array(values, dtype)
+    weights = as_array(weights, dtype)
+    if nkeys is None:
+        unique_keys, groups = np.unique(keys, return_inverse=True)
+        groups = groups.ravel()
+        nkeys = len(unique_keys)
+    else:
+        unique_keys = np.arange(nkeys)
+        groups = as_array(keys)
+    if values.ndim == 1:
+        def group_totals(chunk):
+            chunk_weights = weights[chunk]
+            return (np.bincount(groups[chunk], weights=values[chunk] * chunk_weights, minlength=nkeys),
+                    np.bincount(groups[chunk], weights=chunk_weights, minlength=nkeys))
+
+        sums = map_chunks(group_totals, len(values), n_threads)
+        totals = sum(chunk_totals for chunk_totals, _ in sums)
+        total_weights = sum(chunk_weights for _, chunk_weights in sums)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return unique_keys, np.divide(totals, total_weights, out=out)
+    total_weights = np.bincount(groups, weights=weights, minlength=nkeys)
+    # Many metrics at once, sort the rows by group and add up each group's block of rows
+    order = np.argsort(groups, kind='stable')
+    sorted_groups = groups[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_groups[1:] != sorted_groups[:-1])))
+    totals = np.zeros((nkeys, values.shape[1]))
+    if len(order) > 0:
+        totals[sorted_groups[starts]] = np.add.reduceat(values[order] * weights[order, np.newaxis], starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return unique_keys, np.divide(totals, total_weights[:, np.newaxis], out=out)
 
 
 def lin_interp(x, x1, y1, x2, y2):
@@ -50,48 +113,402 @@ def approx_equal(a, b, per_diff=1e-15) -> bool:
     return np.abs(b-a)/((np.abs(a)+np.abs(b))/2) <= per_diff
 
 
+def _approx_equal_arrays(a, b, per_diff=1e-15):
+    '''
+    The elementwise version of approx_equal, for numpy arrays
+    '''
+    a = np.asarray(a)
+    b = np.asarray(b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rval = np.abs(b-a)/((np.abs(a)+np.abs(b))/2) <= per_diff
+    return rval | ((a == 0) & (b == 0))
+
+
+def _crossings(cum, targets):
+    '''
+    Finds where the cumulative areas cross each of the targets, walking the areas in order like
+    wtd_median does.
+    :param cum: The cumulative areas, i.e. cumsum of the weights sorted by value
+    :param targets: The areas we are looking for
+    :return: A tuple (equal_ix, above_ix) of integer arrays, one entry per target.  equal_ix is the
+    first index whose area is approx_equal to the target, above_ix is the first other index whose area
+    is above the target.  Either is len(cum) if there is no such index.
+    '''
+    n = len(cum)
+    targets = np.asarray(targets, dtype=float)
+    if np.all(cum[1:] >= cum[:-1]):
+        # Non-negative weights, so the areas are sorted and we can binary search them.
+        # Nothing below target*(1-per_diff) can be approx_equal, and the approx_equal
+        # areas are all next to each other, so the first one is at most one distinct
+        # value after that.
+        first = np.searchsorted(cum, targets - np.abs(targets)*1e-15, side='left')
+        equal_ix = np.full(targets.shape, n, dtype=np.intp)
+        candidate = first
+        for i in range(2):
+            inside = candidate < n
+            found = np.zeros(targets.shape, dtype=bool)
+            found[inside] = _approx_equal_arrays(cum[candidate[inside]], targets[inside])
+            found &= (equal_ix == n)
+            equal_ix[found] = candidate[found]
+            candidate = np.searchsorted(cum, cum[np.minimum(candidate, n-1)], side='right')
+        above_ix = np.searchsorted(cum, targets, side='right')
+        above_ix = np.where((above_ix == equal_ix) & (above_ix < n), above_ix + 1, above_ix)
+        return equal_ix, above_ix
+    # Negative weights, the areas go up and down so we have to look at them all
+    positions = np.arange(n)
+    equal_ix = np.full(targets.shape, n, dtype=np.intp)
+    above_ix = np.full(targets.shape, n, dtype=np.intp)
+    for i, target in enumerate(targets.flat):
+        equal = np.flatnonzero(_approx_equal_arrays(cum, target))
+        if len(equal) > 0:
+            equal_ix.flat[i] = equal[0]
+        above = np.flatnonzero((cum > target) & (positions != equal_ix.flat[i]))
+        if len(above) > 0:
+            above_ix.flat[i] = above[0]
+    return equal_ix, above_ix
+
+
+def _interpolate_crossings(xs, cum, prev_cum, targets, equal_ix, above_ix):
+    '''
+    Calculates the weighted median (or other quantile) from where the cumulative areas
+    cross the targets, see wtd_median.
+    :param xs: The sorted values
+    :param cum: The cumulative area at each value
+    :param prev_cum: The cumulative area before each value
+    :param targets: The areas we were looking for
+    :param equal_ix: From _crossings
+    :param above_ix: From _crossings
+    :return: A float numpy array, with nan where the target was never crossed
+    '''
+    n = len(cum)
+    targets = np.asarray(targets, dtype=float)
+    rval = np.full(targets.shape, np.nan)
+    crossed = above_ix < n
+    # If we hit the target exactly, we average the equal point and the point we went above it
+    averaged = crossed & (equal_ix < above_ix)
+    rval[averaged] = ((xs[equal_ix[averaged]] + 0.5) + (xs[above_ix[averaged]] - 0.5)) / 2
+    # Otherwise we interpolate between the area before and the area after
+    interp = crossed & ~averaged
+    ix = above_ix[interp]
+    x = xs[ix]
+    area = cum[ix]
+    prev_area = prev_cum[ix]
+    y1 = x - 0.5
+    y2 = x + 0.5
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m = (y2 - y1)/(area - prev_area)
+        rval[interp] = np.where(area == prev_area, (y2 + y1)/2, m*(targets[interp] - prev_area) + y1)
+    return rval
+
+
+@instrumented
 def wtd_median(values, weights):
     '''
-    Calculates the weighted median of a set of values.
+    Calculates the weighted median of a set of values.  Each value is treated as spreading its
+    weight evenly over [value-0.5, value+0.5], and we find where half the total weight is.  If the
+    cumulative weight hits exactly half at some value, the median is the average of the top of that
+    value and the bottom of the next value with weight.
     :param values: The values to calculated the weighted median of
     :param weights: The weights of the values
     :return: The weighted median
     '''
-    pairs = list(zip(values, weights))
-    sorted_pairs = sorted(pairs, key=lambda x: x[0])
-    #print("Sorted Pairs="+str(sorted_pairs))
-    total_weight = np.sum(weights)
-    half_way = total_weight/2
     if len(values) == 0:
         # Nothing to do
         return 0
     elif len(values) == 1:
         # We have only 1 value
         return values[0]
-    #Now we have at least 2 values, we start with first value
-    prev_area = 0
-    xs_with_cumulative_area_equal = []
-    for i in range(len(sorted_pairs)):
-        (x, weight) = sorted_pairs[i]
-        area = prev_area+weight
-        #print("area="+str(area)+" prev_area="+str(prev_area)+" str")
-        if approx_equal(area, half_way) and len(xs_with_cumulative_area_equal) == 0:
-            # Okay we are equal
-            next_x = sorted_pairs[i+1][0]
-            xs_with_cumulative_area_equal.append(x+0.5)
-        elif area > half_way:
-            # We have gone from being below to being above, the median is here
-            # Unless we have other places with area equal
-            if len(xs_with_cumulative_area_equal) > 0:
-                # Okay we need to average the previous equal areas
-                xs_with_cumulative_area_equal.append(x-0.5)
-                return np.mean(xs_with_cumulative_area_equal)
-            # Alright nothing was previously equal, do this
-            (prev_x, prev_weight) = sorted_pairs[i-1]
-            if i!=(len(sorted_pairs)-1):
-                next_x = sorted_pairs[i+1][0]
-            else:
-                next_x = (x - prev_x) + x
-            return lin_interp(half_way, prev_area, x-0.5, area, x+0.5)
-        prev_area = area
-    return None
\ No newline at end of file
+    values = as_array(values)
+    weights = as_array(weights)
+    order = np.argsort(values, kind='stable')
+    xs = values[order]
+    cum = np.cumsum(weights[order])
+    half_way = np.asarray([np.sum(weights)/2])
+    equal_ix, above_ix = _crossings(cum, half_way)
+    if above_ix[0] == len(cum):
+        return None
+    prev_cum = np.concatenate(([0], cum[:-1]))
+    return _interpolate_crossings(xs, cum, prev_cum, half_way, equal_ix, above_ix)[0]
+
+
+def _wtd_quantile_sorted(xs, sorted_weights, total, qs):
+    '''
+    The weighted quantiles of values that are already sorted, see wtd_quantile
+    :param xs: The sorted values
+    :param sorted_weights: The weights, in the same order as xs
+    :param total: The total weight
+    :param qs: A numpy array of the quantile levels
+    :return: A float numpy array the same shape as qs
+    '''
+    if (len(xs) == 0) or not (total > 0):
+        return np.full(qs.shape, np.nan)
+    cum = np.cumsum(sorted_weights)
+    prev_cum = np.concatenate(([0], cum[:-1]))
+    targets = qs * total
+    equal_ix, above_ix = _crossings(cum, targets)
+    rval = _interpolate_crossings(xs, cum, prev_cum, targets, equal_ix, above_ix)
+    # If we hit the target but never got above it (e.g. the 1.0 quantile) we are at the top of the equal point
+    top = (above_ix == len(cum)) & (equal_ix < len(cum))
+    rval[top] = xs[equal_ix[top]] + 0.5
+    return rval
+
+
+@instrumented
+def wtd_quantile(values, weights, qs, axis=None):
+    '''
+    Calculates weighted quantiles of a set of values, using the same convention as wtd_median, i.e.
+    each value spreads its weight evenly over [value-0.5, value+0.5].  The sort and cumulative
+    weights are shared by all of the quantile levels, so asking for many levels at once is cheap.
+    wtd_quantile(values, weights, 0.5) is the same as wtd_median(values, weights).
+    :param values: The values to calculate the weighted quantiles of
+    :param weights: The weights of the values, either the same shape as values, or 1d with
+    the same length as values along axis.
+    :param qs: The quantile level, or an array-like of levels, each between 0 and 1
+    :param axis: If None we use all of the values, otherwise we calculate the quantiles of each
+    slice along this axis, e.g. axis=0 for each column of a 2d array.
+    :return: If axis is None, a float (if qs is a single level) or an array the same shape as qs.
+    Otherwise an array of shape qs.shape plus the shape of values without axis, like np.quantile.
+    If there are no values, or the total weight is not positive, the quantiles are nan.
+    '''
+    values = as_array(values)
+    weights = as_array(weights)
+    scalar_q = np.ndim(qs) == 0
+    qs = np.asarray(qs, dtype=float)
+    if axis is None:
+        values = values.ravel()
+        weights = np.broadcast_to(weights, values.shape).ravel() if weights.ndim == 0 else weights.ravel()
+        order = np.argsort(values, kind='stable')
+        rval = _wtd_quantile_sorted(values[order], weights[order], np.sum(weights), qs)
+        return rval[()] if scalar_q else rval
+    values = np.moveaxis(values, axis, -1)
+    if weights.ndim == 1:
+        weights = np.broadcast_to(weights, values.shape)
+    else:
+        weights = np.moveaxis(weights, axis, -1)
+    # One sort and cumulative sum for every slice, then each slice is searched on its own
+    order = np.argsort(values, axis=-1, kind='stable')
+    xs = np.take_along_axis(values, order, axis=-1)
+    ws = np.take_along_axis(weights, order, axis=-1)
+    totals = np.sum(weights, axis=-1)
+    other_shape = values.shape[:-1]
+    rval = np.empty(other_shape + qs.shape)
+    for index in np.ndindex(*other_shape):
+        rval[index] = _wtd_quantile_sorted(xs[index], ws[index], totals[index], qs)
+    # Put the quantile levels first, like np.quantile
+    return np.moveaxis(rval, tuple(range(len(other_shape), rval.ndim)), tuple(range(qs.ndim)))
+
+
+def _segmented_cumsum(xs, starts):
+    '''
+    The cumulative sums of each segment of xs, each one summed on its own from zero, so that the
+    rounding is the same as np.cumsum of the segment by itself.  (Subtracting the totals of the
+    earlier segments from one cumsum of everything has rounding errors that grow with the total.)
+    :param xs: The values, with the segments one after another
+    :param starts: The increasing indices the segments start at, the first is 0
+    :return: A float numpy array the same shape as xs
+    '''
+    n = len(xs)
+    sizes = np.diff(np.append(starts, n))
+    cum = np.array(xs, dtype=float)
+    # Long segments are summed one at a time, the short ones a position at a time across all of
+    # them at once, so there are only about 2 sqrt(n) python steps however the sizes are spread
+    long_size = max(int(np.sqrt(n)), 1)
+    is_long = sizes > long_size
+    for start, stop in zip(starts[is_long], starts[is_long] + sizes[is_long]):
+        cum[start:stop] = np.cumsum(xs[start:stop])
+    by_size = np.argsort(-sizes[~is_long], kind='stable')
+    short_starts = starts[~is_long][by_size]
+    minus_sizes = -sizes[~is_long][by_size]
+    for k in range(1, -minus_sizes[0] if len(minus_sizes) > 0 else 0):
+        # The segments with more than k values come first
+        ix = short_starts[:np.searchsorted(minus_sizes, -k)] + k
+        cum[ix] += cum[ix - 1]
+    return cum
+
+
+@instrumented
+def wtd_median_grouped(values, weights, keys):
+    '''
+    Calculates the weighted median of each group of values, in one pass.  The median of each
+    group is the same as calling wtd_median on just that group's values and weights (up to
+    floating point rounding in the interpolation).
+    :param values: The values to calculate the weighted medians of
+    :param weights: The weights of the values
+    :param keys: The group of each value, anything np.unique can handle
+    :return: A tuple (unique_keys, medians) of numpy arrays, sorted by key.  If a group's
+    weights never get above half its total (e.g. they are all zero) its median is nan.
+    '''
+    values = as_array(values)
+    weights = as_array(weights, float)
+    unique_keys, groups = np.unique(as_array(keys), return_inverse=True)
+    groups = groups.ravel()
+    if len(values) == 0:
+        return unique_keys, np.zeros(0)
+    order = np.lexsort((values, groups))
+    groups = groups[order]
+    xs = values[order]
+    ws = weights[order]
+    n = len(xs)
+    starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1])))
+    # Cumulative areas within each group
+    cum = _segmented_cumsum(ws, starts)
+    totals = np.add.reduceat(ws, starts)
+    half_ways = totals / 2
+    positions = np.arange(n)
+    equal = _approx_equal_arrays(cum, half_ways[groups])
+    equal_ix = np.minimum.reduceat(np.where(equal, positions, n), starts)
+    above = (cum > half_ways[groups]) & (positions != equal_ix[groups])
+    above_ix = np.minimum.reduceat(np.where(above, positions, n), starts)
+    # The area before the first item of each group is zero, not the end of the previous group
+    prev_cum = np.concatenate(([0.0], cum[:-1]))
+    prev_cum[starts] = 0
+    rval = _interpolate_crossings(xs, cum, prev_cum, half_ways, equal_ix, above_ix)
+    # A single value is its own median
+    sizes = np.diff(np.append(starts, n))
+    rval[sizes == 1] = xs[starts[sizes == 1]]
+    return unique_keys, rval
+
+
+class WtdMeanAccumulator:
+    '''
+    Keeps a running weighted mean of data that arrives in chunks.  Accumulators built from
+    different chunks (e.g. in different processes) can be merged, and are picklable.
+    '''
+    def __init__(self):
+        self.weighted_total = 0.0
+        self.total_weight = 0.0
+
+    def update(self, values, weights):
+        '''
+        Adds a chunk of data
+        :param values: The values, either 1d, or 2d with one row per item and one column per metric
+        :param weights: The weight of each item
+        :return: self, so calls can be chained
+        '''
+        weights = as_array(weights, float)
+        self.weighted_total = self.weighted_total + np.dot(weights, as_array(values, float))
+        self.total_weight += weights.sum()
+        return self
+
+    def merge(self, other):
+        '''
+        Adds all of the data from another accumulator into this one
+        :param other: The WtdMeanAccumulator to add
+        :return: self, so calls can be chained
+        '''
+        self.weighted_total = self.weighted_total + other.weighted_total
+        self.total_weight += other.total_weight
+        return self
+
+    def mean(self):
+        '''
+        :return: The weighted mean of everything added so far
+        '''
+        return self.weighted_total / self.total_weight
+
+
+class WtdQuantileAccumulator:
+    '''
+    Keeps the data needed for weighted medians and quantiles of data that arrives in chunks.
+    Accumulators built from different chunks (e.g. in different processes) can be merged, and
+    are picklable.
+
+    By default every value is kept, in a sorted run that each chunk is merged into, and the
+    results are the same as wtd_median / wtd_quantile on all of the data (ties are ordered by
+    when they arrived, and merged data comes after our own).
+
+    If max_size is set, equal values are combined into one with their weights summed, so the
+    results are those of wtd_quantile on the distinct values and their total weights.  (These
+    differ from wtd_quantile on the raw data, which interpolates across each repeat on its own.)
+    That is exact, e.g. for integer data, while there are at most max_size distinct values.
+    Beyond that they are compressed into max_size/2 bins of equal weight, each replaced by its
+    weighted median value with the bin's weight, which bounds memory at the cost of exactness but
+    never makes up values that are not in the data.
+    '''
+    def __init__(self, max_size=None):
+        '''
+        Constructor
+        :param max_size: If not None, the most values to keep before compressing
+        '''
+        self.max_size = max_size
+        self.values = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.total_weight = 0.0
+
+    def _merge_sorted(self, values, weights):
+        # Equal values go after the ones we already have, so ties stay in arrival order
+        positions = np.searchsorted(self.values, values, side='right')
+        self.values = np.insert(self.values, positions, values)
+        self.weights = np.insert(self.weights, positions, weights)
+        if self.max_size is not None:
+            self._combine_equal()
+            if len(self.values) > self.max_size:
+                self._compress(max(1, self.max_size // 2))
+
+    def _combine_equal(self):
+        # The values are sorted, so equal ones are next to each other
+        if len(self.values) < 2:
+            return
+        starts = np.flatnonzero(np.concatenate(([True], self.values[1:] != self.values[:-1])))
+        if len(starts) < len(self.values):
+            self.weights = np.add.reduceat(self.weights, starts)
+            self.values = self.values[starts]
+
+    def _compress(self, nbins):
+        cum = np.cumsum(self.weights)
+        if not (cum[-1] > 0):
+            return
+        # Put each value in the bin containing the middle of its weight
+        bins = np.minimum(((cum - self.weights / 2) / cum[-1] * nbins).astype(int), nbins - 1)
+        starts = np.flatnonzero(np.concatenate(([True], bins[1:] != bins[:-1])))
+        stops = np.append(starts[1:], len(bins))
+        bin_weights = np.add.reduceat(self.weights, starts)
+        # Each bin is represented by the value where half its weight is reached
+        half_ways = cum[starts] - self.weights[starts] + bin_weights / 2
+        medians = np.clip(np.searchsorted(cum, half_ways), starts, stops - 1)
+        keep = bin_weights > 0
+        self.values = self.values[medians[keep]]
+        self.weights = bin_weights[keep]
+
+    def update(self, values, weights):
+        '''
+        Adds a chunk of data
+        :param values: The values
+        :param weights: The weight of each value
+        :return: self, so calls can be chained
+        '''
+        values = as_array(values, float).ravel()
+        weights = as_array(weights, float).ravel()
+        order = np.argsort(values, kind='stable')
+        self.total_weight += weights.sum()
+        self._merge_sorted(values[order], weights[order])
+        return self
+
+    def merge(self, other):
+        '''
+        Adds all of the data from another accumulator into this one
+        :param other: The WtdQuantileAccumulator to add
+        :return: self, so calls can be chained
+        '''
+        self.total_weight += other.total_weight
+        self._merge_sorted(other.values, other.weights)
+        return self
+
+    def quantile(self, qs):
+        '''
+        The weighted quantiles of everything added so far, see wtd_quantile
+        :param qs: The quantile level, or an array-like of levels
+        :return: A float, or an array the same shape as qs
+        '''
+        scalar_q = np.ndim(qs) == 0
+        rval = _wtd_quantile_sorted(self.values, self.weights, self.total_weight, np.asarray(qs, dtype=float))
+        return rval[()] if scalar_q else rval
+
+    def median(self):
+        '''
+        The weighted median of everything added so far, see wtd_median
+        :return:
+        '''
+        if len(self.values) == 1:
+            return self.values[0]
+        return self.quantile(0.5)
@@ -0,0 +1,47 @@
+from unittest import TestCase
+import array
+
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+from dlpy.chunked import as_array
+from dlpy.percentile import sort_dedupe, std_perc, std_percs
+from dlpy.likert import likert_using_percentile, cluster_values_simple
+from dlpy.weighted_calcs import wtd_mean, wtd_median
+from dlpy.ap.scoring import RankScoringV1
+
+
+class Test(TestCase):
+    def test_as_array_views_without_copying(self):
+        values = np.arange(6.0)
+        self.assertTrue(np.shares_memory(as_array(values), values))
+        self.assertTrue(np.shares_memory(as_array(values, np.float64), values))
+        series = pd.Series(values)
+        self.assertTrue(np.shares_memory(as_array(series), series.to_numpy()))
+        buffer = array.array('d', [1, 2, 3])
+        self.assertTrue(np.shares_memory(as_array(buffer), as_array(memoryview(buffer))))
+        npt.assert_array_equal(as_array(buffer), [1, 2, 3])
+        # Strided or differently typed inputs have to be copied
+        strided = as_array(values[::2])
+        self.assertTrue(strided.flags.c_contiguous)
+        npt.assert_array_equal(strided, [0, 2, 4])
+        self.assertEqual(as_array([1, 2], np.float32).dtype, np.float32)
+        self.assertEqual(as_array(3.0).shape, ())
+
+    def test_public_functions_take_any_input(self):
+        values = [5.0, 3.0, 9.0, 3.0, 1.0, 7.0]
+        weights = [1.0, 2.0, 1.0, 1.0, 3.0, 1.0]
+        inputs = [values, tuple(values), np.array(values), array.array('d', values),
+                  memoryview(array.array('d', values)), pd.Series(values)]
+        for X in inputs:
+            self.assertEqual(sort_dedupe(X), [1.0, 3.0, 5.0, 7.0, 9.0])
+            npt.assert_array_equal(std_percs(X), std_percs(values))
+            self.assertEqual(std_perc(X, 5.0), 3.5 / 6)
+            npt.assert_array_equal(cluster_values_simple(X), cluster_values_simple(values))
+            self.assertEqual(likert_using_percentile(X), likert_using_percentile(values))
+            self.assertAlmostEqual(wtd_mean(X, pd.Series(weights)), wtd_mean(values, weights))
+            self.assertAlmostEqual(wtd_median(X, weights), wtd_median(values, weights))
+        rks = RankScoringV1.standard(values)
+        plan = [1, 0, 0, 1, 1, 0]
+        for dense in (plan, np.array(plan), pd.Series(plan), array.array('l', plan)):
+            self.assertEqual(rks.grade(pd.Series(values), dense), rks.grade(values, plan))
@@ -0,0 +1,72 @@
+from unittest import TestCase
+import os
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+import pandas as pd
+import dlpy.likert as lk
+from dlpy.cli import main
+from dlpy.percentile import gcp, gcp_grouped
+from dlpy.weighted_calcs import wtd_mean, wtd_median
+
+
+class Test(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        nrows = 300
+        self.frame = pd.DataFrame({"id": np.arange(nrows), "dept": rng.choice(["x", "y", "z"], nrows),
+                                   "score": rng.integers(0, 40, nrows).astype(float), "w": rng.random(nrows)})
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def path(self, name):
+        return os.path.join(self.directory.name, name)
+
+    def check_grouped(self, out):
+        npt.assert_allclose(out["score_gcp"], gcp_grouped(self.frame.score, self.frame.dept.to_numpy()))
+        for dept in ("x", "y", "z"):
+            rows = (self.frame.dept == dept).to_numpy()
+            scores = self.frame.score.to_numpy()[rows]
+            weights = self.frame.w.to_numpy()[rows]
+            npt.assert_array_equal(out["score_likert"][rows],
+                                   [likert.ivalue() for likert in lk.likert_using_percentile(scores, do_cluster=False)])
+            npt.assert_allclose(out["score_wtd_mean"][rows], wtd_mean(scores, weights))
+            npt.assert_allclose(out["score_wtd_median"][rows], wtd_median(scores, weights))
+
+    def test_csv(self):
+        self.frame.to_csv(self.path("in.csv"), index=False)
+        args = [self.path("in.csv"), self.path("out.csv"), "--column", "score", "--group", "dept", "--weight", "w",
+                "--steps", "gcp,likert,wtd_mean,wtd_median", "--rows", "47"]
+        main(args)
+        out = pd.read_csv(self.path("out.csv"))
+        self.assertEqual(list(out.columns), ["id", "dept", "score", "w", "score_gcp", "score_likert",
+                                             "score_wtd_mean", "score_wtd_median"])
+        npt.assert_array_equal(out["id"], self.frame["id"])
+        self.check_grouped({name: out[name].to_numpy() for name in out.columns})
+        # In worker processes we get the same thing
+        main(args[0:1] + [self.path("out2.csv")] + args[2:] + ["--workers", "2"])
+        pd.testing.assert_frame_equal(pd.read_csv(self.path("out2.csv")), out)
+
+    def test_npy(self):
+        scores = self.frame.score.to_numpy()
+        np.save(self.path("in.npy"), scores)
+        main([self.path("in.npy"), self.path("out.npy"), "--column", "score", "--rows", "64"])
+        out = np.load(self.path("out.npy"))
+        self.assertEqual(out.dtype.names, ("score_gcp", "score_likert"))
+        self.assertEqual(out["score_likert"].dtype, np.int8)
+        npt.assert_allclose(out["score_gcp"], [gcp(list(scores), score) for score in scores])
+        # Structured input, all the columns are available
+        records = np.zeros(len(scores), dtype=[("score", float), ("dept", "U1"), ("w", float)])
+        records["score"], records["dept"], records["w"] = scores, self.frame.dept, self.frame.w
+        np.save(self.path("records.npy"), records)
+        main([self.path("records.npy"), self.path("out.npy"), "--column", "score", "--group", "dept", "--weight", "w",
+              "--steps", "gcp,likert,wtd_mean,wtd_median", "--rows", "64"])
+        self.check_grouped(np.load(self.path("out.npy")))
+
+    def test_bad_step(self):
+        self.frame.to_csv(self.path("in.csv"), index=False)
+        self.assertRaises(Exception, main, [self.path("in.csv"), self.path("out.csv"), "--column", "score",
+                                            "--steps", "gcp,bogus"])
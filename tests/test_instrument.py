@@ -0,0 +1,57 @@
+from unittest import TestCase
+
+import numpy as np
+import dlpy.instrument as instrument
+from dlpy.percentile import gcp
+from dlpy.weighted_calcs import wtd_mean
+from dlpy.ap.scoring import RankScoringV1
+
+
+class Test(TestCase):
+    def tearDown(self):
+        instrument.disable()
+        instrument.reset()
+
+    def test_disabled_records_nothing(self):
+        instrument.reset()
+        wtd_mean([1, 2, 3], [1, 1, 1])
+        self.assertEqual(instrument.snapshot(), {})
+
+    def test_recording(self):
+        with instrument.recording():
+            wtd_mean(np.arange(10.0), np.ones(10))
+            wtd_mean([1, 2], [1, 1])
+            gcp([3, 1, 2], 2)
+            scores = list(range(20))
+            RankScoringV1.standard(scores).grade(scores, [1] * 20)
+            RankScoringV1.standard(scores).prepare(scores).grade_many([[1] * 20, [0] * 20])
+        self.assertFalse(instrument.is_enabled())
+        stats = instrument.snapshot()
+        mean_stats = stats["dlpy.weighted_calcs.wtd_mean"]
+        self.assertEqual(mean_stats["calls"], 2)
+        self.assertEqual(mean_stats["total_items"], 12)
+        self.assertEqual(mean_stats["max_items"], 10)
+        self.assertGreaterEqual(mean_stats["total_seconds"], mean_stats["max_seconds"])
+        self.assertEqual(stats["dlpy.percentile.gcp"]["calls"], 1)
+        self.assertEqual(stats["dlpy.percentile.sort_dedupe"]["max_items"], 3)
+        # Scalar kernels are not instrumented
+        self.assertNotIn("dlpy.percentile.gcp_sorted_deduped", stats)
+        self.assertNotIn("dlpy.ap.scoring.rank_interpolate", stats)
+        self.assertNotIn("dlpy.ap.scoring.rank_interpolate_many", stats)
+        # Methods record the size of the argument after self
+        self.assertEqual(stats["dlpy.ap.scoring.RankScoringV1.grade"]["max_items"], 20)
+        self.assertEqual(stats["dlpy.ap.scoring.PreparedRanking.grade_ranked"]["calls"], 1)
+        # Recording after the block is off, and reset clears
+        wtd_mean([1, 2], [1, 1])
+        self.assertEqual(instrument.snapshot()["dlpy.weighted_calcs.wtd_mean"]["calls"], 2)
+        instrument.reset()
+        self.assertEqual(instrument.snapshot(), {})
+
+    def test_records_failures(self):
+        @instrument.instrumented(name="failing")
+        def failing(values):
+            raise Exception("Failed")
+        with instrument.recording():
+            self.assertRaises(Exception, failing, [1, 2, 3])
+        self.assertEqual(instrument.snapshot()["failing"]["calls"], 1)
+        self.assertEqual(failing.__name__, "failing")
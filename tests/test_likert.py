@@ -1,4 +1,9 @@
 from unittest import TestCase
+import os
+import subprocess
+import sys
+import tempfile
+import numpy as np
 import dlpy.likert as lk
 import numpy.testing as npt
 
@@ -47,6 +52,15 @@ class Test(TestCase):
         centers = lk.ClusterOfNumber.clustered_values_from_clusters(clusters)
         npt.assert_almost_equal(centers, [1, 1, 1, 1.5, 2, 2, 2])
 
+    def test_cluster_broken_up_by_last_value(self):
+        # The last value makes its cluster too wide, so it is broken up into single values
+        centers = lk.cluster_values_simple(list(range(9)), 0.15, 0.2)
+        self.assertIsInstance(centers, list)
+        npt.assert_almost_equal(centers, list(range(9)))
+        # Empty clusters are skipped rather than breaking the lookup of the others
+        clusters = [lk.ClusterOfNumber(5.0, 1), lk.ClusterOfNumber(), lk.ClusterOfNumber(3.0, 0)]
+        self.assertEqual(lk.ClusterOfNumber.clustered_values_from_clusters(clusters), [3.0, 5.0])
+
     def test_small_count_clusters(self):
         values = [0.9999, 0.9989, 1.0003, 0, 0.00001, -0.001, 1, 2, 1.001]
         likerts = lk.likert_using_small_count(values)
@@ -62,8 +76,76 @@ class Test(TestCase):
         likerts = lk.likert_using_percentile(values, do_cluster=True)
         self.assertEqual(likerts, [L, L, L, L, m, H, H, H])
 
+    def test_likert_using_default(self):
+        # Too many values for the small count version, so we fall back to percentiles
+        values = list(range(20))
+        self.assertEqual(lk.likert_using_default(values),
+                         lk.likert_using_percentile(values, cluster_epsilon=0.05, cluster_delta=0.2))
+        self.assertEqual(lk.likert_using_default([1, 2, 3]), [l, m, h])
+
     def test_clustering(self):
         values = [101, 102, 103, 104, 105, 106, 107, 108, 110, 112, 150, 151, 100]
         vs = lk.cluster_values_simple(values)
         expected = [101, 102, 103, 104, 105, 106, 107, 108, 110, 112, 150.5, 150.5, 100]
-        npt.assert_almost_equal(vs, expected)
\ No newline at end of file
+        npt.assert_almost_equal(vs, expected)
+
+    def test_small_ints(self):
+        values = [3, 1, 4, 1, 5, 9, 2, 6, 5, 3, 5, 8, 9, 7, 9, 3, 2, 3, 8, 4]
+        for small_ints in (None, True):
+            self.assertEqual(lk.likert_using_percentile(values, do_cluster=False, small_ints=small_ints),
+                             lk.likert_using_percentile(values, do_cluster=False, small_ints=False))
+            self.assertEqual(lk.likert_using_zscores(values, do_cluster=False, small_ints=small_ints),
+                             lk.likert_using_zscores(values, do_cluster=False, small_ints=False))
+        self.assertEqual(lk.likert_using_small_count([1, 2, 3, 3], small_ints=True), [l, m, h, h])
+        self.assertEqual(lk.likert_using_percentile([1, 2, 3, 4, 5], do_cluster=False), [L, l, m, h, H])
+        # Clustering gives float centers, which are counted when the values were integers
+        self.assertIs(lk._small_int_centers(values, None), True)
+        self.assertIsNone(lk._small_int_centers([1.0, 2.0], None))
+        self.assertIs(lk._small_int_centers(values, False), False)
+        for likert_using in (lk.likert_using_percentile, lk.likert_using_zscores, lk.likert_using_default):
+            self.assertEqual(likert_using(values), likert_using(values, small_ints=False))
+
+    def test_likert_transform(self):
+        rng = np.random.default_rng(0)
+        for values in (rng.integers(0, 50, 500).astype(float), rng.normal(size=300)):
+            for method, likert_using in (("percentile", lk.likert_using_percentile),
+                                         ("zscores", lk.likert_using_zscores)):
+                codes = lk.likert_transform(values, method=method, chunk_size=64)
+                self.assertEqual(codes.dtype, np.int8)
+                expected = [likert.ivalue() for likert in likert_using(values, do_cluster=False)]
+                npt.assert_array_equal(codes, expected)
+        with tempfile.TemporaryDirectory() as directory:
+            in_path = os.path.join(directory, "in.npy")
+            out_path = os.path.join(directory, "out.npy")
+            np.save(in_path, values)
+            lk.likert_transform(in_path, out_path, chunk_size=50)
+            npt.assert_array_equal(np.load(out_path), lk.likert_transform(values))
+        self.assertRaises(Exception, lk.likert_transform, values, method="bogus")
+
+    def test_likert_codes_from_01_grades(self):
+        grades = np.array([0, 0.1, 0.2, 0.39, 0.4, 0.6, 0.79, 0.8, 1])
+        expected = [lk.likert_from_01_grade(grade).ivalue() for grade in grades]
+        codes = lk.likert_codes_from_01_grades(grades)
+        self.assertEqual(codes.dtype, np.int8)
+        npt.assert_array_equal(codes, expected)
+        out = np.zeros(len(grades), dtype=np.int8)
+        self.assertIs(lk.likert_codes_from_01_grades(grades, out), out)
+        npt.assert_array_equal(out, expected)
+
+    def test_small_int_dtypes(self):
+        flags = np.array([True, False, True, True])
+        for likert_using in (lk.likert_using_percentile, lk.likert_using_zscores):
+            self.assertEqual(likert_using(flags, do_cluster=False), likert_using(flags.astype(int), do_cluster=False))
+        X = np.array([-100, 100, 0, 5, 7], dtype=np.int8)
+        self.assertEqual(lk.likert_using_percentile(X, do_cluster=False), [L, H, l, m, h])
+
+
+class TestImports(TestCase):
+    def test_numeric_import_is_light(self):
+        # The numeric APIs must not drag in the plotting or table libraries
+        code = ("import sys, dlpy.likert, dlpy.ap.scoring, dlpy.percentile, dlpy.weighted_calcs;"
+                "dlpy.likert.likert_using_percentile([1, 2, 3, 4, 5, 6]);"
+                "print(sorted(m for m in ('matplotlib', 'pandas', 'scipy') if m in sys.modules))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        self.assertEqual(output.stdout.strip(), "[]")
+
@@ -44,3 +44,49 @@ class Test(TestCase):
         npt.assert_array_almost_equal(LHS, (0,0,0))
         npt.assert_array_almost_equal(RHS, (-2,2,6))
 
+
+    def test_pw_linear_many(self):
+        curves = [
+            [(0, 0), (1, 2), (3, 4)],
+            [(-2, 1), (2, 0.5)],
+            [(1, 0.5)],
+            [(0, 0), (1, 1), (1, 2), (4, 3)]
+        ]
+        lhs = [0, 2, 0, -1]
+        rhs = [6, 0, 1, 5]
+        types = [dlm.DecayType.POWER, dlm.DecayType.EXPONENTIAL, dlm.DecayType.POWER, dlm.DecayType.EXPONENTIAL]
+        X = np.array([[-5, -3, -1, -2], [0, -2, 0.5, 0], [0.5, 0, 2, 1], [2, 2, 3, 2.5], [3, 5, 10, 4], [10, 9, -7, 20]])
+        pts, lengths = dlm.pad_pts(curves)
+        npt.assert_array_equal(lengths, [3, 2, 1, 4])
+        self.assertEqual(pts.shape, (4, 4, 2))
+        rates = [2, 1, 3, 1]
+        values = dlm.pw_linear_many(X, pts, lengths, lhs, rhs, types, rates)
+        expected = [[dlm.pw_linear(X[i, j], curves[j], lhs[j], rhs[j], types[j], rates[j]) for j in range(4)]
+                    for i in range(X.shape[0])]
+        npt.assert_allclose(values, expected)
+        out = np.zeros(X.shape, dtype=np.float32)
+        self.assertIs(dlm.pw_linear_many(X, pts, lengths, lhs, rhs, types, rates, out=out, dtype=np.float32), out)
+        npt.assert_allclose(out, expected, rtol=1e-5)
+
+    def test_decay_params_arrays(self):
+        x0 = np.array([1, 1, 2, 0])
+        y0 = np.array([1, 2, 0.5, 3])
+        m = np.array([-1, 0.5, 2, 0])
+        C = np.array([0, 3, 0, 1])
+        A, B, Cs = dlm.decay_linear_params(x0, y0, m, C, 2)
+        for j in range(4):
+            npt.assert_allclose((A[j], B[j], Cs[j]), dlm.decay_linear(0, x0[j], y0[j], m[j], C[j], 2, return_params=True))
+        xs = np.array([[5], [-5]])
+        npt.assert_allclose(dlm.decay_linear_eval(xs, A, B, Cs, 2),
+                            [[dlm.decay_linear(x, x0[j], y0[j], m[j], C[j], 2) for j in range(4)] for x in xs[:, 0]])
+        # The decay goes through (x0, y0) with slope m, k included
+        npt.assert_allclose(dlm.decay_linear_eval(x0[0:3], A[0:3], B[0:3], Cs[0:3], 2), y0[0:3])
+        h = 1e-6
+        slopes = (dlm.decay_linear_eval(x0 + h, A, B, Cs, 2) - dlm.decay_linear_eval(x0 - h, A, B, Cs, 2)) / (2 * h)
+        npt.assert_allclose(slopes[0:3], m[0:3], rtol=1e-5)
+        A, B, Cs = dlm.decay_exponential_params(x0[0:3], y0[0:3], m[0:3], C[0:3])
+        for j in range(3):
+            npt.assert_allclose((A[j], B[j], Cs[j]), dlm.decay_exponential(0, x0[j], y0[j], m[j], C[j], return_params=True))
+        # Degenerate cases are flat instead of raising
+        A, B, Cs = dlm.decay_exponential_params([0, 0], [3, 1], [0, 1], [1, 1])
+        npt.assert_allclose(dlm.decay_exponential_eval([[10], [-10]], A, B, Cs), [[3, 1], [3, 1]])
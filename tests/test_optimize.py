@@ -0,0 +1,53 @@
+from unittest import TestCase
+import itertools
+
+from dlpy.ap.scoring import RankScoringV1
+from dlpy.ap.optimize import grade_frontier, optimal_plan
+import numpy.testing as npt
+
+scores = [7, 3, 9, 1, 5, 8, 2, 10, 4, 6]
+costs = [3, 5, 1, 4, 2, 2, 6, 1, 3, 2]
+
+
+def brute_force(rks, budget):
+    best = None
+    for plan in itertools.product([0, 1], repeat=len(scores)):
+        cost = sum(c * p for c, p in zip(costs, plan))
+        if cost > budget:
+            continue
+        grade = rks.grade(scores, list(plan))
+        if (best is None) or (grade > best[1]) or (grade == best[1] and cost < best[0]):
+            best = (cost, grade)
+    return best
+
+
+class TestOptimize(TestCase):
+    def test_optimal_plan(self):
+        rks = RankScoringV1(1, 2, 2, 4, 2, 6, 3, 8)
+        for budget in (0, 3, 5, 8, 12, 20):
+            cost, grade, plan = optimal_plan(scores, costs, budget, rks)
+            npt.assert_almost_equal((cost, grade), brute_force(rks, budget))
+            npt.assert_almost_equal(rks.grade(scores, plan), grade)
+            self.assertLessEqual(sum(c * p for c, p in zip(costs, plan)), budget)
+
+    def test_optimal_plan_rank_interpolate(self):
+        rks = RankScoringV1(1, 2, 2, 4, 2, 6, 3, 8, True)
+        for budget in (0, 3, 5, 8, 12, 20):
+            cost, grade, plan = optimal_plan(scores, costs, budget, rks)
+            npt.assert_almost_equal((cost, grade), brute_force(rks, budget))
+            npt.assert_almost_equal(rks.grade(scores, plan), grade)
+
+    def test_grade_frontier(self):
+        rks = RankScoringV1(1, 2, 2, 4, 2, 6, 3, 8)
+        frontier = grade_frontier(scores, costs, rks)
+        self.assertEqual(frontier[0][0], 0)
+        for (cost1, grade1, plan1), (cost2, grade2, plan2) in zip(frontier[:-1], frontier[1:]):
+            self.assertLess(cost1, cost2)
+            self.assertLess(grade1, grade2)
+        for cost, grade, plan in frontier:
+            npt.assert_almost_equal((cost, grade), brute_force(rks, cost))
+        npt.assert_almost_equal(frontier[-1][1], 1.0)
+
+    def test_nothing_in_budget(self):
+        rks = RankScoringV1(1, 2, 2, 4, 2, 6, 3, 8)
+        self.assertIsNone(optimal_plan(scores, costs, -1, rks))
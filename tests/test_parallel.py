@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+import numpy as np
+import numpy.testing as npt
+from dlpy.parallel import concat_segments, segment_map
+from dlpy.likert import likert_using_default
+from dlpy.percentile import GcpCurve
+from dlpy.ap.scoring import RankScoringV1
+
+
+class Test(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        sizes = rng.integers(1, 60, 40)
+        self.segments = [rng.normal(size=size).round(1) for size in sizes]
+        self.plans = [(rng.random(size) < 0.3).astype(int) for size in sizes]
+        self.values, self.offsets = concat_segments(self.segments)
+
+    def test_concat_segments(self):
+        self.assertEqual(self.offsets[0], 0)
+        self.assertEqual(self.offsets[-1], sum(len(segment) for segment in self.segments))
+        npt.assert_array_equal(self.values[self.offsets[3]:self.offsets[4]], self.segments[3])
+
+    def test_likert_and_gcp(self):
+        likerts = np.concatenate([[likert.ivalue() for likert in likert_using_default(segment)]
+                                  for segment in self.segments])
+        gcps = np.concatenate([GcpCurve.fit(segment).evaluate(segment) for segment in self.segments])
+        for workers in (1, 2):
+            codes = segment_map("likert", self.values, self.offsets, workers=workers, min_parallel=0)
+            self.assertEqual(codes.dtype, np.int8)
+            npt.assert_array_equal(codes, likerts)
+            npt.assert_array_equal(segment_map("gcp", self.segments, workers=workers, min_parallel=0), gcps)
+
+    def test_grade(self):
+        grades = [RankScoringV1.standard(segment).grade(segment, plan)
+                  for segment, plan in zip(self.segments, self.plans)]
+        npt.assert_array_equal(segment_map("grade", self.segments, plans=self.plans, workers=2, min_parallel=0),
+                               grades)
+        # Small jobs run serially, with the same results
+        npt.assert_array_equal(segment_map("grade", self.segments, plans=self.plans, workers=2), grades)
+        rks = RankScoringV1.standard(self.segments[0])
+        self.assertAlmostEqual(segment_map("grade", self.segments[0:1], plans=self.plans[0:1], rks=rks)[0],
+                               rks.grade(self.segments[0], self.plans[0]))
+        self.assertRaises(Exception, segment_map, "grade", self.segments)
+        self.assertRaises(Exception, segment_map, "nope", self.segments)
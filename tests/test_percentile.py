@@ -1,6 +1,9 @@
 from unittest import TestCase
+import os
+import tempfile
 import numpy.testing as npt
 import dlpy.percentile as dlpr
+import numpy as np
 
 
 class Test(TestCase):
@@ -106,4 +109,126 @@ class Test(TestCase):
         npt.assert_allclose(
             pts,
             [(10.0, 0.01), (17.916666666666668, 0.2), (26.0, 0.4), (30.0, 0.5), (34.0, 0.6), (42.083333333333336, 0.8), (50.0, 0.99)]
-        )
\ No newline at end of file
+        )
+
+    def test_small_int_counts(self):
+        lowest, counts = dlpr.small_int_counts([3, 5, 3, 7])
+        self.assertEqual(lowest, 3)
+        npt.assert_array_equal(counts, [2, 0, 1, 0, 1])
+        self.assertIsNone(dlpr.small_int_counts([3.0, 5.0]))
+        self.assertIsNotNone(dlpr.small_int_counts([3.0, 5.0], small_ints=True))
+        self.assertIsNone(dlpr.small_int_counts([3.5, 5.0], small_ints=True))
+        self.assertIsNone(dlpr.small_int_counts([3, 5], small_ints=False))
+        self.assertIsNone(dlpr.small_int_counts([0, 10 ** 9]))
+
+    def test_small_int_paths(self):
+        rng = np.random.default_rng(0)
+        X = rng.integers(1, 11, 500)
+        self.assertEqual(dlpr.sort_dedupe(X), dlpr.sort_dedupe(X, small_ints=False))
+        self.assertEqual(dlpr.sort_dedupe([5, 1, 3, 1]), [1, 3, 5])
+        unique_values, inverse = dlpr.unique_inverse(X)
+        npt.assert_array_equal(unique_values, np.unique(X))
+        npt.assert_array_equal(unique_values[inverse], X)
+        expected = [dlpr.std_perc(X, x) for x in X]
+        npt.assert_array_equal(dlpr.std_percs(X), expected)
+        npt.assert_array_equal(dlpr.std_percs(X.astype(float)), expected)
+
+    def test_small_int_dtypes(self):
+        # Bools are not counted, but still work through np.unique
+        self.assertIsNone(dlpr.small_int_counts(np.array([True, False, True])))
+        self.assertEqual(dlpr.sort_dedupe([True, False, True]), [False, True])
+        unique_values, inverse = dlpr.unique_inverse(np.array([True, False, True]))
+        npt.assert_array_equal(unique_values[inverse], [True, False, True])
+        npt.assert_array_equal(dlpr.std_percs([True, False, True]), dlpr.std_percs([1, 0, 1]))
+        # The range of a narrow signed dtype does not fit in the dtype itself
+        X = np.array([-100, 100, 0, -100], dtype=np.int8)
+        lowest, counts = dlpr.small_int_counts(X)
+        self.assertEqual(lowest, -100)
+        self.assertEqual(len(counts), 201)
+        unique_values, inverse = dlpr.unique_inverse(X)
+        npt.assert_array_equal(unique_values, [-100, 0, 100])
+        npt.assert_array_equal(unique_values[inverse], X)
+        npt.assert_array_equal(dlpr.std_percs(X), dlpr.std_percs(X.astype(float)))
+        self.assertEqual(dlpr.sort_dedupe(X), [-100, 0, 100])
+
+    def test_gcp_grouped(self):
+        X = [10, 50, 3, 20, 30, 5, 20, 7, 40, 4]
+        keys = ["a", "a", "b", "a", "a", "b", "a", "c", "a", "b"]
+        epsilon = 0.05
+        for decay_type in (dlpr.DecayType.POWER, dlpr.DecayType.EXPONENTIAL):
+            expected = [dlpr.gcp([x for x, k in zip(X, keys) if k == key], x, epsilon, decay_type)
+                        for x, key in zip(X, keys)]
+            npt.assert_array_equal(dlpr.gcp_grouped(X, keys, epsilon, decay_type), expected)
+        # A group with a single value is in the middle
+        self.assertEqual(dlpr.gcp_grouped(X, keys, epsilon)[7], 0.5)
+        # Scoring other values against the groups, including the tails
+        S = [0, 10, 25, 60, 2, 4.5, 9, 7]
+        S_keys = ["a", "a", "a", "a", "b", "b", "b", "c"]
+        expected = [dlpr.gcp([x for x, k in zip(X, keys) if k == key], s, epsilon) for s, key in zip(S, S_keys)
+                    if key != "c"]
+        values = dlpr.gcp_grouped(X, keys, epsilon, S=S, S_keys=S_keys)
+        npt.assert_allclose(values[0:7], expected)
+        self.assertEqual(values[7], 0.5)
+        self.assertTrue(np.isnan(dlpr.gcp_grouped(X, keys, epsilon, S=[8], S_keys=["c"])[0]))
+        self.assertRaises(Exception, dlpr.gcp_grouped, X, keys, epsilon, S=[1], S_keys=["d"])
+
+    def test_gcp_curve(self):
+        X = [10, 50, 3, 20, 30, 5, 20, 7, 40, 4, 3]
+        curve = dlpr.GcpCurve.fit(X, 0.05, chunk_size=4)
+        npt.assert_array_equal(curve.knots, dlpr.sort_dedupe(X))
+        S = [0, 3, 4.5, 20, 33, 50, 70]
+        npt.assert_allclose(curve.evaluate(S), [dlpr.gcp(X, s, 0.05) for s in S])
+        self.assertEqual(curve.pts(), dlpr.gcp_sorted_deduped(dlpr.sort_dedupe(X), 0, 0.05, return_params=True)[0])
+
+    def test_gcp_transform_out_of_core(self):
+        X = np.random.default_rng(0).integers(0, 30, 1000).astype(float)
+        expected = [dlpr.gcp(list(X), x) for x in X]
+        with tempfile.TemporaryDirectory() as directory:
+            in_path = os.path.join(directory, "in.npy")
+            out_path = os.path.join(directory, "out.npy")
+            np.save(in_path, X)
+            out = dlpr.gcp_transform(in_path, out_path, chunk_size=64)
+            self.assertIsInstance(out, np.memmap)
+            npt.assert_array_equal(np.load(out_path), expected)
+            del out
+        out = np.zeros(len(X))
+        self.assertIs(dlpr.gcp_transform(X, out, chunk_size=100), out)
+        npt.assert_array_equal(out, expected)
+        self.assertRaises(Exception, dlpr.gcp_transform, X, np.zeros(3))
+
+    def test_gcp_dtype_and_out(self):
+        rng = np.random.default_rng(1)
+        X = rng.normal(size=200).round(2)
+        S = np.concatenate((X, rng.uniform(-4, 4, 100)))
+        curve = dlpr.GcpCurve.fit(X)
+        expected = [dlpr.gcp(X, s) for s in S]
+        # The float64 path gives exactly what gcp does
+        npt.assert_array_equal(curve.evaluate(S), expected)
+        single = curve.evaluate(S, dtype=np.float32)
+        self.assertEqual(single.dtype, np.float32)
+        npt.assert_allclose(single, expected, rtol=1e-5, atol=1e-6)
+        out = np.zeros(len(S), dtype=np.float32)
+        self.assertIs(curve.transform(S, out, chunk_size=64, dtype=np.float32), out)
+        npt.assert_array_equal(out, single)
+        # An output of another dtype is written through a buffer
+        out = np.zeros(len(S), dtype=np.float32)
+        curve.transform(S, out, chunk_size=64)
+        npt.assert_allclose(out, expected, rtol=1e-5, atol=1e-6)
+        out = np.zeros(len(X), dtype=np.float32)
+        self.assertIs(dlpr.gcp_grouped(X, X > 0, out=out), out)
+        npt.assert_allclose(out, dlpr.gcp_grouped(X, X > 0), atol=1e-6)
+        self.assertRaises(Exception, curve.evaluate, S, dtype=np.int32)
+
+    def test_gcp_float32_accuracy(self):
+        rng = np.random.default_rng(2)
+        X = rng.random(1000)
+        curve = dlpr.GcpCurve.fit(X)
+        pole = curve._tails()[1][1]
+        # Inside the knots, then the tails, including values either side of the right tail's pole
+        inside = rng.uniform(X.min(), X.max(), 1000)
+        tails = np.concatenate((rng.uniform(-3, X.min(), 100), rng.uniform(X.max(), 3, 100),
+                                pole + np.linspace(-1e-6, 1e-6, 21)))
+        for S, rtol, atol in ((inside, 0, 2e-5), (tails, 1e-7, 0)):
+            single = curve.evaluate(S, dtype=np.float32)
+            npt.assert_allclose(single, curve.evaluate(S), rtol=rtol, atol=atol)
+            npt.assert_array_equal(curve.transform(S, chunk_size=50, dtype=np.float32), single)
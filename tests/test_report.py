@@ -0,0 +1,40 @@
+from unittest import TestCase
+import os
+import tempfile
+
+from matplotlib.figure import Figure
+from dlpy.ap.scoring import RankScoringV1
+from dlpy.ap.report import render_report, render_reports
+
+rks = RankScoringV1(2, 4, 3, 8, 3, 12, 3, 15)
+scores = [i for i in range(1, 20)]
+planA = [1, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
+planD = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1, 1, 1, 0, 0, 0, 0, 0, 0, 0]
+
+
+class TestReport(TestCase):
+    def test_plot_on_axes(self):
+        ax = Figure().add_subplot()
+        rks.plot(scores, planA, ax=ax)
+        self.assertIn("grade is A", ax.get_title())
+        ax = Figure().add_subplot()
+        rks.plot_heatmap(scores, planD, ax=ax)
+        self.assertEqual(ax.get_title(), "Funded projects in Blue, by rank, for grade D")
+
+    def test_render_report(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            for name in ("grade.png", "grade.svg"):
+                path = render_report(rks, scores, planA, os.path.join(out_dir, name))
+                self.assertGreater(os.path.getsize(path), 0)
+            path = render_report(rks, scores, planA, os.path.join(out_dir, "heat.png"), kind="heatmap")
+            self.assertGreater(os.path.getsize(path), 0)
+
+    def test_render_reports(self):
+        with tempfile.TemporaryDirectory() as out_dir:
+            jobs = [(scores, plan, os.path.join(out_dir, "{}.png".format(i)))
+                    for i, plan in enumerate([planA, planD] * 3)]
+            for processes in (1, 2):
+                paths = render_reports(rks, jobs, processes=processes)
+                self.assertEqual(paths, [job[2] for job in jobs])
+                for path in paths:
+                    self.assertGreater(os.path.getsize(path), 0)
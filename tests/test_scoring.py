@@ -1,6 +1,8 @@
 from unittest import TestCase
 
-from dlpy.ap.scoring import RankScoringV1, rank_interpolate
+from dlpy.ap.scoring import RankScoringV1, SparsePlan, rank_interpolate, rank_interpolate_many, \
+    power_weights, top_ranked
+import numpy as np
 import numpy.testing as npt
 
 rks = RankScoringV1(2, 4, 3, 8, 3, 12, 3, 15)
@@ -132,3 +134,64 @@ class TestRankScoringV1(TestCase):
         plan_subset = [0,0,0,1,1]
         score = rank_interpolate(plan_subset, 2, 0.6, 0.8, best_plan)
         npt.assert_almost_equal(score, 0.6)
+
+    def test_top_ranked(self):
+        rng = np.random.default_rng(42)
+        for nitems in (1, 10, 100, 1000):
+            for values in (rng.random(nitems), rng.integers(0, 5, nitems)):
+                for count in (1, 5, 25, nitems):
+                    npt.assert_array_equal(top_ranked(values, count),
+                                           np.argsort(values, kind="stable")[0:count])
+        npt.assert_array_equal(top_ranked([3, 1, 2, 1, 3, 1], 2), [1, 3])
+        npt.assert_array_equal(top_ranked([np.nan] * 10 + [1.0], 3), [10, 0, 1])
+        self.assertEqual(len(top_ranked(scores, 0)), 0)
+
+    def test_sparse_plan(self):
+        plan = SparsePlan([9, 2, 4], [1, 0.5, 1], 12)
+        self.assertEqual(len(plan), 12)
+        self.assertEqual(plan[2], 0.5)
+        self.assertEqual(plan[3], 0)
+        self.assertEqual(plan[-3], 1)
+        self.assertEqual(plan.to_dense(), [0, 0, 0.5, 0, 1, 0, 0, 0, 0, 1, 0, 0])
+        npt.assert_array_equal(plan.values_at([4, 11, 2]), [1, 0, 0.5])
+        self.assertEqual(SparsePlan.from_dense(planB).to_dense(), planB)
+        self.assertEqual(SparsePlan.from_dict({9: 1, 2: 0.5, 4: 1}, 12).to_dense(), plan.to_dense())
+
+    def test_grade_sparse(self):
+        for rk in (rks, rksPower):
+            for plan in (planAP, planAA, planA, planB, planC, planD):
+                funded = np.flatnonzero(plan)
+                expected = rk.grade(scores, plan)
+                npt.assert_almost_equal(rk.grade(scores, SparsePlan(funded, nitems=len(plan))), expected)
+                npt.assert_almost_equal(rk.grade(scores, {int(i): 1 for i in funded}), expected)
+                npt.assert_almost_equal(rk.percents(scores, SparsePlan(funded)), rk.percents(scores, plan))
+
+    def test_best_plan_not_above_sparse(self):
+        rng = np.random.default_rng(7)
+        values = rng.random(50)
+        rk = RankScoringV1.standard(values)
+        dense = rk.best_plan_not_above(values)
+        sparse = rk.best_plan_not_above(values, sparse=True)
+        for dense_plan, sparse_plan in zip(dense, sparse):
+            self.assertEqual(dense_plan, sparse_plan.to_dense())
+
+    def test_grade_many(self):
+        rng = np.random.default_rng(3)
+        plans = [planAP, planAA, planA, planB, planC, planD] + \
+            [list(rng.integers(0, 2, len(planA))) for i in range(50)]
+        for rk in (rks, rksPower):
+            expected = [rk.grade(scores, plan) for plan in plans]
+            npt.assert_almost_equal(rk.grade_many(scores, plans), expected)
+            npt.assert_almost_equal(rk.grade_many(scores, np.array(plans)), expected)
+            prepared = rk.prepare(scores)
+            npt.assert_almost_equal(prepared.grade(SparsePlan.from_dense(planB)), rk.grade(scores, planB))
+
+    def test_rank_interpolate_many(self):
+        best_plan = [1, 0, 0, 1, 1]
+        subsets = [[1, 0, 0, 1, 1], [0, 1, 0, 1, 1], [0, 0, 1, 1, 1], [1, 0, 0, 1, 0]]
+        npt.assert_almost_equal(rank_interpolate_many(subsets, 2, 0.6, 0.8, best_plan),
+                                [0.8, 0.7414, 0.6999698, 0.7500301954398001])
+        weights = power_weights(5)
+        npt.assert_almost_equal(weights, [1, 0.707, 0.707**2, 0.707**3, 0.707**4])
+        self.assertIs(weights, power_weights(5))
+        self.assertFalse(weights.flags.writeable)
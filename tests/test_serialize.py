@@ -0,0 +1,63 @@
+from unittest import TestCase
+import os
+import tempfile
+
+import numpy as np
+import numpy.testing as npt
+from dlpy.serialize import save, load
+from dlpy.maths import DecayType, PwLinearCurves
+from dlpy.percentile import GcpCurve
+from dlpy.ap.scoring import RankScoringV1
+
+
+class Test(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "fitted.npz")
+        self.rng = np.random.default_rng(0)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_gcp_curve(self):
+        curve = GcpCurve.fit(self.rng.integers(0, 100, 1000), 0.02, DecayType.POWER, 2)
+        save(self.path, curve)
+        for mmap in (True, False):
+            loaded = load(self.path, mmap=mmap)
+            self.assertEqual((loaded.epsilon, loaded.decay_type, loaded.decay_rate), (0.02, DecayType.POWER, 2))
+            npt.assert_array_equal(loaded.knots, curve.knots)
+            S = np.linspace(-10, 110, 50)
+            npt.assert_array_equal(loaded.evaluate(S), curve.evaluate(S))
+        # Memory mapped, not copied
+        self.assertIsInstance(load(self.path).knots.base, np.memmap)
+
+    def test_pw_linear_curves(self):
+        curves = PwLinearCurves.from_pts([[(0, 0), (1, 1)], [(2, 3)], [(0, 1), (1, 0.5), (4, 0)]], 0, [1, 5, 0],
+                                         [DecayType.POWER, DecayType.EXPONENTIAL, DecayType.POWER], [1, 1, 2])
+        save(self.path, curves)
+        loaded = load(self.path)
+        self.assertEqual(loaded.decay_types(), curves.decay_types())
+        npt.assert_array_equal(loaded.lhs_params, curves.lhs_params)
+        X = self.rng.uniform(-3, 6, (20, 3))
+        npt.assert_array_equal(loaded.evaluate(X), curves.evaluate(X))
+
+    def test_prepared_ranking(self):
+        scores = self.rng.random(500)
+        rks = RankScoringV1.standard(scores)
+        rks.use_rank_interpolate = True
+        rks.grade_decay_rate = 0.8
+        prepared = rks.prepare(scores)
+        save(self.path, {"ranking": prepared, "curve": GcpCurve.fit(scores)})
+        loaded = load(self.path)
+        self.assertEqual(set(loaded.keys()), {"ranking", "curve"})
+        ranking = loaded["ranking"]
+        self.assertEqual(ranking.rks.grade_decay_rate, 0.8)
+        self.assertEqual(ranking.nitems, 500)
+        plans = (self.rng.random((30, 500)) < 0.3).astype(int)
+        npt.assert_array_equal(ranking.grade_many(plans), prepared.grade_many(plans))
+        npt.assert_array_equal(ranking.grade_many(plans), rks.grade_many(scores, plans))
+
+    def test_bad_files(self):
+        self.assertRaises(Exception, save, self.path, "not fitted")
+        np.savez(self.path, x=np.zeros(3))
+        self.assertRaises(Exception, load, self.path)
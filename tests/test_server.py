@@ -0,0 +1,105 @@
+from unittest import TestCase
+import asyncio
+import json
+
+import numpy as np
+import numpy.testing as npt
+from dlpy.server import ScoringServer
+from dlpy.percentile import GcpCurve
+from dlpy.likert import likert_codes_from_01_grades
+from dlpy.ap.scoring import RankScoringV1
+
+
+async def _client(port, requests):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    for request in requests:
+        writer.write((json.dumps(request) + "\n").encode("utf-8"))
+    await writer.drain()
+    responses = {}
+    for i in range(len(requests)):
+        response = json.loads(await reader.readline())
+        responses[response["id"]] = response
+    writer.close()
+    await writer.wait_closed()
+    return responses
+
+
+class Test(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.scores = rng.random(200)
+        self.values = rng.normal(0.5, 0.5, 300)
+        self.plans = (rng.random((20, 200)) < 0.3).astype(int)
+        self.curve = GcpCurve.fit(self.scores)
+        self.prepared = RankScoringV1.standard(self.scores).prepare(self.scores)
+
+    def run_server(self, clients, **kwargs):
+        async def run():
+            server = ScoringServer({"scores": self.curve, "ranking": self.prepared}, **kwargs)
+            listening = await server.start()
+            port = listening.sockets[0].getsockname()[1]
+            try:
+                results = await asyncio.gather(*[_client(port, requests) for requests in clients])
+                stats = (await _client(port, [{"id": "stats", "op": "stats"}]))["stats"]["result"]
+            finally:
+                listening.close()
+                await listening.wait_closed()
+                await server.close()
+            return results, stats
+        return asyncio.run(run())
+
+    def test_loopback(self):
+        gcp_requests = [{"id": i, "op": "gcp", "model": "scores", "value": v} for i, v in enumerate(self.values)]
+        likert_requests = [{"id": i, "op": "likert", "value": v} for i, v in enumerate(self.values)]
+        grade_requests = [{"id": i, "op": "grade", "model": "ranking", "plan": plan.tolist()}
+                          for i, plan in enumerate(self.plans)]
+        # A sparse plan, as an object of project index to amount
+        grade_requests.append({"id": "sparse", "op": "grade", "model": "ranking",
+                               "plan": {str(i): int(x) for i, x in enumerate(self.plans[0]) if x}})
+        bad_requests = [{"id": "model", "op": "gcp", "model": "missing", "value": 1},
+                        {"id": "op", "op": "nope", "model": "scores", "value": 1},
+                        {"id": "kind", "op": "grade", "model": "scores", "plan": [1]}]
+        (gcps, likerts, grades, bad), stats = self.run_server(
+            [gcp_requests, likert_requests, grade_requests, bad_requests], max_batch=64, max_wait=0.01)
+        npt.assert_array_almost_equal([gcps[i]["result"] for i in range(len(self.values))],
+                                      self.curve.evaluate(self.values))
+        npt.assert_array_equal([likerts[i]["result"] for i in range(len(self.values))],
+                               likert_codes_from_01_grades(self.values))
+        expected = self.prepared.grade_many(self.plans)
+        npt.assert_array_almost_equal([grades[i]["result"] for i in range(len(self.plans))], expected)
+        self.assertAlmostEqual(grades["sparse"]["result"], expected[0])
+        self.assertEqual(set(bad.keys()), {"model", "op", "kind"})
+        self.assertTrue(all("error" in response for response in bad.values()))
+        # Requests were batched, but never more than max_batch at once
+        self.assertEqual(stats["requests"], 2 * len(self.values) + len(self.plans) + 1)
+        self.assertLess(stats["batches"], stats["requests"])
+        self.assertGreater(stats["max_batch"], 1)
+        self.assertLessEqual(stats["max_batch"], 64)
+        self.assertEqual(stats["queue_depth"], 0)
+        self.assertTrue(0 <= stats["latency_p50"] <= stats["latency_p90"] <= stats["latency_p99"])
+
+    def test_bad_request_only_fails_itself(self):
+        async def run():
+            server = ScoringServer({"scores": self.curve, "ranking": self.prepared}, max_wait=0.01)
+            try:
+                return await asyncio.gather(server.submit("grade", "ranking", self.plans[0].tolist()),
+                                            server.submit("grade", "ranking", [1, 0]),
+                                            server.submit("grade", "ranking", {"500": 1}),
+                                            server.submit("gcp", "scores", 0.5),
+                                            server.submit("gcp", "scores", "abc"),
+                                            server.submit("likert", None, [0.5, 0.6]),
+                                            return_exceptions=True)
+            finally:
+                await server.close()
+        good_grade, short_plan, bad_index, good_gcp, bad_gcp, bad_likert = asyncio.run(run())
+        self.assertAlmostEqual(good_grade, self.prepared.grade(self.plans[0]))
+        self.assertAlmostEqual(good_gcp, self.curve.evaluate(0.5))
+        for error in (short_plan, bad_index, bad_gcp, bad_likert):
+            self.assertIsInstance(error, Exception)
+        # If a batch still fails, its values are scored one at a time
+        server = ScoringServer({"ranking": self.prepared})
+        outcomes = server._score_each("grade", self.prepared, [self.plans[1], np.zeros(3)])
+        self.assertAlmostEqual(outcomes[0][0], self.prepared.grade(self.plans[1]))
+        self.assertIsNone(outcomes[0][1])
+        self.assertIsInstance(outcomes[1][1], Exception)
+        server.executor.shutdown()
@@ -0,0 +1,76 @@
+from unittest import TestCase
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+import numpy as np
+import numpy.testing as npt
+from dlpy.shared import SharedRegistry
+from dlpy.percentile import GcpCurve
+from dlpy.ap.scoring import RankScoringV1
+
+PREFIX = "dlpy_test_{}_".format(os.getpid())
+
+
+def _grade_in_worker(plans):
+    registry = SharedRegistry(PREFIX)
+    ranking = registry.attach("ranking")
+    grades = ranking.grade_many(plans)
+    del ranking
+    registry.release("ranking")
+    return grades
+
+
+class Test(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.scores = rng.random(300)
+        self.plans = (rng.random((10, 300)) < 0.3).astype(int)
+        self.registry = SharedRegistry(PREFIX)
+
+    def tearDown(self):
+        self.registry.close()
+
+    def test_attach_in_workers(self):
+        prepared = RankScoringV1.standard(self.scores).prepare(self.scores)
+        self.registry.publish("ranking", prepared)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            results = list(executor.map(_grade_in_worker, [self.plans[0:5], self.plans[5:10]]))
+        npt.assert_array_equal(np.concatenate(results), prepared.grade_many(self.plans))
+
+    def test_read_only_and_reference_counted(self):
+        curve = GcpCurve.fit(self.scores)
+        self.registry.publish("curve", curve)
+        self.assertRaises(Exception, self.registry.publish, "curve", curve)
+        attached = self.registry.attach("curve")
+        self.assertIs(self.registry.attach("curve"), attached)
+        npt.assert_array_equal(attached.evaluate(self.scores), curve.evaluate(self.scores))
+        self.assertRaises(ValueError, attached.knots.__setitem__, 0, 1.0)
+        self.registry.release("curve")
+        # Still attached once
+        self.assertEqual(attached.evaluate([0.5])[0], curve.evaluate([0.5])[0])
+        del attached
+        self.registry.release("curve")
+        self.assertEqual(self.registry.attached, {})
+        self.registry.unpublish("curve")
+        self.assertRaises(FileNotFoundError, self.registry.attach, "curve")
+
+    def test_release_while_in_use(self):
+        self.registry.publish("curve", GcpCurve.fit(self.scores))
+        attached = self.registry.attach("curve")
+        expected = attached.evaluate(self.scores)
+        self.assertRaises(Exception, self.registry.release, "curve")
+        # Still tracked, and the memory is still there
+        self.assertIs(self.registry.attach("curve"), attached)
+        self.registry.release("curve")
+        npt.assert_array_equal(attached.evaluate(self.scores), expected)
+        # Holding just one of its arrays keeps it in use too
+        knots = attached.knots
+        del attached
+        self.assertRaises(Exception, self.registry.release, "curve")
+        self.assertIn("curve", self.registry.attached)
+        npt.assert_array_equal(self.registry.attach("curve").evaluate(self.scores), expected)
+        self.registry.release("curve")
+        self.assertEqual(knots[0], GcpCurve.fit(self.scores).knots[0])
+        del knots
+        self.registry.release("curve")
+        self.assertEqual(self.registry.attached, {})
@@ -0,0 +1,58 @@
+from unittest import TestCase
+import numpy as np
+import numpy.testing as npt
+import dlpy.threads as th
+import dlpy.maths as dlm
+import dlpy.likert as lk
+from dlpy.percentile import GcpCurve, gcp_transform
+from dlpy.weighted_calcs import wtd_mean, wtd_mean_grouped
+
+
+class Test(TestCase):
+    def test_chunk_bounds(self):
+        self.assertEqual(th.chunk_bounds(100, 4, 1000), [slice(0, 100)])
+        self.assertEqual(th.chunk_bounds(100, 1, 10), [slice(0, 100)])
+        self.assertEqual(th.chunk_bounds(10, 4, 1), [slice(0, 2), slice(2, 5), slice(5, 7), slice(7, 10)])
+        self.assertEqual(th.chunk_bounds(3, 8, 1), [slice(0, 1), slice(1, 2), slice(2, 3)])
+        # 10 rows of 100 elements are big enough to split
+        self.assertEqual(len(th.chunk_bounds(10, 2, 500, row_size=100)), 2)
+
+    def test_settings(self):
+        previous = th.get_threads()
+        with th.using_threads(3, 10):
+            self.assertEqual(th.get_threads(), (3, 10))
+            self.assertEqual(len(th.chunk_bounds(30)), 3)
+        self.assertEqual(th.get_threads(), previous)
+        self.assertRaises(Exception, th.set_threads, 0)
+
+    def test_map_chunks(self):
+        self.assertEqual(th.map_chunks(lambda chunk: (chunk.start, chunk.stop), 9, 3, 1), [(0, 3), (3, 6), (6, 9)])
+        # A chunk that calls another threaded transform runs it in its own thread
+        nested = th.map_chunks(lambda chunk: len(th.map_chunks(lambda inner: inner, 100, 4, 1)), 8, 4, 1)
+        self.assertEqual(nested[0], 4)
+        self.assertEqual(nested[1:], [1, 1, 1])
+
+    def test_threaded_transforms_match(self):
+        rng = np.random.default_rng(0)
+        values = rng.normal(size=5000)
+        weights = rng.uniform(size=5000)
+        keys = rng.integers(0, 7, 5000)
+        curve = GcpCurve.fit(values)
+        codes = lk.likert_transform(values)
+        X = rng.normal(size=(500, 3))
+        pts, lengths = dlm.pad_pts([[(0, 0), (1, 2)], [(-1, 1), (2, 0.5)], [(1, 0.5)]])
+        pw_args = (pts, lengths, [0, 2, 0], [6, 0, 1])
+        expected_pw = dlm.pw_linear_many(X, *pw_args)
+        for n_threads in (2, 4):
+            with th.using_threads(n_threads, 1):
+                npt.assert_array_equal(curve.evaluate(values), curve.evaluate(values, n_threads=1))
+                npt.assert_array_equal(curve.transform(values, chunk_size=1000), curve.evaluate(values))
+                npt.assert_array_equal(gcp_transform(values, chunk_size=1000),
+                                       GcpCurve.fit(values, chunk_size=1000).evaluate(values, n_threads=1))
+                npt.assert_array_equal(dlm.pw_linear_many(X, *pw_args), expected_pw)
+                npt.assert_array_equal(lk.likert_transform(values, chunk_size=1000), codes)
+                npt.assert_array_equal(lk.likert_codes_from_01_grades(curve.evaluate(values)),
+                                       lk.likert_codes_from_01_grades(curve.evaluate(values), n_threads=1))
+                self.assertAlmostEqual(wtd_mean(values, weights), wtd_mean(values, weights, n_threads=1))
+                npt.assert_allclose(wtd_mean_grouped(values, weights, keys)[1],
+                                    wtd_mean_grouped(values, weights, keys, n_threads=1)[1])
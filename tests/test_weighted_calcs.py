@@ -2,6 +2,8 @@ from unittest import TestCase
 
 from dlpy.weighted_calcs import *
 from numpy import testing as npt
+import numpy as np
+import pickle
 
 
 class Test(TestCase):
@@ -66,3 +68,129 @@ class Test(TestCase):
             wtd_median(vals, wgts),
             12.0
         )
+
+    def test_wtd_median_ties(self):
+        # Tied values are walked in the order they were given
+        npt.assert_almost_equal(wtd_median([1, 1], [3, 1]), 0.5 + 2 / 3)
+        npt.assert_almost_equal(wtd_median([1, 1], [1, 3]), 0.5 + 1 / 3)
+        self.assertIsNone(wtd_median([1, 2], [0, 0]))
+        self.assertEqual(wtd_median([], []), 0)
+        self.assertEqual(wtd_median([7], [2]), 7)
+
+    def test_wtd_median_grouped(self):
+        vals = [1, 2, 3, 1, 2, 3, 4, 5, 1, 2, 22, 9]
+        wgts = [1, 1, 1, 5, 4, 3, 1, 1, 4, 4, 8, 3]
+        keys = ['a', 'a', 'a', 'b', 'b', 'b', 'b', 'b', 'c', 'c', 'c', 'd']
+        unique_keys, medians = wtd_median_grouped(vals, wgts, keys)
+        npt.assert_array_equal(unique_keys, ['a', 'b', 'c', 'd'])
+        npt.assert_almost_equal(medians, [2.0, 2.0, 12.0, 9])
+        rng = np.random.default_rng(1)
+        keys = rng.integers(0, 20, 1000)
+        vals = rng.random(1000)
+        wgts = rng.random(1000)
+        unique_keys, medians = wtd_median_grouped(vals, wgts, keys)
+        npt.assert_almost_equal(medians, [wtd_median(vals[keys == key], wgts[keys == key]) for key in unique_keys])
+
+    def test_wtd_median_grouped_exact_half_after_many_groups(self):
+        # Each group's areas hit exactly half, which must not be lost to the rounding of the earlier groups' totals
+        ngroups = 2000
+        keys = np.repeat(np.arange(ngroups), 2)
+        vals = np.tile([1.0, 10.0], ngroups)
+        wgts = np.full(2 * ngroups, 0.3)
+        unique_keys, medians = wtd_median_grouped(vals, wgts, keys)
+        npt.assert_array_equal(medians, np.full(ngroups, wtd_median([1.0, 10.0], [0.3, 0.3])))
+        # Groups of very different sizes, with fractional weights
+        rng = np.random.default_rng(2)
+        keys = np.repeat(np.arange(300), rng.integers(1, 12, 300))
+        keys = np.concatenate((keys, np.full(200, 300)))
+        vals = rng.integers(0, 5, len(keys)).astype(float)
+        wgts = rng.integers(1, 4, len(keys)) * 0.1
+        unique_keys, medians = wtd_median_grouped(vals, wgts, keys)
+        npt.assert_allclose(medians, [wtd_median(vals[keys == key], wgts[keys == key]) for key in unique_keys],
+                            atol=1e-12)
+
+    def test_wtd_quantile(self):
+        npt.assert_almost_equal(wtd_quantile([1, 2, 3], [1, 1, 1], [0, 0.25, 0.5, 1]), [0.5, 1.25, 2.0, 3.5])
+        npt.assert_almost_equal(wtd_quantile([1, 2, 3, 4, 5], [5, 4, 3, 1, 1], 0.5),
+                                wtd_median([1, 2, 3, 4, 5], [5, 4, 3, 1, 1]))
+        vals = [1, 2, 22] + list(range(3, 22))
+        wgts = [4, 4, 8] + [0] * 19
+        npt.assert_almost_equal(wtd_quantile(vals, wgts, 0.5), 12.0)
+        self.assertTrue(np.isnan(wtd_quantile([1, 2], [0, 0], 0.5)))
+
+    def test_wtd_quantile_axis(self):
+        rng = np.random.default_rng(2)
+        vals = rng.random((40, 3))
+        wgts = rng.random((40, 3))
+        qs = [0.1, 0.5, 0.9]
+        by_column = wtd_quantile(vals, wgts, qs, axis=0)
+        self.assertEqual(by_column.shape, (3, 3))
+        for j in range(3):
+            npt.assert_almost_equal(by_column[:, j], wtd_quantile(vals[:, j], wgts[:, j], qs))
+        by_row = wtd_quantile(vals.T, wgts[:, 0], 0.5, axis=1)
+        npt.assert_almost_equal(by_row, [wtd_median(vals[:, j], wgts[:, 0]) for j in range(3)])
+
+    def test_wtd_mean_grouped(self):
+        vals = [1, 2, 3, 1, 2, 1, 2, 3, 4, 5]
+        wgts = [1, 1, 1, 1, 1, 5, 4, 3, 1, 1]
+        keys = ['a', 'a', 'a', 'b', 'b', 'c', 'c', 'c', 'c', 'c']
+        unique_keys, means = wtd_mean_grouped(vals, wgts, keys)
+        npt.assert_array_equal(unique_keys, ['a', 'b', 'c'])
+        npt.assert_almost_equal(means, [2.0, 1.5, 2.2142857142857144])
+        codes = np.array([0, 0, 0, 1, 1, 2, 2, 2, 2, 2])
+        npt.assert_almost_equal(wtd_mean_grouped(np.array(vals, dtype=float), np.array(wgts, dtype=float), codes,
+                                                 nkeys=3)[1], means)
+        metrics = np.column_stack((vals, np.array(vals) * 10))
+        unique_keys, means2d = wtd_mean_grouped(metrics, wgts, keys)
+        npt.assert_almost_equal(means2d, np.column_stack((means, means * 10)))
+        out = np.zeros(3, dtype=np.float32)
+        self.assertIs(wtd_mean_grouped(vals, wgts, keys, dtype=np.float32, out=out)[1], out)
+        npt.assert_allclose(out, means, rtol=1e-6)
+        self.assertAlmostEqual(wtd_mean(vals, wgts, dtype=np.float32), wtd_mean(vals, wgts), places=6)
+
+    def test_wtd_mean_accumulator(self):
+        rng = np.random.default_rng(4)
+        vals = rng.random(300)
+        wgts = rng.random(300)
+        first = WtdMeanAccumulator().update(vals[0:100], wgts[0:100])
+        second = WtdMeanAccumulator().update(vals[100:200], wgts[100:200]).update(vals[200:], wgts[200:])
+        second = pickle.loads(pickle.dumps(second))
+        npt.assert_almost_equal(first.merge(second).mean(), wtd_mean(vals, wgts))
+
+    def test_wtd_quantile_accumulator(self):
+        rng = np.random.default_rng(5)
+        vals = rng.integers(0, 20, 300)
+        wgts = rng.integers(0, 5, 300)
+        first = WtdQuantileAccumulator().update(vals[0:100], wgts[0:100])
+        second = WtdQuantileAccumulator().update(vals[100:200], wgts[100:200]).update(vals[200:], wgts[200:])
+        merged = first.merge(pickle.loads(pickle.dumps(second)))
+        self.assertEqual(merged.median(), wtd_median(vals, wgts))
+        npt.assert_array_equal(merged.quantile([0.1, 0.9]), wtd_quantile(vals, wgts, [0.1, 0.9]))
+
+    def test_wtd_quantile_accumulator_bounded(self):
+        rng = np.random.default_rng(6)
+        vals = rng.integers(0, 1000, 20000)
+        wgts = rng.random(20000)
+        acc = WtdQuantileAccumulator(max_size=1000)
+        for start in range(0, 20000, 1000):
+            acc.update(vals[start:start + 1000], wgts[start:start + 1000])
+        self.assertLessEqual(len(acc.values), 1000)
+        npt.assert_allclose(acc.quantile([0.25, 0.5, 0.75]), wtd_quantile(vals, wgts, [0.25, 0.5, 0.75]), atol=5)
+        # Bins are represented by values from the data
+        self.assertTrue(np.all(np.isin(acc.values, vals)))
+
+    def test_wtd_quantile_accumulator_repeated_values(self):
+        # Only 20 distinct values, which fit in max_size once the repeats are combined
+        rng = np.random.default_rng(7)
+        vals = rng.integers(0, 20, 5000)
+        wgts = rng.random(5000)
+        acc = WtdQuantileAccumulator(max_size=64)
+        for start in range(0, 5000, 500):
+            acc.update(vals[start:start + 500], wgts[start:start + 500])
+        unique_vals, inverse = np.unique(vals, return_inverse=True)
+        total_wgts = np.bincount(inverse, weights=wgts)
+        npt.assert_array_equal(acc.values, unique_vals)
+        npt.assert_allclose(acc.weights, total_wgts)
+        qs = [0.1, 0.25, 0.5, 0.75, 0.9]
+        npt.assert_allclose(acc.quantile(qs), wtd_quantile(unique_vals, total_wgts, qs))
+        self.assertAlmostEqual(acc.median(), wtd_median(unique_vals, total_wgts))